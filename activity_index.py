@@ -0,0 +1,94 @@
+from datetime import timedelta
+from .log_reader import open_log
+from .timeframe_index import TimeframeIndex, get_file_key
+from .timestamps import TIMESTAMP_BYTES_PATTERN, parse_timestamp
+
+MINUTE_FORMAT = "%Y-%m-%d %H:%M"
+MINUTE_SIZE = len("2015-04-08 12:34")
+ERROR_MARKER = b"ERROR"
+TRACEBACK_MARKER = b"Traceback"
+COUNTERS = ("records", "errors", "tracebacks")
+# 2: the minutes are kept sparsely
+ACTIVITY_INDEX_VERSION = 2
+
+
+class Activity(object):
+    """
+    records, ERROR records and tracebacks per minute, kept only for the minutes that have records, so a bogus
+    timestamp (a clock reset to 1970, a line from the far future) costs one more minute and not a dense span of
+    millions of them
+    """
+    def __init__(self, minutes=None):
+        self.minutes = dict() if minutes is None else minutes  # minute -> [records, errors, tracebacks]
+
+    @property
+    def start(self):
+        return min(self.minutes)
+
+    def count(self, minute, counts):
+        """ adds the [records, errors, tracebacks] counts of minute """
+        total = self.minutes.setdefault(minute, [0] * len(COUNTERS))
+        for index, count in enumerate(counts):
+            total[index] += count
+
+    def add(self, other):
+        """ adds the counts of other into this one """
+        for minute, counts in other.minutes.items():
+            self.count(minute, counts)
+
+
+def bin_file(filepath):
+    """ streams the log file once, counting its records per minute. :returns: Activity, or None if it has none """
+    minutes = dict()  # minute bytes -> [records, errors, tracebacks]
+    current = None
+    with open_log(filepath) as fd:
+        for line in fd:
+            if line[:1].isdigit():
+                # records start with their timestamp, so the minute is usually a prefix seen before
+                counts = minutes.get(line[:MINUTE_SIZE])
+                if counts is None:
+                    match = TIMESTAMP_BYTES_PATTERN.search(line)
+                    if match is not None:
+                        counts = minutes.setdefault(match.group()[:MINUTE_SIZE], [0, 0, 0])
+                if counts is not None:
+                    current = counts
+                    counts[0] += 1
+                    if ERROR_MARKER in line:
+                        counts[1] += 1
+                    continue
+            if current is not None and line.startswith(TRACEBACK_MARKER):
+                current[2] += 1
+    if not minutes:
+        return None
+    activity = Activity()
+    for minute, counts in minutes.items():  # differently formatted timestamps may be the same minute
+        activity.count(parse_timestamp(minute.decode("ascii") + ":00"), counts)
+    return activity
+
+
+class ActivityIndex(TimeframeIndex):
+    """
+    On-disk cache of the per-minute activity of every file in a log directory, kept like the timeframes.
+    Each entry has the first minute of the file, and [minutes since the first one, records, errors, tracebacks]
+    of each minute that has records
+    """
+    version = ACTIVITY_INDEX_VERSION
+
+    def get(self, filepath, scan=bin_file):
+        """:returns: the Activity of filepath (or None), calling scan(filepath) only if the cached entry is stale"""
+        key = get_file_key(filepath)
+        entry = self.entries.get(filepath)
+        if entry is None or entry["key"] != key:
+            activity = scan(filepath)
+            entry = dict(key=key)
+            if activity is not None:
+                start = activity.start
+                entry["start"] = start.strftime(MINUTE_FORMAT)
+                entry["minutes"] = [[int((minute - start).total_seconds() // 60)] + counts
+                                    for minute, counts in sorted(activity.minutes.items())]
+            self.entries[filepath] = entry
+            self.dirty = True
+        if "start" not in entry:
+            return None
+        start = parse_timestamp(entry["start"] + ":00")
+        return Activity(dict((start + timedelta(minutes=offset), counts) for offset, *counts in entry["minutes"]))
@@ -0,0 +1,122 @@
+import sublime, sublime_plugin
+from datetime import timedelta
+from os import path
+from .activity_index import ActivityIndex, Activity
+from .background import run_in_background
+from .diagnostics import get_active_filepath, get_file_prefix, get_file_series, get_index_dir, \
+    goto_timestamp_in_background
+from .results_view import new_results_view, append_to_results_view
+from .timeframe_index import get_index_path
+from .timestamps import parse_timestamp
+
+SPARKS = u" ▁▂▃▄▅▆▇█"
+MINUTES_PER_ROW = 60
+LABEL_WIDTH = len("2015-04-08 12:00 records ")
+
+
+def get_activity_index(dirname):
+    return ActivityIndex(get_index_path(get_index_dir(), dirname, suffix=".activity.json"))
+
+
+def get_files_activity(files, task=None):
+    """ the activity of all the files together, scanning only the files that aren't in the cache yet """
+    indexes = dict()
+    total = Activity()
+    try:
+        for count, filepath in enumerate(files):
+            if task is not None:
+                task.progress("Counting log records [{}/{}]".format(count + 1, len(files)))
+            dirname = path.dirname(filepath)
+            if dirname not in indexes:
+                indexes[dirname] = get_activity_index(dirname)
+            try:
+                activity = indexes[dirname].get(filepath)
+            except (IOError, OSError, ValueError):  # bad file
+                continue
+            if activity is not None:
+                total.add(activity)
+    finally:  # even if cancelled, keep what was counted so far
+        for index in indexes.values():
+            index.prune()
+            try:
+                index.save()
+            except (IOError, OSError):  # the index is only a cache, we can live without it
+                pass
+    return total if total.minutes else None
+
+
+def sparkline(counts, peak):
+    return u"".join(SPARKS[-(-count * (len(SPARKS) - 1) // peak)] if count else SPARKS[0] for count in counts)
+
+
+def render_activity(prefix, files, activity):
+    """
+    one pair of rows (records, errors) per hour, one character per minute. only the hours that have records are
+    laid out, with a line telling how many hours are skipped between them
+    """
+    if activity is None:
+        return u"No log records found in {}\n".format(prefix)
+    minutes = activity.minutes
+    peak_minute = max(minutes, key=lambda minute: minutes[minute][0])
+    peak_errors_minute = max(minutes, key=lambda minute: minutes[minute][1])
+    lines = [u"Activity of {} ({} files), one row per hour, one character per minute".format(prefix, len(files)),
+             u"peak: {} records/minute at {:%Y-%m-%d %H:%M}, {} errors/minute at {:%Y-%m-%d %H:%M}".format(
+                 minutes[peak_minute][0], peak_minute, minutes[peak_errors_minute][1], peak_errors_minute),
+             u"{} tracebacks. Use Infinidat: Goto Minute in Activity Overview to jump to the minute under the "
+             u"cursor".format(sum(counts[2] for counts in minutes.values())),
+             u""]
+    peak, peak_errors = minutes[peak_minute][0] or 1, minutes[peak_errors_minute][1] or 1
+    hours = dict()  # hour -> (records, errors) of each of its minutes
+    for minute, counts in minutes.items():
+        hour = minute.replace(minute=0)
+        if hour not in hours:
+            hours[hour] = ([0] * MINUTES_PER_ROW, [0] * MINUTES_PER_ROW)
+        hours[hour][0][minute.minute] += counts[0]
+        hours[hour][1][minute.minute] += counts[1]
+    previous = None
+    for hour in sorted(hours):
+        if previous is not None and hour - previous > timedelta(hours=1):
+            lines.append(u"... {} hours without records".format(int((hour - previous).total_seconds() // 3600) - 1))
+        row_records, row_errors = hours[hour]
+        lines.append(u"{:%Y-%m-%d %H:00} records |{}| {}".format(hour, sparkline(row_records, peak), sum(row_records)))
+        lines.append(u"{} errors  |{}| {}".format(
+            u" " * len("2015-04-08 12:00"), sparkline(row_errors, peak_errors), sum(row_errors)))
+        previous = hour
+    return u"\n".join(lines) + u"\n"
+
+
+class ActivityOverview(sublime_plugin.WindowCommand):
+    def run(self):
+        prefix = get_file_prefix(get_active_filepath(self.window))
+        files = get_file_series(prefix)
+        view = new_results_view(self.window, "activity {}".format(path.basename(prefix)))
+        view.settings().set("infinidat_activity_files", files)
+
+        def build(task):
+            activity = get_files_activity(files, task)
+            append_to_results_view(view, render_activity(prefix, files, activity), wait=True)
+
+        run_in_background(("activity", view.id()), view, build, cancel_on_close=True)
+
+
+class GotoActivityMinute(sublime_plugin.TextCommand):
+    """ in an activity overview, jumps to the minute under the cursor in the log files """
+    def run(self, edit):
+        files = self.view.settings().get("infinidat_activity_files")
+        if not files:
+            sublime.status_message("not an activity overview")
+            return
+        row, column = self.view.rowcol(self.view.sel()[0].begin())
+        line = self.view.substr(self.view.line(self.view.text_point(row, 0)))
+        if line[:1] == u" ":  # the errors row belongs to the hour of the records row above it
+            line = self.view.substr(self.view.line(self.view.text_point(row - 1, 0)))
+        minute = column - LABEL_WIDTH - 1
+        try:
+            hour = parse_timestamp(line[:len("2015-04-08 12:00")] + ":00")
+        except ValueError:
+            hour = None
+        if hour is None or not 0 <= minute < MINUTES_PER_ROW:
+            sublime.status_message("place the cursor on a minute of the overview")
+            return
+        goto_timestamp_in_background(self.view.window(), files, hour + timedelta(minutes=minute),
+                                     "this type of files")
@@ -0,0 +1,87 @@
+import sublime, sublime_plugin
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+# the shared worker pool of all the file scanning done by the plugin, so it never runs on the UI thread
+EXECUTOR = ThreadPoolExecutor(max_workers=4)
+# the worker pool of bulk work (walking the path index roots, grepping and indexing whole bundles), so it never
+# keeps the interactive work (opening files, jumping to a timestamp) waiting
+BULK_EXECUTOR = ThreadPoolExecutor(max_workers=2)
+STATUS_KEY = "infinidat"
+# view id -> keys of the tasks that write into that view, and should stop when it's closed
+VIEW_TASKS = dict()
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Task(object):
+    """
+    A unit of background work. Starting a task with the same key as a running one supersedes it:
+    the older task is cancelled the next time it checks in (see progress and check)
+    """
+    _lock = threading.Lock()
+    _latest = dict()
+
+    def __init__(self, key, view=None):
+        self.key = key
+        self.view = view
+        with Task._lock:
+            Task._latest[key] = self
+
+    @property
+    def cancelled(self):
+        return Task._latest.get(self.key) is not self
+
+    def check(self):
+        if self.cancelled:
+            raise Cancelled()
+
+    def progress(self, message):
+        """ shows the message in the status bar, and raises Cancelled if this task was superseded """
+        self.check()
+        if self.view is not None:
+            sublime.set_timeout(lambda: self.view.set_status(STATUS_KEY, message), 0)
+
+    def finish(self):
+        if self.view is not None and not self.cancelled:  # a newer task owns the status bar now
+            sublime.set_timeout(lambda: self.view.erase_status(STATUS_KEY), 0)
+
+
+def cancel(key):
+    with Task._lock:
+        Task._latest[key] = None
+
+
+class CancelOnCloseListener(sublime_plugin.EventListener):
+    def on_close(self, view):
+        for key in VIEW_TASKS.pop(view.id(), []):
+            cancel(key)
+
+
+def run_in_background(key, view, work, on_done=None, cancel_on_close=False, bulk=False):
+    """
+    Runs work(task) on the shared executor (or the bulk one), then on_done(result) on the UI thread, unless the task
+    was superseded by a newer task with the same key in the meantime (or its view was closed, with cancel_on_close)
+    """
+    task = Task(key, view)
+    if cancel_on_close:
+        VIEW_TASKS.setdefault(view.id(), []).append(key)
+
+    def run():
+        try:
+            result = work(task)
+        except Cancelled:
+            return
+        except Exception:
+            traceback.print_exc()
+            return
+        finally:
+            task.finish()
+        if on_done is not None:
+            sublime.set_timeout(lambda: None if task.cancelled else on_done(result), 0)
+
+    (BULK_EXECUTOR if bulk else EXECUTOR).submit(run)
+    return task
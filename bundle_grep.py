@@ -0,0 +1,91 @@
+import sublime, sublime_plugin
+import heapq
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .background import run_in_background
+from .diagnostics import get_bundle_files, get_files_timeframes, strptime
+from .grep_engine import compile_pattern, iter_file_chunks, iter_matches
+from .results_view import new_results_view, append_to_results_view, format_result
+from .timestamps import TIMESTAMP_PATTERN
+
+
+def iter_checked(chunks, task):
+    """ the chunks, raising Cancelled between them once the task was superseded """
+    for chunk in chunks:
+        task.check()
+        yield chunk
+
+
+def grep_file(filepath, pattern, default_timestamp, task=None):
+    """:returns: the matches in the file as sorted (timestamp, filepath, line number, line) tuples"""
+    hits = []
+    chunks = iter_file_chunks(filepath)
+    if task is not None:
+        chunks = iter_checked(chunks, task)
+    for line_number, line, record_line in iter_matches(chunks, pattern):
+        match = TIMESTAMP_PATTERN.search(record_line)
+        try:
+            timestamp = strptime(match.group()) if match else default_timestamp
+        except ValueError:
+            timestamp = default_timestamp
+        hits.append((timestamp, filepath, line_number, line))
+    hits.sort()
+    return hits
+
+
+def grep_files(files, pattern, on_results, max_workers, task=None):
+    """
+    Greps the files concurrently, calling on_results with chunks of result lines in timestamp order.
+    Results are passed on as soon as no file that is still being searched can have an earlier match
+    :param files: timeframes as returned by get_files_timeframes
+    """
+    pending = []
+    unfinished = dict((item['filepath'], item['start']) for item in files)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = dict((executor.submit(grep_file, item['filepath'], pattern, item['start'], task), item['filepath'])
+                       for item in files)
+        try:
+            for count, future in enumerate(as_completed(futures)):
+                if task is not None:
+                    task.progress("Searched {}/{} files".format(count + 1, len(futures)))
+                del unfinished[futures[future]]
+                for hit in future.result():
+                    heapq.heappush(pending, hit)
+                watermark = min(unfinished.values()) if unfinished else None
+                results = []
+                while pending and (watermark is None or pending[0][0] < watermark):
+                    _, filepath, line_number, line = heapq.heappop(pending)
+                    results.append(format_result(filepath, line_number, line))
+                on_results("".join(results))
+        except BaseException:
+            # leaving the executor waits for its futures: drop the queued files, the running ones stop at their
+            # next chunk once the task is cancelled
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def get_max_workers():
+    settings = sublime.load_settings("Infinidat.sublime-settings")
+    return settings.get("grep-workers", 4)
+
+
+class GrepDiagnostics(sublime_plugin.WindowCommand):
+    def run(self):
+        view = self.window.active_view()
+        selection = view.substr(view.sel()[0]) if len(view.sel()) else ""
+        self.window.show_input_panel("Grep diagnostics for", selection, self.on_done, None, None)
+
+    def on_done(self, text):
+        if not text:
+            return
+        files = get_bundle_files(self.window)
+        results_view = new_results_view(self.window, "grep diagnostics {!r}".format(text))
+        pattern = compile_pattern(text)
+
+        def search(task):
+            timeframes = get_files_timeframes(files, task)
+            grep_files(timeframes, pattern, lambda contents: append_to_results_view(results_view, contents),
+                       get_max_workers(), task)
+
+        run_in_background(("grep_diagnostics", results_view.id()), results_view, search, cancel_on_close=True,
+                          bulk=True)
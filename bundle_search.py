@@ -0,0 +1,76 @@
+import sublime, sublime_plugin
+from os import path
+from .background import run_in_background
+from .diagnostics import get_active_filepath, get_file_prefix, get_index_dir
+from .results_view import new_results_view, append_to_results_view, format_result
+from .timeframe_index import get_index_path
+from .trigram_index import TrigramIndex, get_bundle_series
+
+BATCH_SIZE = 1000
+
+
+def get_bundle_roots(window):
+    """ the "bundle-index-roots" setting, or the diagnostics directory of the active file """
+    roots = sublime.load_settings("Infinidat.sublime-settings").get("bundle-index-roots")
+    if roots:
+        return [path.expanduser(root) for root in roots]
+    filepath = get_active_filepath(window)
+    if not filepath:
+        return []
+    parts = get_file_prefix(filepath).rsplit(path.sep, 7)
+    return [parts[0]] if len(parts) == 8 else []
+
+
+def get_trigram_index(root):
+    """ the indexes are kept in "bundle-index-dir", if set (e.g. next to the bundles, built offline) """
+    index_dir = sublime.load_settings("Infinidat.sublime-settings").get("bundle-index-dir") or get_index_dir()
+    return TrigramIndex(get_index_path(path.expanduser(index_dir), root, suffix=".trigrams"))
+
+
+class UpdateBundleIndex(sublime_plugin.WindowCommand):
+    """ indexes the bundle logs that are new or changed since the last update """
+    def run(self):
+        roots = get_bundle_roots(self.window)
+        if not roots:
+            sublime.status_message("set bundle-index-roots, or open a log file of a diagnostics bundle")
+            return
+        view = self.window.active_view()
+
+        def update(task):
+            for root in roots:
+                get_trigram_index(root).update(get_bundle_series(root), task)
+            sublime.set_timeout(lambda: sublime.status_message("Bundle index is up to date"), 0)
+
+        run_in_background(("update_bundle_index", self.window.id()), view, update, bulk=True)
+
+
+class SearchBundles(sublime_plugin.WindowCommand):
+    """ finds the lines containing a text in all the indexed bundles, reading only the blocks that may have it """
+    def run(self):
+        view = self.window.active_view()
+        selection = view.substr(view.sel()[0]) if view is not None and len(view.sel()) else ""
+        self.window.show_input_panel("Search bundles for", selection, self.on_done, None, None)
+
+    def on_done(self, text):
+        roots = get_bundle_roots(self.window)
+        if not text or not roots:
+            return
+        results_view = new_results_view(self.window, "search bundles {!r}".format(text))
+
+        def search(task):
+            results, unindexed = [], 0
+            for root in roots:
+                index = get_trigram_index(root)
+                unindexed += len(index.get_unindexed(get_bundle_series(root)))
+                for filepath, _, line_number, line in index.search(text, task):
+                    results.append(format_result(filepath, line_number, line))
+                    if len(results) >= BATCH_SIZE:
+                        append_to_results_view(results_view, "".join(results), wait=True)
+                        results = []
+            append_to_results_view(results_view, "".join(results), wait=True)
+            if unindexed:
+                append_to_results_view(results_view, "{} files are new or changed since they were indexed, run "
+                                                     "Infinidat: Update Bundle Index\n".format(unindexed))
+
+        run_in_background(("search_bundles", results_view.id()), results_view, search, cancel_on_close=True,
+                          bulk=True)
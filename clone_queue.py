@@ -0,0 +1,171 @@
+import os
+import time
+import shutil
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED, CLONING, RETRYING, DONE, FAILED = "queued", "cloning", "retrying", "done", "failed"
+RETRY_DELAY = 5
+
+
+def get_repo_dirname(url):
+    """ the directory a clone of url ends up in, like git does it: git@host:group/repo.git -> repo """
+    name = url.rstrip("/").replace(":", "/").split("/")[-1]
+    return name[:-len(".git")] if name.endswith(".git") else name
+
+
+def get_directory_size(dirpath):
+    total = 0
+    for root, dirs, files in os.walk(dirpath):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class CloneJob(object):
+    def __init__(self, name, url, destination):
+        self.name = name
+        self.url = url
+        self.destination = destination
+        self.target = os.path.join(destination, get_repo_dirname(url))
+        self.state = QUEUED
+        self.attempts = 0
+        self.error = None
+        self.size = 0
+        self.duration = 0
+
+
+class CloneOptions(object):
+    """
+    how to clone: with projector (the default), or, to save network and disk, with a shallow git clone (depth)
+    and/or borrowing the objects of an existing clone of the same repository under reference_dir
+    """
+    def __init__(self, projector_path, git_path="git", depth=None, reference_dir=None):
+        self.projector_path = projector_path
+        self.git_path = git_path
+        self.depth = depth
+        self.reference_dir = reference_dir
+
+    def get_command(self, job):
+        """:returns: (argv, cwd) that clone the job's repository into its target"""
+        if not self.depth and not self.reference_dir:
+            return [self.projector_path, "repository", "clone", job.url], job.destination
+        argv = [self.git_path, "clone"]
+        if self.depth:
+            argv += ["--depth", str(self.depth), "--no-single-branch"]
+        if self.reference_dir:
+            reference = os.path.join(os.path.expanduser(self.reference_dir), get_repo_dirname(job.url))
+            if os.path.isdir(reference):
+                argv += ["--reference", reference, "--dissociate"]
+        return argv + [job.url, job.target], job.destination
+
+
+class CloneQueue(object):
+    """
+    Clones repositories on a bounded pool of workers, retrying failed clones.
+    on_update(queue, job) is called from the worker threads whenever the state of a job changes
+    """
+    def __init__(self, options, max_workers=4, retries=2, on_update=None):
+        self.options = options
+        self.retries = retries
+        self.on_update = on_update
+        self.jobs = []
+        self.started = None
+        self._reported = True
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+
+    def add(self, name, url, destination):
+        job = CloneJob(name, url, destination)
+        with self._lock:
+            if self.started is None or self.is_idle():
+                # a new batch: forget the finished jobs, so the counters and the throughput are about this batch
+                self.jobs = []
+                self.started = time.time()
+                self._reported = False
+            # repositories of different groups may have the same name (group1/utils, group2/utils): only the first
+            # one gets the target directory, a failing clone of the other one must never touch it
+            duplicate = any(other.target == job.target and other.state != FAILED for other in self.jobs)
+            if duplicate:
+                job.state, job.error = FAILED, "another repository is being cloned into {}".format(job.target)
+            self.jobs.append(job)
+        if not duplicate:
+            self._executor.submit(self._run, job)
+        self._notify(job)
+        return job
+
+    def is_idle(self):
+        return all(job.state in (DONE, FAILED) for job in self.jobs)
+
+    def take_finished_batch(self):
+        """:returns: the jobs of the batch once all of them finished (exactly once per batch), otherwise None"""
+        with self._lock:
+            if self._reported or not self.is_idle():
+                return None
+            self._reported = True
+            return list(self.jobs)
+
+    def _notify(self, job):
+        if self.on_update is not None:
+            self.on_update(self, job)
+
+    def _run(self, job):
+        while True:
+            if os.path.exists(job.target):  # the user's own directory, or a clone that failed to be removed
+                job.state, job.error = FAILED, "{} already exists".format(job.target)
+                break
+            job.attempts += 1
+            job.state = CLONING if job.attempts == 1 else RETRYING
+            self._notify(job)
+            start = time.time()
+            job.error = self._clone(job)
+            job.duration = time.time() - start
+            if job.error is None:
+                job.size = get_directory_size(job.target)
+                job.state = DONE
+                break
+            # don't leave a partial clone behind, the next attempt (or a manual clone) would fail on it.
+            # the target didn't exist before the clone, so whatever is there now was created by it
+            shutil.rmtree(job.target, ignore_errors=True)
+            if job.attempts > self.retries:
+                job.state = FAILED
+                break
+            time.sleep(RETRY_DELAY * job.attempts)
+        self._notify(job)
+
+    def _clone(self, job):
+        """:returns: None on success, the error otherwise"""
+        argv, cwd = self.options.get_command(job)
+        env = dict(os.environ, GIT_TERMINAL_PROMPT="0")  # fail instead of waiting for a password nobody will type
+        try:
+            proc = subprocess.Popen(argv, cwd=cwd, env=env, stdin=subprocess.DEVNULL,
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        except OSError as error:
+            return str(error)
+        output = proc.communicate()[0]
+        if proc.returncode != 0:
+            lines = output.decode("utf-8", "replace").strip().splitlines()
+            return "failed with code {}{}".format(proc.returncode, ": " + lines[-1] if lines else "")
+        return None
+
+    def get_summary(self):
+        """ e.g. 'Cloning 12/20 repositories (3 running, 1 failed), 4.2 MB/s' """
+        with self._lock:
+            jobs = list(self.jobs)
+        counts = dict()
+        for job in jobs:
+            counts[job.state] = counts.get(job.state, 0) + 1
+        finished = counts.get(DONE, 0) + counts.get(FAILED, 0)
+        running = counts.get(CLONING, 0) + counts.get(RETRYING, 0)
+        elapsed = max(time.time() - self.started, 0.001) if self.started is not None else 0.001
+        throughput = sum(job.size for job in jobs if job.state == DONE) / elapsed / (1024 * 1024)
+        details = ["{} running".format(running)] if running else []
+        if counts.get(FAILED):
+            details.append("{} failed".format(counts[FAILED]))
+        return "{} {}/{} repositories{}, {:.1f} MB/s".format(
+            "Cloned" if finished == len(jobs) else "Cloning", finished, len(jobs),
+            " ({})".format(", ".join(details)) if details else "", throughput)
@@ -1,29 +1,27 @@
 
 import sublime, sublime_plugin
-from glob import glob
-from os import path, pardir
+from os import path, pardir, makedirs, rename, listdir, remove, stat, utime
+from shutil import copyfileobj
+import hashlib
 from time import sleep
 from datetime import datetime, timedelta
 from re import search, finditer, escape
 from itertools import product
 from datetime import datetime
 from functools import wraps
+from bisect import bisect_right
+from .timeframe_index import TimeframeIndex, get_index_path
+from .timestamps import TIMESTAMP_FORMAT, TIMESTAMP_PATTERN, TIMESTAMP_BYTES_PATTERN, parse_timestamp
+from .timestamps import parse_datestring as parse_user_datestring
+from .background import run_in_background
+from .log_reader import find_timestamp_offset, get_timeframe, open_log, get_compression_suffix, \
+    strip_compression_suffix, get_file_prefix, get_file_series
 
-STRPTIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
-DATE_FORMATS = [
-                "%d/%m/%y", "%d/%m/%Y", "%d-%m-%y", "%d-%m-%Y",
-                "%m/%d/%y", "%m/%d/%Y", "%m-%d-%y", "%m-%d-%Y",
-                "%d/%m/%y %H:%M:%S", "%d/%m/%Y %H:%M:%S", "%d-%m-%y %H:%M:%S", "%d-%m-%Y %H:%M:%S",
-                "%m/%d/%y %H:%M:%S", "%m/%d/%Y %H:%M:%S", "%m-%d-%y %H:%M:%S", "%m-%d-%Y %H:%M:%S",
-                "%d/%m/%y-%H-%M-%S", "%m/%d/%y-%H-%M-%S",
-                "%d/%m/%y %H:%M", "%d/%m/%Y %H:%M", "%d-%m-%y %H:%M", "%d-%m-%Y %H:%M",
-                "%m/%d/%y %H:%M", "%m/%d/%Y %H:%M", "%m-%d-%y %H:%M", "%m-%d-%Y %H:%M",
-                "%H:%M:%S", "%H:%M",
-                "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M"]
+STRPTIME_FORMAT = TIMESTAMP_FORMAT
 
 
 def strptime(datestring):
-    return datetime.strptime(datestring, STRPTIME_FORMAT)
+    return parse_timestamp(datestring)
 
 
 def strftime(datetime_object, dateformat=STRPTIME_FORMAT):
@@ -31,53 +29,54 @@ def strftime(datetime_object, dateformat=STRPTIME_FORMAT):
 
 
 def parse_datestring(datestring):
-    from argparse import ArgumentTypeError
-    from datetime import datetime
-    for format in DATE_FORMATS:
-        try:
-            return datetime.strptime(datestring, format)
-        except:
-            pass
-    sublime.error_message("Invalid datetime string: {!r}".format(datestring))
-
+    result = parse_user_datestring(datestring)
+    if result is None:
+        sublime.error_message("Invalid datetime string: {!r}".format(datestring))
+    return result
 
-def get_file_prefix(filepath):
-    if filepath[-1].isdigit():
-        return filepath.rsplit('.', 1)[0]
-    return filepath
 
-
-def get_file_series(prefix):
-    return sorted(glob(prefix + "*"))
+def get_active_filepath(window):
+    """:returns: the path of the file in the active view, or of the compressed file it was decompressed from"""
+    view = window.active_view()
+    return view.settings().get("infinidat_source_path") or view.file_name()
 
 
 def get_datetime_from_current_line(window):
     view = window.active_view()
     line = view.substr(view.line(view.sel()[0]))
-    datestring = search("[\d-]+ [\d.:]+", line).group()
+    datestring = TIMESTAMP_PATTERN.search(line).group()
     return strptime(datestring)
 
 
 def get_traces(window):
-    filepath = window.active_view().file_name()
+    filepath = get_active_filepath(window)
     dirname = path.dirname(filepath)
     return get_file_series(path.join(dirname, "izbox-traces.log"))
 
 
 def get_logs(window):
-    filepath = window.active_view().file_name()
+    filepath = get_active_filepath(window)
     dirname = path.dirname(filepath)
     return get_file_series(path.join(dirname, "izbox.log"))
 
 
 def get_files_of_other_node(window):
-    filepath = window.active_view().file_name()
+    filepath = get_active_filepath(window)
     prefix = get_file_prefix(filepath)
     diagnostics_dir, hostname, timestamp, files, var, log, dirname, basename = prefix.rsplit(path.sep, 7)
     other_hostname = hostname[:-1] + ("1" if hostname[-1] == "2" else "2")
     return get_file_series(path.join(diagnostics_dir, other_hostname, "*", files, var, log, "*", basename))
 
 
+def get_bundle_files(window):
+    """:returns: the izbox logs and traces of both nodes, in all the timestamp directories of the bundle"""
+    filepath = get_active_filepath(window)
+    prefix = get_file_prefix(filepath)
+    diagnostics_dir, hostname, timestamp, files, var, log, dirname, basename = prefix.rsplit(path.sep, 7)
+    hostnames = hostname[:-1] + "[12]"
+    return get_file_series(path.join(diagnostics_dir, hostnames, "*", files, var, log, "*", "izbox"))
+
+
 def pairwise(iterable):
     from itertools import tee, izip
     "s -> (s0,s1), (s1,s2), (s2, s3), ..."
@@ -87,26 +86,58 @@ def pairwise(iterable):
 
 
 def get_timeframe_in_file(filepath):
-    with open(filepath, 'rb+') as fd:
-        start = fd.read(32768).decode("ascii")
-        fd.seek(-32769, 2)
-        finish = fd.read().decode("ascii")
-    first, last = search("[\d-]+ [\d.:]+", start).group(), list(finditer("[\d-]+ [\d.:]+", finish))[-1].group()
-    return strptime(first), strptime(last)
+    timeframe = get_timeframe(filepath)
+    if timeframe is None:
+        raise ValueError("no timestamps in {}".format(filepath))
+    return timeframe
+
+
+def get_index_dir():
+    return path.join(sublime.cache_path(), "Infinidat")
+
 
+def get_timeframe_index(dirname):
+    return TimeframeIndex(get_index_path(get_index_dir(), dirname))
+
+
+def get_files_timeframes(files, task=None):
+    """
+    :param task: a background.Task to report progress to (and to be cancelled through)
+    :returns: from oldest to newest
+    """
+    indexes = dict()
 
-def get_files_timeframes(files):
-    """:returns: from oldest to newest"""
     def generator():
-        for filepath in files:
+        for count, filepath in enumerate(files):
+            if task is not None:
+                task.progress("Scanning log files [{}/{}]".format(count + 1, len(files)))
+            dirname = path.dirname(filepath)
+            if dirname not in indexes:
+                indexes[dirname] = get_timeframe_index(dirname)
             try:
-                start, finish = get_timeframe_in_file(filepath)
+                start, finish = indexes[dirname].get(filepath, get_timeframe_in_file)
                 yield dict(start=start, finish=finish, filepath=filepath)
             except:  # bad file
                 pass
     def key(item):
         return item['start']
-    return sorted(generator(), key=key)
+    try:
+        return sorted(generator(), key=key)
+    finally:  # even if cancelled, keep what was scanned so far
+        for index in indexes.values():
+            index.prune()
+            try:
+                index.save()
+            except (IOError, OSError):  # the index is only a cache, we can live without it
+                pass
+
+
+def find_file_containing_timestamp(files, t0):
+    """:param files: timeframes as returned by get_files_timeframes"""
+    index = bisect_right([item['start'] for item in files], t0) - 1
+    if index < 0 or files[index]['finish'] < t0:
+        return None
+    return files[index]['filepath']
 
 
 def show_timestamp_as_close_as_possible(view, t0):
@@ -121,16 +152,105 @@ def show_timestamp_as_close_as_possible(view, t0):
         return
 
 
+def show_offset(view, offset, datestring):
+    """
+    show the record found on disk at the byte offset. For ascii files the byte offset is also the point in the view,
+    otherwise fall back to a single search for the exact timestamp
+    """
+    location = sublime.Region(offset, offset + len(datestring))
+    if view.substr(location) != datestring:
+        location = view.find(datestring, 0, sublime.LITERAL)
+        if location.a == -1:
+            return False
+    view.show_at_center(location)
+    view.sel().clear()
+    view.sel().add(location)
+    return True
+
+
+def get_timestamp_offset_in_file(filepath, t0):
+    """:returns: (byte offset, datestring) of the timestamp of the record closest to t0, or None"""
+    try:
+        with open_log(filepath) as fd:
+            record = find_timestamp_offset(fd, t0)
+    except (IOError, OSError):
+        return None
+    if record is None:
+        return None
+    offset, _, line = record
+    match = TIMESTAMP_BYTES_PATTERN.search(line)
+    return offset + match.start(), match.group().decode("ascii")
+
+
+def get_decompressed_copy(filepath):
+    """
+    sublime can't open compressed files, so we decompress them once into the cache directory.
+    the offsets of the copy are the same as the ones open_log gives for the compressed file
+    """
+    digest = hashlib.sha1(path.abspath(filepath).encode("utf-8")).hexdigest()[:12]
+    decompressed_path = path.join(get_index_dir(), "decompressed",
+                                  digest + "-" + path.basename(strip_compression_suffix(filepath)))
+    if path.exists(decompressed_path) and path.getmtime(decompressed_path) >= path.getmtime(filepath):
+        utime(decompressed_path, None)  # the copies are evicted least recently used first
+        return decompressed_path
+    if not path.isdir(path.dirname(decompressed_path)):
+        makedirs(path.dirname(decompressed_path))
+    with open_log(filepath) as source, open(decompressed_path + ".tmp", 'wb') as destination:
+        copyfileobj(source, destination, 1024 * 1024)
+    rename(decompressed_path + ".tmp", decompressed_path)
+    evict_decompressed_copies(path.dirname(decompressed_path), decompressed_path)
+    return decompressed_path
+
+
+def evict_decompressed_copies(dirname, keep):
+    """ removes the least recently used copies once they take more than "decompressed-cache-max-mb", except keep """
+    max_size = sublime.load_settings("Infinidat.sublime-settings").get("decompressed-cache-max-mb", 4096) * 1024 * 1024
+    copies = []
+    for name in listdir(dirname):
+        if name.endswith(".tmp"):  # still being written
+            continue
+        try:
+            info = stat(path.join(dirname, name))
+        except OSError:
+            continue
+        copies.append((info.st_mtime, info.st_size, path.join(dirname, name)))
+    total = sum(size for _, size, _ in copies)
+    for _, size, filepath in sorted(copies):
+        if total <= max_size:
+            break
+        if filepath == keep:
+            continue
+        try:
+            remove(filepath)
+            total -= size
+        except OSError:
+            pass
+
+
+# view id -> callbacks to call once sublime has finished loading the file
+PENDING_LOAD_CALLBACKS = dict()
+
+
 def open_file_and_do_something_with_it(window, filepath, callback):
+    source_path = None
+    if get_compression_suffix(filepath):
+        source_path, filepath = filepath, get_decompressed_copy(filepath)
     view = window.open_file(filepath)
+    if source_path:
+        view.settings().set("infinidat_source_path", source_path)
+    if view.is_loading():
+        PENDING_LOAD_CALLBACKS.setdefault(view.id(), []).append(callback)
+    else:
+        callback(view)
 
-    def _callback():
-        if view.is_loading():
-            sublime.set_timeout(_callback, 1)
-        else:
+
+class OpenFileListener(sublime_plugin.EventListener):
+    def on_load(self, view):
+        for callback in PENDING_LOAD_CALLBACKS.pop(view.id(), []):
             callback(view)
 
-    _callback()
+    def on_close(self, view):
+        PENDING_LOAD_CALLBACKS.pop(view.id(), None)
 
 
 def word_wrap_callback(value=False):
@@ -140,31 +260,77 @@ def word_wrap_callback(value=False):
     return callback
 
 
-def goto_timestamp_in_files(window, files, t0, ident):
-    try:
-        [filepath] = [item['filepath'] for item in files if item['start'] <= t0 and t0 <= item['finish']]
-    except ValueError:  # there is no file containing t0
-        sublime.error_message("{} not found in {}".format(t0, ident))
-        return
+def find_timestamp_in_files(files, t0, task=None):
+    """
+    the disk-heavy part of going to a timestamp, safe to run in the background
+    :returns: (filepath, (offset, datestring) or None), or None if there is no file containing t0
+    """
+    filepath = find_file_containing_timestamp(files, t0)
+    if filepath is None:
+        return None
+    if task is not None:
+        task.progress("Searching {} in {}".format(t0, path.basename(filepath)))
+    if get_compression_suffix(filepath):
+        get_decompressed_copy(filepath)  # so that opening it later doesn't block
+    return filepath, get_timestamp_offset_in_file(filepath, t0)
+
 
+def show_timestamp_in_file(window, filepath, found, t0):
     def callback(view):
         word_wrap_callback()(view)
+        if found is not None:
+            offset, datestring = found
+            if show_offset(view, offset, datestring):
+                return
         show_timestamp_as_close_as_possible(view, t0)
 
     open_file_and_do_something_with_it(window, filepath, callback)
 
 
+def goto_timestamp_in_files(window, files, t0, ident):
+    result = find_timestamp_in_files(files, t0)
+    if result is None:  # there is no file containing t0
+        sublime.error_message("{} not found in {}".format(t0, ident))
+        return
+    show_timestamp_in_file(window, result[0], result[1], t0)
+
+
+def goto_timestamp_in_background(window, files, t0, ident):
+    """
+    scans the timeframes of the files and searches for t0 on the shared executor, then jumps there.
+    a newer jump in the same window supersedes this one
+    """
+    def work(task):
+        return find_timestamp_in_files(get_files_timeframes(files, task), t0, task)
+
+    def done(result):
+        if result is None:  # there is no file containing t0
+            sublime.error_message("{} not found in {}".format(t0, ident))
+            return
+        show_timestamp_in_file(window, result[0], result[1], t0)
+
+    run_in_background(("goto", window.id()), window.active_view(), work, done)
+
+
+def scan_in_background(window, files):
+    """
+    warms up the timeframe index while the user is still typing.
+    the jump itself supersedes it, but whatever was scanned until then is kept in the index
+    """
+    run_in_background(("goto", window.id()), window.active_view(), lambda task: get_files_timeframes(files, task))
+
+
 class OpenNextFile(sublime_plugin.WindowCommand):
     def run(self):
-        filepath = self.window.active_view().file_name()
+        filepath = get_active_filepath(self.window)
         series = get_file_series(get_file_prefix(filepath))
         index = (series.index(filepath)+1) % len(series)
-        open_file_and_do_something_with_it(window, series[index], word_wrap_callback())
+        open_file_and_do_something_with_it(self.window, series[index], word_wrap_callback())
 
 
 class OpenPreviousFile(sublime_plugin.WindowCommand):
     def run(self):
-        filepath = self.window.active_view().file_name()
+        filepath = get_active_filepath(self.window)
         series = get_file_series(get_file_prefix(filepath))
         index = (series.index(filepath)-1) % len(series)
         open_file_and_do_something_with_it(self.window, series[index], word_wrap_callback())
@@ -173,40 +339,41 @@ class OpenPreviousFile(sublime_plugin.WindowCommand):
 class GotoTrace(sublime_plugin.WindowCommand):
     def run(self):
         t0 = get_datetime_from_current_line(self.window)
-        files = get_files_timeframes(get_traces(self.window))
-        goto_timestamp_in_files(self.window, files, t0, "traces")
+        goto_timestamp_in_background(self.window, get_traces(self.window), t0, "traces")
 
 
 class GotoLog(sublime_plugin.WindowCommand):
     def run(self):
         t0 = get_datetime_from_current_line(self.window)
-        files = get_files_timeframes(get_logs(self.window))
-        goto_timestamp_in_files(self.window, files, t0, "logs")
+        goto_timestamp_in_background(self.window, get_logs(self.window), t0, "logs")
 
 
 class GotoOtherNode(sublime_plugin.WindowCommand):
     def run(self):
         t0 = get_datetime_from_current_line(self.window)
-        files = get_files_timeframes(get_files_of_other_node(self.window))
-        goto_timestamp_in_files(self.window, files, t0, "other node")
+        goto_timestamp_in_background(self.window, get_files_of_other_node(self.window), t0, "other node")
 
 
 class GotoDate(sublime_plugin.WindowCommand):
     def run(self):
-        filepath = self.window.active_view().file_name()
-        files = get_files_timeframes(get_file_series(get_file_prefix(filepath)))
+        filepath = get_active_filepath(self.window)
+        files = get_file_series(get_file_prefix(filepath))
+        scan_in_background(self.window, files)
 
         def innerfunc(datestring):
             t0 = parse_datestring(datestring)
-            goto_timestamp_in_files(self.window, files, t0, "this type of files")
+            if t0 is None:
+                return
+            goto_timestamp_in_background(self.window, files, t0, "this type of files")
 
         self.window.show_input_panel("Enter timestamp", "", innerfunc, None, None)
 
 
 class GotoTimestamp(sublime_plugin.WindowCommand):
     def run(self):
-        filepath = self.window.active_view().file_name()
-        files = get_files_timeframes(get_file_series(get_file_prefix(filepath)))
+        filepath = get_active_filepath(self.window)
+        files = get_file_series(get_file_prefix(filepath))
+        scan_in_background(self.window, files)
 
         def innerfunc(timestamp_string):
             timestamp = int(timestamp_string)
@@ -214,7 +381,7 @@ class GotoTimestamp(sublime_plugin.WindowCommand):
                 t0 = datetime.utcfromtimestamp(timestamp)
             except ValueError:
                 t0 = datetime.utcfromtimestamp(timestamp/1000)
-            goto_timestamp_in_files(self.window, files, t0, "this type of files")
+            goto_timestamp_in_background(self.window, files, t0, "this type of files")
 
         self.window.show_input_panel("Enter timestamp", "", innerfunc, None, None)
 
@@ -0,0 +1,109 @@
+import re
+from array import array
+from .grep_engine import iter_units
+from .timestamps import TIMESTAMP_PATTERN, parse_timestamp
+
+INCLUDE, EXCLUDE, INCLUDE_REGEX, EXCLUDE_REGEX, TIME_RANGE = "include", "exclude", "include_regex", \
+    "exclude_regex", "time_range"
+FILTER_KINDS = [(INCLUDE, "Include text"), (EXCLUDE, "Exclude text"), (INCLUDE_REGEX, "Include regex"),
+                (EXCLUDE_REGEX, "Exclude regex"), (TIME_RANGE, "Time range (start, finish)")]
+
+
+class Filter(object):
+    """ one predicate of a pipeline, on the text of a line or a log record """
+    def __init__(self, kind, argument, start=None, finish=None):
+        self.kind = kind
+        self.argument = argument
+        self.start = start
+        self.finish = finish
+        if kind in (INCLUDE, EXCLUDE):
+            self._pattern = re.compile(re.escape(argument))
+        elif kind in (INCLUDE_REGEX, EXCLUDE_REGEX):
+            self._pattern = re.compile(argument)
+        self._excludes = kind in (EXCLUDE, EXCLUDE_REGEX)
+
+    @property
+    def key(self):
+        return self.kind, self.argument
+
+    def __str__(self):
+        return "{} {}".format({INCLUDE: "+", EXCLUDE: "-", INCLUDE_REGEX: "+/", EXCLUDE_REGEX: "-/",
+                               TIME_RANGE: "@"}[self.kind], self.argument)
+
+    def matches(self, text):
+        if self.kind == TIME_RANGE:
+            first_line_end = text.find("\n")
+            match = TIMESTAMP_PATTERN.search(text, 0, len(text) if first_line_end == -1 else first_line_end)
+            if match is None:
+                return False
+            timestamp = parse_timestamp(match.group())
+            return (self.start is None or timestamp >= self.start) and \
+                   (self.finish is None or timestamp <= self.finish)
+        return (self._pattern.search(text) is None) == self._excludes
+
+
+def iter_spans(chunks, spans):
+    """
+    yields (offset, text) of the (start, end) spans (flattened and sorted) of the text of the chunks,
+    reading the chunks once and holding at most a chunk and a span in memory
+    """
+    chunks = iter(chunks)
+    buffer, base = "", 0
+    for index in range(0, len(spans), 2):
+        start, end = spans[index], spans[index + 1]
+        while base + len(buffer) < end:
+            chunk = next(chunks, None)
+            if chunk is None:
+                break
+            # drop what the remaining spans don't need, only when the buffer is rebuilt anyway
+            keep = min(max(0, start - base), len(buffer))
+            buffer, base = buffer[keep:] + chunk, base + keep
+        yield start, buffer[start - base:end - base]
+
+
+class FilterPipeline(object):
+    """
+    A stack of filters over a text, evaluated together in a single streaming pass.
+    The spans that survive each prefix of the stack are kept, so after changing the last filters only the
+    surviving spans of the unchanged prefix are read and filtered again
+    """
+    def __init__(self, records=True):
+        self.records = records
+        self.filters = []
+        self._stages = []  # stage i: array of (start, end) of the units that pass filters[:i + 1]
+
+    def set_filters(self, filters):
+        common = 0
+        while common < min(len(filters), len(self.filters), len(self._stages)) and \
+                filters[common].key == self.filters[common].key:
+            common += 1
+        self.filters = list(filters)
+        del self._stages[common:]
+
+    def invalidate(self):
+        """ the source text changed, nothing cached is valid anymore """
+        del self._stages[:]
+
+    def run(self, get_chunks):
+        """
+        :param get_chunks: returns the chunks of the source text (called once)
+        :returns: generator of (source offset, text) of the units that pass all the filters
+        """
+        filters, cached = self.filters, len(self._stages)
+        if cached:
+            units = iter_spans(get_chunks(), self._stages[-1])
+        else:
+            units = iter_units(get_chunks(), self.records)
+        pending = filters[cached:]
+        stages = [array('Q') for _ in pending]
+        for offset, text in units:
+            for predicate, stage in zip(pending, stages):
+                if not predicate.matches(text):
+                    break
+                stage.append(offset)
+                stage.append(offset + len(text))
+            else:
+                yield offset, text
+        # only once the pass completed (a cancelled pass caches nothing), and if the filters weren't changed meanwhile
+        if self.filters is filters and len(self._stages) == cached:
+            self._stages.extend(stages)
@@ -0,0 +1,163 @@
+import sublime, sublime_plugin
+import re
+from array import array
+from bisect import bisect_right
+from .background import run_in_background
+from .filter_pipeline import FILTER_KINDS, TIME_RANGE, Filter, FilterPipeline
+from .grep import iter_view_chunks
+from .results_view import new_results_view, append_to_results_view, clear_results_view
+from .timeline import parse_time_window
+
+BATCH_SIZE = 1024 * 1024
+# filtered view id -> FilteredView
+FILTERED_VIEWS = dict()
+
+
+class FilteredView(object):
+    """
+    A view showing the lines (or log records) of a source view that pass a stack of filters.
+    The source is never modified, and every piece of the filtered text maps back to its offset in the source
+    """
+    def __init__(self, source, view, records=True):
+        self.source = source
+        self.view = view
+        self.pipeline = FilterPipeline(records)
+        self.source_change_count = source.change_count()
+        self.output_starts = array('Q')
+        self.source_starts = array('Q')
+
+    def get_source_point(self, point):
+        index = bisect_right(self.output_starts, point) - 1
+        if index < 0:
+            return None
+        return self.source_starts[index] + point - self.output_starts[index]
+
+    def set_filters(self, filters):
+        if self.source.change_count() != self.source_change_count:
+            self.pipeline.invalidate()
+            self.source_change_count = self.source.change_count()
+        self.pipeline.set_filters(filters)
+        self.view.set_name("filtered: " + " ".join(str(predicate) for predicate in filters))
+        self.refilter()
+
+    def refilter(self):
+        view = self.view
+
+        def work(task):
+            clear_results_view(view, task)
+            output_starts, source_starts = array('Q'), array('Q')
+            batch, size, written = [], 0, 0
+            for offset, text in self.pipeline.run(lambda: iter_view_chunks(self.source)):
+                output_starts.append(written + size)
+                source_starts.append(offset)
+                batch.append(text)
+                size += len(text)
+                if size >= BATCH_SIZE:
+                    task.check()
+                    append_to_results_view(view, "".join(batch), wait=True, task=task)
+                    written += size
+                    batch, size = [], 0
+            task.check()
+            append_to_results_view(view, "".join(batch), wait=True, task=task)
+            return output_starts, source_starts
+
+        def done(result):
+            self.output_starts, self.source_starts = result
+
+        run_in_background(("filter", view.id()), view, work, done, cancel_on_close=True)
+
+
+def ask_for_filter(window, on_filter, kind=None, initial_text=""):
+    """ asks for the kind of filter (unless given) and its argument, then calls on_filter(Filter or None) """
+    def on_kind(index):
+        if index >= 0:
+            ask_for_filter(window, on_filter, FILTER_KINDS[index][0], initial_text)
+
+    if kind is None:
+        window.show_quick_panel([caption for _, caption in FILTER_KINDS], on_kind)
+        return
+
+    def on_argument(text):
+        if not text:
+            on_filter(None)
+            return
+        if kind == TIME_RANGE:
+            time_window = parse_time_window(text)
+            if time_window is None:
+                return
+            on_filter(Filter(kind, text, *time_window))
+            return
+        try:
+            on_filter(Filter(kind, text))
+        except re.error as error:
+            sublime.error_message("Invalid filter {!r}: {}".format(text, error))
+
+    caption = dict(FILTER_KINDS)[kind]
+    window.show_input_panel(caption + ":", initial_text, on_argument, None, None)
+
+
+class FilterView(sublime_plugin.TextCommand):
+    """ adds a filter to the filtered view, or opens a new filtered view of the current view """
+    def run(self, edit, records=True):
+        window = self.view.window()
+        filtered = FILTERED_VIEWS.get(self.view.id())
+
+        def on_filter(predicate):
+            if predicate is None:
+                return
+            current = filtered
+            if current is None:
+                current = FilteredView(self.view, new_results_view(window, "filtered"), records)
+                FILTERED_VIEWS[current.view.id()] = current
+            current.set_filters(current.pipeline.filters + [predicate])
+
+        ask_for_filter(window, on_filter)
+
+
+class EditViewFilters(sublime_plugin.TextCommand):
+    """ changes or removes (by entering nothing) one of the filters of a filtered view """
+    def run(self, edit):
+        filtered = FILTERED_VIEWS.get(self.view.id())
+        if filtered is None:
+            sublime.status_message("not a filtered view")
+            return
+        filters = filtered.pipeline.filters
+        window = self.view.window()
+
+        def on_select(index):
+            if index < 0:
+                return
+
+            def on_filter(predicate):
+                new_filters = list(filters)
+                if predicate is None:
+                    del new_filters[index]
+                else:
+                    new_filters[index] = predicate
+                filtered.set_filters(new_filters)
+
+            ask_for_filter(window, on_filter, filters[index].kind, filters[index].argument)
+
+        window.show_quick_panel([str(predicate) for predicate in filters], on_select)
+
+
+class OpenFilteredSource(sublime_plugin.TextCommand):
+    """ shows the line under the cursor of a filtered view in its source view """
+    def run(self, edit):
+        filtered = FILTERED_VIEWS.get(self.view.id())
+        if filtered is None or filtered.source.window() is None:
+            sublime.status_message("the source of this view is not open")
+            return
+        point = filtered.get_source_point(self.view.sel()[0].begin())
+        if point is None:
+            return
+        source = filtered.source
+        source.window().focus_view(source)
+        source.sel().clear()
+        source.sel().add(sublime.Region(point))
+        source.show_at_center(point)
+
+
+class FilteredViewListener(sublime_plugin.EventListener):
+    def on_close(self, view):
+        FILTERED_VIEWS.pop(view.id(), None)
@@ -0,0 +1,204 @@
+import sublime, sublime_plugin
+import os
+import select
+import threading
+import time
+import ctypes
+import ctypes.util
+from .background import Task, Cancelled, VIEW_TASKS, cancel
+from .diagnostics import get_active_filepath, get_file_prefix, get_file_series, get_timeframe_index
+from .log_reader import get_compression_suffix, find_first_timestamp, find_last_timestamp, HEAD_SCAN_SIZE
+from .results_view import new_results_view, append_to_results_view
+from .timestamps import parse_timestamp_bytes
+
+INITIAL_TAIL_SIZE = 1024 * 1024
+BATCH_SIZE = 1024 * 1024
+POLL_INTERVAL = 1.0
+INDEX_SAVE_INTERVAL = 30.0  # the timeframe of a followed file is saved at most this often, and when it stops
+IN_MODIFY, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x2, 0x40, 0x80, 0x100, 0x200
+
+
+class PollingWatcher(object):
+    def wait(self, timeout):
+        time.sleep(timeout)
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """ wakes up as soon as something in the directory is written, created, renamed or deleted (linux only) """
+    def __init__(self, dirname):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        if libc.inotify_add_watch(self.fd, os.fsencode(dirname), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if readable:
+            try:
+                os.read(self.fd, 64 * 1024)  # which file changed doesn't matter, the follower checks its own
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+def get_watcher(dirname):
+    try:
+        return InotifyWatcher(dirname)
+    except (OSError, AttributeError, TypeError):  # not linux, or no libc to load
+        return PollingWatcher()
+
+
+def find_rotated_file(filepath, fd):
+    """
+    :returns: the file of the series fd was rotated into (e.g. izbox.log.1), the path itself if the file was
+              truncated in place, or None if fd is still the current file
+    """
+    try:
+        stat = os.stat(filepath)
+    except OSError:  # in the middle of a rotation, the new file isn't there yet
+        return None
+    current = os.fstat(fd.fileno())
+    if (stat.st_dev, stat.st_ino) == (current.st_dev, current.st_ino):
+        return filepath if stat.st_size < fd.tell() else None
+    for other in get_file_series(get_file_prefix(filepath)):
+        try:
+            other_stat = os.stat(other)
+        except OSError:
+            continue
+        if (other_stat.st_dev, other_stat.st_ino) == (current.st_dev, current.st_ino):
+            return other
+    return filepath  # rotated out of the series (deleted or moved away)
+
+
+def parse_timestamp_or_none(data):
+    try:
+        return parse_timestamp_bytes(data) if data is not None else None
+    except ValueError:
+        return None
+
+
+def read_start(fd):
+    """ the first timestamp of the file, which appending doesn't change """
+    position = fd.tell()
+    fd.seek(0)
+    head = fd.read(HEAD_SCAN_SIZE)
+    fd.seek(position)
+    return parse_timestamp_or_none(find_first_timestamp(head, 0, len(head)))
+
+
+class TimeframeUpdater(object):
+    """
+    extends the cached timeframe of the followed file by the appended data, instead of scanning the file again.
+    the appended batches are accumulated, and the index is saved at most every INDEX_SAVE_INTERVAL seconds
+    """
+    def __init__(self, filepath, start):
+        self.filepath = filepath
+        self.start = start
+        self.previous_size = self.size = self.finish = None
+        self.saved = time.time()
+
+    def add(self, previous_size, size, data, caught_up):
+        """:param caught_up: whether data ends at the end of the file, so the size matches the file's key"""
+        if self.previous_size is None:
+            self.previous_size = previous_size
+        self.size = size
+        self.finish = parse_timestamp_or_none(find_last_timestamp(data, 0, len(data), cut=False)) or self.finish
+        if caught_up and time.time() - self.saved >= INDEX_SAVE_INTERVAL:
+            self.save()
+
+    def save(self):
+        self.saved = time.time()
+        if self.previous_size is None:
+            return
+        index = get_timeframe_index(os.path.dirname(self.filepath))  # loaded again, others may have saved it
+        if index.extend(self.filepath, self.start, self.previous_size, self.size, self.finish):
+            try:
+                index.save()
+            except (IOError, OSError):  # the index is only a cache
+                pass
+        self.previous_size = self.size = self.finish = None
+
+
+def follow(task, view, filepath):
+    """ appends whatever is written to the file to the view, in whole lines, until the task is cancelled """
+    fd = open(filepath, 'rb')
+    size = os.fstat(fd.fileno()).st_size
+    fd.seek(max(0, size - INITIAL_TAIL_SIZE))
+    if fd.tell() > 0:
+        fd.readline()  # start at a line boundary
+    watcher = get_watcher(os.path.dirname(filepath))
+    timeframe = TimeframeUpdater(filepath, read_start(fd))
+    partial = b""
+    task.progress("Following {}".format(os.path.basename(filepath)))
+    try:
+        while True:
+            previous_size = fd.tell()
+            data = fd.read(BATCH_SIZE)
+            if data:
+                data, partial = partial + data, b""
+                cut = data.rfind(b"\n") + 1
+                data, partial = data[:cut], data[cut:]  # a line still being written waits for its end
+                task.check()
+                append_to_results_view(view, data.decode("utf-8", "replace"), wait=True)
+                if data:
+                    timeframe.add(previous_size, fd.tell(), data, caught_up=fd.tell() - previous_size < BATCH_SIZE)
+                continue
+            rotated = find_rotated_file(filepath, fd)
+            if rotated is not None:
+                rest = partial + fd.read()  # whatever was written before the rotation
+                if rest and not rest.endswith(b"\n"):
+                    rest += b"\n"  # the last line of the old file, it doesn't go on in the new one
+                if rest:
+                    append_to_results_view(view, rest.decode("utf-8", "replace"), wait=True)
+                fd.close()
+                fd = open(filepath, 'rb')
+                timeframe = TimeframeUpdater(filepath, read_start(fd))
+                partial = b""
+                task.progress("Following {} (rotated to {})".format(os.path.basename(filepath),
+                                                                    os.path.basename(rotated)))
+                continue
+            task.check()
+            watcher.wait(POLL_INTERVAL)
+    except (IOError, OSError) as error:
+        sublime.set_timeout(lambda: sublime.status_message("Stopped following {}: {}".format(filepath, error)), 0)
+    except Cancelled:
+        pass
+    finally:
+        fd.close()
+        watcher.close()
+        timeframe.save()
+        task.finish()
+
+
+class FollowLog(sublime_plugin.WindowCommand):
+    """ follows the log file of the active view in a new view, like tail -f. run it in that view to stop """
+    def run(self):
+        view = self.window.active_view()
+        key = view.settings().get("infinidat_follow_key")
+        if key is not None:
+            cancel(tuple(key))
+            view.settings().erase("infinidat_follow_key")
+            view.set_name(view.name().replace("follow:", "followed:", 1))
+            return
+        filepath = get_active_filepath(self.window)
+        if not filepath or get_compression_suffix(filepath) is not None:
+            sublime.status_message("only plain log files that are still being written can be followed")
+            return
+        follow_view = new_results_view(self.window, "follow: {}".format(os.path.basename(filepath)))
+        follow_view.settings().set("infinidat_source_path", filepath)
+        key = ("follow", follow_view.id())
+        follow_view.settings().set("infinidat_follow_key", list(key))
+        task = Task(key, follow_view)
+        VIEW_TASKS.setdefault(follow_view.id(), []).append(key)
+        thread = threading.Thread(target=follow, args=(task, follow_view, filepath))
+        thread.daemon = True
+        thread.start()
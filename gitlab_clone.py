@@ -1,66 +1,107 @@
 import sublime, sublime_plugin
 import os
-import json
-import subprocess
 import threading
-import time
-import itertools
+import traceback
+from .clone_queue import CloneOptions, CloneQueue, DONE, FAILED
+from .gitlab_repos import ListingFailed, list_repositories, get_sorted_items, load_cache, is_cache_fresh, update_cache
+
+CLONE_QUEUE = None
+
+
+def on_clone_update(queue, job):
+    message = None
+    if job.state in (DONE, FAILED):
+        message = "GitLab clone: {} {}{}".format(job.name, job.state, ": " + job.error if job.error else "")
+    summary = queue.get_summary()
+    batch = queue.take_finished_batch()
+    failed = [job for job in batch if job.state == FAILED] if batch is not None else []
+
+    def update():
+        if message is not None:
+            sublime.status_message(message)
+        view = sublime.active_window().active_view()
+        if view is not None:
+            view.set_status("tkc", summary)
+        if failed:
+            sublime.error_message("Failed to clone:\n" + "\n".join(
+                "{}: {}".format(failed_job.name, failed_job.error) for failed_job in failed))
+    sublime.set_timeout(update, 0)
+
+
+def get_clone_queue():
+    """ all the clones share one queue, so cloning many repositories never runs more than gitlab-clone-workers """
+    global CLONE_QUEUE
+    if CLONE_QUEUE is None:
+        settings = sublime.load_settings("Infinidat.sublime-settings")
+        options = CloneOptions(os.path.expanduser(settings.get("projector-path")),
+                               depth=settings.get("gitlab-clone-depth"),
+                               reference_dir=settings.get("gitlab-clone-reference-dir"))
+        CLONE_QUEUE = CloneQueue(options, settings.get("gitlab-clone-workers", 4),
+                                 settings.get("gitlab-clone-retries", 2), on_clone_update)
+    return CLONE_QUEUE
 
 
 class GitlabClone(sublime_plugin.WindowCommand):
-    def _projector_clone(self, git_url, clone_dst):
-        proc = subprocess.Popen([self._projector_path, "repository", "clone", git_url], cwd=clone_dst)
-        returncode = proc.wait()
-        if returncode == 0:
-            self.window.active_view().set_status("tkc", "Cloning done")
-        else:
-            self.window.active_view().set_status("tkc", "Cloning failed with code {}".format(returncode))
+    def _set_status(self, message):
+        sublime.set_timeout(lambda: self.window.active_view().set_status("tkc", message), 0)
 
-    def _refresh_progress(self):
+    def _refresh_progress(self, count):
         if self.selected:
             # user has already selected the repo, stop bugging with status messages
             return
-        p = next(self._progress)
-        verb = "Refreshing" if self.repo_list else "Loading"
-        self.window.active_view().set_status("tkc", verb + " repository list [" + " " * p + "=" + " " * (4 - p) + "]")
+        verb = "Refreshing" if self.repo_items else "Loading"
+        self._set_status("{} repository list [{} repositories]".format(verb, count))
 
     def _refresh_repo_items(self):
-        self._progress = itertools.cycle(list(range(5)) + list(reversed(list(range(1, 4)))))
-        proc = subprocess.Popen([self._projector_path, "gitlab", "list"], stdout=subprocess.PIPE)
-        while proc.poll() is None:
-            self._refresh_progress()
-            time.sleep(0.2)
-        data = proc.stdout.read()
-        self.repo_list = json.loads(data.decode("ascii").replace("'", "\""))
-        json.dump(self.repo_list, open(self._cache_file, "w"))
-        repo_items = sorted(list(self.repo_list.items()), key=lambda kv: kv[0])
+        cached = dict(self.repo_items)
+        try:
+            repo_list = list_repositories(self._projector_path, self._refresh_progress)
+            update_cache(self._cache_file, cached, repo_list)
+        except (ListingFailed, OSError) as error:
+            traceback.print_exc()
+            self._set_status("Refreshing the repository list failed: {}".format(error))
+            return
+        sublime.set_timeout(lambda: self._on_refreshed(repo_list), 0)
+
+    def _on_refreshed(self, repo_list):
+        repo_items = get_sorted_items(repo_list)
         if self.repo_items == repo_items:
             self.window.active_view().set_status("tkc", "")
             return
         self.repo_items = repo_items
         if not self.selected:
             # user is still viewing the repository list, so reload it
+            self.window.active_view().set_status("tkc", "")
             self.window.run_command("hide_overlay")
-            self.window.show_quick_panel([k for k, v in self.repo_items], self.on_repo_select, selected_index=self._current_index)
+            self.window.show_quick_panel([k for k, v in self.repo_items], self.on_repo_select,
+                                         on_highlight=self._on_highlighted, selected_index=self._current_index)
 
     def on_dst_select(self, clone_dst):
-        clone_dst = os.path.expanduser(clone_dst)
-        self.window.active_view().set_status("tkc", "Cloning {} into {}...".format(self.git_url, clone_dst))
-        clone_thread = threading.Thread(target=self._projector_clone, args=(self.git_url, clone_dst))
-        clone_thread.start()
+        self.clone_dst = os.path.expanduser(clone_dst)
+        self._queue_clone()
+
+    def _queue_clone(self):
+        get_clone_queue().add(self.repo_name, self.git_url, self.clone_dst)
+        # keep picking repositories into the same destination, until the panel is dismissed
+        self.window.show_quick_panel([k for k, v in self.repo_items], self.on_repo_select,
+                                     on_highlight=self._on_highlighted, selected_index=self._current_index)
 
     def on_repo_select(self, index):
         self.selected = True
         self.window.active_view().set_status("tkc", "")
         if index < 0:
             return
-        self.git_url = self.repo_items[index][1]
-        self.window.show_input_panel("Clone destination: ", "", self.on_dst_select, None, None)
+        self.repo_name, self.git_url = self.repo_items[index]
+        if self.clone_dst is None:
+            self.window.show_input_panel("Clone destination: ", "", self.on_dst_select, None, None)
+        else:
+            self._queue_clone()
 
     def _load_settings(self):
         settings = sublime.load_settings("Infinidat.sublime-settings")
         self._projector_path = os.path.expanduser(settings.get("projector-path"))
         self._cache_file = os.path.expanduser(settings.get("gitlab-cache-file"))
+        self._cache_ttl = settings.get("gitlab-cache-ttl", 3600)
 
     def _on_highlighted(self, item_index):
         self._current_index = item_index
@@ -70,11 +111,10 @@ class GitlabClone(sublime_plugin.WindowCommand):
         if not os.path.exists(self._projector_path):
             return
         self.selected = False
+        self.clone_dst = None
         self._current_index = 0
-        self.repo_list = dict()
-        if os.path.exists(self._cache_file):
-            self.repo_list = json.load(open(self._cache_file))
-        self.repo_items = sorted(list(self.repo_list.items()), key=lambda kv: kv[0])
-        self.refresh_thread = threading.Thread(target=self._refresh_repo_items)
-        self.refresh_thread.start()
+        self.repo_items = load_cache(self._cache_file)  # already sorted
+        if not self.repo_items or not is_cache_fresh(self._cache_file, self._cache_ttl):
+            self.refresh_thread = threading.Thread(target=self._refresh_repo_items)
+            self.refresh_thread.start()
         self.window.show_quick_panel([k for k, v in self.repo_items], self.on_repo_select, on_highlight=self._on_highlighted)
@@ -0,0 +1,185 @@
+import os
+import re
+import ast
+import json
+import codecs
+import struct
+import time
+import tempfile
+import subprocess
+
+READ_SIZE = 64 * 1024
+PROGRESS_INTERVAL = 100
+CACHE_MAGIC = b"TKC\0"
+CACHE_VERSION = 1
+CACHE_HEADER = struct.Struct("<III")  # version, number of repositories, size of the names block
+# projector prints the repositories as a python dict: {'name': 'url', ...}. this matches one 'name': 'url' item
+# (with either kind of quotes, so it's fine with json too), so items can be parsed as they arrive
+STRING = r"""(?:'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")"""
+ITEM_PATTERN = re.compile(r"({0})\s*:\s*({0})".format(STRING))
+
+
+class ListingFailed(Exception):
+    pass
+
+
+def iter_repo_items(chunks):
+    """ yields (name, url) from the chunks of the output of 'projector gitlab list', as soon as each item is complete """
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        end = 0
+        for match in ITEM_PATTERN.finditer(pending):
+            yield ast.literal_eval(match.group(1)), ast.literal_eval(match.group(2))
+            end = match.end()
+        pending = pending[end:]
+
+
+def iter_process_output(proc):
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")  # a read may end in the middle of a character
+    while True:
+        data = os.read(proc.stdout.fileno(), READ_SIZE)
+        yield decoder.decode(data, final=not data)
+        if not data:
+            return
+
+
+def list_repositories(projector_path, on_progress=None):
+    """
+    runs 'projector gitlab list', calling on_progress(count) every PROGRESS_INTERVAL repositories parsed.
+    :returns: dict of name -> url
+    :raises: ListingFailed if projector failed, so a partial listing never replaces the cache
+    """
+    proc = subprocess.Popen([projector_path, "gitlab", "list"], stdout=subprocess.PIPE)
+    repo_list = dict()
+    try:
+        for name, url in iter_repo_items(iter_process_output(proc)):
+            repo_list[name] = url
+            if on_progress is not None and len(repo_list) % PROGRESS_INTERVAL == 0:
+                on_progress(len(repo_list))
+    finally:
+        proc.stdout.close()
+        returncode = proc.wait()
+    if returncode != 0:
+        raise ListingFailed("projector gitlab list failed with code {}".format(returncode))
+    return repo_list
+
+
+def get_sorted_items(repo_list):
+    return sorted(repo_list.items(), key=lambda kv: kv[0])
+
+
+def get_binary_cache_path(cache_file):
+    """
+    the binary cache is written next to "gitlab-cache-file" (e.g. ~/.tkc.v1), never over it: older versions
+    of the plugin read that file as json
+    """
+    return "{}.v{}".format(cache_file, CACHE_VERSION)
+
+
+def read_file(filepath):
+    try:
+        with open(filepath, "rb") as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def load_cache(cache_file):
+    """
+    :returns: the cached (name, url) items sorted by name, empty if there is no (valid) cache.
+              without a binary cache, the json dict older versions wrote to cache_file is used
+    """
+    data = read_file(get_binary_cache_path(cache_file))
+    if data is not None and data.startswith(CACHE_MAGIC):
+        repo_items = read_binary_cache(data)
+        if repo_items:
+            return repo_items
+    data = read_file(cache_file)
+    if data is None:
+        return []
+    try:
+        return get_sorted_items(json.loads(data.decode("utf-8")))
+    except (ValueError, AttributeError):  # not json, or not a dict
+        return []
+
+
+def read_binary_cache(data):
+    """
+    the cache is a header followed by two newline-separated utf-8 blocks, the names and the urls, already sorted.
+    loading it is two splits, with no parsing or sorting per item
+    """
+    try:
+        version, count, names_size = CACHE_HEADER.unpack_from(data, len(CACHE_MAGIC))
+    except struct.error:
+        return []
+    if version != CACHE_VERSION:
+        return []
+    start = len(CACHE_MAGIC) + CACHE_HEADER.size
+    try:
+        names = data[start:start + names_size].decode("utf-8").split("\n")
+        urls = data[start + names_size:].decode("utf-8").split("\n")
+    except ValueError:
+        return []
+    if not count or len(names) != count or len(urls) != count:
+        return []
+    return list(zip(names, urls))
+
+
+def write_binary_cache(f, repo_items):
+    names = "\n".join(name for name, url in repo_items).encode("utf-8")
+    urls = "\n".join(url for name, url in repo_items).encode("utf-8")
+    f.write(CACHE_MAGIC)
+    f.write(CACHE_HEADER.pack(CACHE_VERSION, len(repo_items), len(names)))
+    f.write(names)
+    f.write(urls)
+
+
+def is_cache_fresh(cache_file, ttl):
+    """ True if the cache was written less than ttl seconds ago """
+    try:
+        return time.time() - os.stat(get_binary_cache_path(cache_file)).st_mtime < ttl
+    except OSError:
+        return False
+
+
+def save_cache(cache_file, repo_list):
+    binary_path = get_binary_cache_path(cache_file)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(binary_path)))
+    with os.fdopen(fd, "wb") as temp_file:
+        write_binary_cache(temp_file, get_sorted_items(repo_list))
+    os.rename(temp_path, binary_path)  # atomic, a concurrent reader never sees a partial cache
+
+
+def update_cache(cache_file, cached, repo_list):
+    """
+    writes the new listing to the cache if it differs from the cached one (a dict of name -> url), otherwise only
+    touches the cache so its age counts from this refresh. :returns: (added, removed) names
+    """
+    added = set(repo_list) - set(cached)
+    removed = set(cached) - set(repo_list)
+    changed = added or removed or any(cached[name] != url for name, url in repo_list.items() if name in cached)
+    if changed or not os.path.exists(get_binary_cache_path(cache_file)):
+        save_cache(cache_file, repo_list)
+    else:
+        os.utime(get_binary_cache_path(cache_file), None)
+    return added, removed
+
+
+if __name__ == "__main__":
+    # cold start of the quick panel, from the old json cache vs the binary cache: python gitlab_repos.py
+    import shutil
+    from timeit import timeit
+    repo_list = dict(("group{}/project-{}".format(i % 50, i), "git@gitlab:group{}/project-{}.git".format(i % 50, i))
+                     for i in range(20000))
+    temp_dir = tempfile.mkdtemp()
+    json_file, binary_file = os.path.join(temp_dir, "json"), os.path.join(temp_dir, "binary")
+    with open(json_file, "w") as f:
+        json.dump(repo_list, f)
+    save_cache(binary_file, repo_list)
+    assert load_cache(json_file) == load_cache(binary_file) == get_sorted_items(repo_list)
+    count = 20
+    for name, path in [("json", json_file), ("binary", binary_file)]:
+        seconds = timeit(lambda: load_cache(path), number=count)
+        print("{:<8} {:.2f} ms to load {} repositories".format(name, seconds * 1000 / count, len(repo_list)))
+    shutil.rmtree(temp_dir)
@@ -1,50 +1,52 @@
 import sublime, sublime_plugin
-from contextlib import contextmanager
+from os import path
+from .grep_engine import CHUNK_SIZE, compile_pattern, iter_file_chunks, grep
+from .view_index import get_view_index
 
+# sublime's encoding names of the files we can stream from disk instead of copying the buffer text
+SUBLIME_ENCODINGS = {"Undefined": "utf-8", "UTF-8": "utf-8", "UTF-8 with BOM": "utf-8-sig",
+                     "Western (Windows 1252)": "cp1252", "Western (ISO 8859-1)": "latin-1"}
 
-def compare_regions(item):
-    return item.begin()
 
+def iter_view_chunks(view, chunk_size=CHUNK_SIZE):
+    size = view.size()
+    for start in range(0, size, chunk_size):
+        yield view.substr(sublime.Region(start, min(start + chunk_size, size)))
 
-def select_all_lines_containing_current_selection(view):
-    view.window().run_command("find_all_under")
-    view.run_command("expand_selection", dict(to="line"))
 
+def get_view_chunks(view):
+    """ stream from disk when the buffer is saved, otherwise from the buffer text """
+    filepath = view.file_name()
+    if filepath and not view.is_dirty() and path.isfile(filepath):
+        encoding = SUBLIME_ENCODINGS.get(view.encoding())
+        if encoding is not None:
+            return iter_file_chunks(filepath, encoding)
+    return iter_view_chunks(view)
 
-def grep_selection(view, edit, invert_selection=True):
-    select_all_lines_containing_current_selection(view)
-    if invert_selection:
-        view.run_command("invert_selection")
-    _ = [view.erase(edit, region) for region in sorted(view.sel(), key=compare_regions, reverse=True)]
+
+def show_results_in_new_view(view, name, contents):
+    results_view = view.window().new_file()
+    results_view.set_scratch(True)
+    results_view.set_name(name)
+    results_view.settings().set("syntax", view.settings().get("syntax"))
+    results_view.run_command("grep_set_results", dict(contents=contents))
+    return results_view
+
+
+def grep_view_into_new_view(view, word, invert_selection=False, records=False):
+    pattern = compile_pattern(word)
+    contents = "".join(grep(get_view_chunks(view), pattern, invert=invert_selection, records=records))
+    name = "{} {!r}".format("grep -v" if invert_selection else "grep", word)
+    return show_results_in_new_view(view, name, contents)
+
+
+def get_multiline_message_region(view, position):
+    start, end = get_view_index(view).records.record_at(position)
+    return sublime.Region(start, end)
 
 
 def expand_multiline_message(view, selection=None):
-    beginnings = view.find_all(r"^\d+.*$")
-    total = len(beginnings)
-    for index, region in enumerate(beginnings):
-        if region.a <= selection.a and beginnings[(index+1)%total].a >= selection.a:
-            view.sel().add(sublime.Region(region.a, region.b-1))
-            expand_multiline_messages(view)
-            break
-
-def expand_multiline_messages(view):
-    selection = view.sel()
-    regions = list(selection)
-    for region in regions:
-        next_traceback_line_region = view.find(r"(?:\n[^\d].*)+", region.b+1)
-        if next_traceback_line_region.a == next_traceback_line_region.b:
-            continue
-        if (next_traceback_line_region.a, next_traceback_line_region.b) == (-1, -1):
-            continue
-        selection.add(sublime.Region(next_traceback_line_region.a, next_traceback_line_region.b+1))
-
-
-def log_grep_selection(view, edit, invert_selection=True):
-    select_all_lines_containing_current_selection(view)
-    expand_multiline_messages(view)
-    if invert_selection:
-        view.run_command("invert_selection")
-    _ = [view.erase(edit, region) for region in sorted(view.sel(), key=compare_regions, reverse=True)]
+    view.sel().add(get_multiline_message_region(view, selection.a))
 
 
 def get_selected_region(view):
@@ -54,46 +56,40 @@ def get_selected_region(view):
     return current_position, word
 
 
-@contextmanager
-def stay_in_place(view):
-    current_position, word = get_selected_region(view)
-    all_positions = sorted([(region.a, region.b) for region in view.find_all(word, sublime.LITERAL)])
-    index = all_positions.index(current_position)
-    yield
-    view.sel().clear()
-    view.sel().add(view.find_all(word, sublime.LITERAL)[index])
+class GrepSetResultsCommand(sublime_plugin.TextCommand):
+    def run(self, edit, contents):
+        # a single insert, no matter how many lines matched
+        self.view.insert(edit, 0, contents)
+        self.view.sel().clear()
+        self.view.sel().add(sublime.Region(0))
+
+
+def grep_command(view, invert_selection=False, records=False):
+    _, word = get_selected_region(view)
+    if not word:
+        sublime.status_message("nothing selected to grep")
+        return
+    grep_view_into_new_view(view, word, invert_selection, records)
 
 
 class GrepCommand(sublime_plugin.TextCommand):
     def run(self, edit):
-        with stay_in_place(self.view):
-            grep_selection(self.view, edit)
+        grep_command(self.view)
 
 
 class GrepExcludeCommand(sublime_plugin.TextCommand):
     def run(self, edit):
-        grep_selection(self.view, edit, invert_selection=False)
-        self.view.sel().clear()
+        grep_command(self.view, invert_selection=True)
 
 
 class LogGrepCommand(sublime_plugin.TextCommand):
     def run(self, edit):
-        _, word = get_selected_region(self.view)
-        if len(word) < 4:
-            sublime.error_message("selection is too short, it will take too long to grep this")
-            return
-        with stay_in_place(self.view):
-            log_grep_selection(self.view, edit)
+        grep_command(self.view, records=True)
 
 
 class LogGrepExcludeCommand(sublime_plugin.TextCommand):
     def run(self, edit):
-        _, word = get_selected_region(self.view)
-        if len(word) < 4:
-            sublime.error_message("selection is too short, it will take too long to grep this")
-            return
-        log_grep_selection(self.view, edit, invert_selection=False)
-        self.view.sel().clear()
+        grep_command(self.view, invert_selection=True, records=True)
 
 
 class ExpandLogMessage(sublime_plugin.TextCommand):
@@ -105,9 +101,12 @@ class ExpandLogMessage(sublime_plugin.TextCommand):
 
 class GrepTracebacks(sublime_plugin.TextCommand):
     def run(self, edit):
-        self.view.sel().clear()
+        index = get_view_index(self.view).records
+        records = []
         for selection in self.view.find_all("Traceback", sublime.LITERAL):
-            expand_multiline_message(self.view, selection)
-        self.view.run_command("invert_selection")
-        _ = [self.view.erase(edit, region) for region in sorted(self.view.sel(), key=compare_regions, reverse=True)]
+            record = index.find(selection.a)
+            if not records or records[-1] != record:  # several tracebacks in the same message
+                records.append(record)
+        contents = "".join(self.view.substr(sublime.Region(*index.get_record(record))) for record in records)
+        show_results_in_new_view(self.view, "tracebacks", contents)
 
@@ -0,0 +1,174 @@
+import io
+import re
+from .log_reader import open_log
+from .record_index import get_record_starts, get_record_start, get_record_end
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def compile_pattern(text, regex=False):
+    return re.compile(text if regex else re.escape(text))
+
+
+def iter_file_chunks(filepath, encoding="utf-8", chunk_size=CHUNK_SIZE):
+    with io.TextIOWrapper(open_log(filepath), encoding=encoding, errors="replace") as fd:
+        for chunk in iter(lambda: fd.read(chunk_size), ""):
+            yield chunk
+
+
+def _line_boundary(text):
+    return text.rfind("\n") + 1
+
+
+def _record_boundary(text):
+    """:returns: the offset of the last record start in text, so everything before it is made of whole records"""
+    position = len(text)
+    while True:
+        position = text.rfind("\n", 0, position)
+        if position == -1:
+            return 0
+        if text[position + 1:position + 2].isdigit():
+            return position + 1
+
+
+def iter_complete_blocks(chunks, boundary):
+    """ re-cuts the chunks so that no line (or record) is split between two blocks """
+    remainder = ""
+    for chunk in chunks:
+        text = remainder + chunk
+        cut = boundary(text)
+        if cut == 0:
+            remainder = text
+            continue
+        yield text[:cut]
+        remainder = text[cut:]
+    if remainder:
+        yield remainder
+
+
+def _as_lines(text):
+    return text if text.endswith("\n") or not text else text + "\n"
+
+
+def grep_lines_in_block(text, pattern, invert=False):
+    if invert:
+        search = pattern.search
+        return "".join(line for line in text.splitlines(True) if not search(line))
+    result = []
+    position = 0
+    while True:
+        match = pattern.search(text, position)
+        if match is None:
+            break
+        start = text.rfind("\n", 0, match.start()) + 1
+        end = text.find("\n", match.end())
+        end = len(text) if end == -1 else end + 1
+        result.append(text[start:end])
+        position = end
+    return "".join(result)
+
+
+def grep_records_in_block(text, pattern, invert=False):
+    if invert:
+        starts = get_record_starts(text)
+        ends = starts[1:] + [len(text)]
+        search = pattern.search
+        return "".join(text[start:end] for start, end in zip(starts, ends) if not search(text, start, end))
+    result = []
+    position = 0
+    while True:
+        match = pattern.search(text, position)
+        if match is None:
+            break
+        start = get_record_start(text, match.start())
+        position = get_record_end(text, max(match.end() - 1, match.start()))
+        result.append(text[start:position])
+    return "".join(result)
+
+
+def grep(chunks, pattern, invert=False, records=False):
+    """
+    Streams the chunks and yields the matching lines (or multi-line log records) of each block.
+    Only matches are searched for with the compiled pattern, so sparse results don't cost a python loop per line
+    """
+    boundary, grep_block = (_record_boundary, grep_records_in_block) if records else \
+                           (_line_boundary, grep_lines_in_block)
+    for block in iter_complete_blocks(chunks, boundary):
+        result = grep_block(block, pattern, invert)
+        if result:
+            yield _as_lines(result)
+
+
+def iter_matches(chunks, pattern):
+    """
+    Streams the chunks and yields (line number, line, first line of its record) for every line matching the pattern.
+    Line numbers start at 1. Lines are counted with str.count between matches, not one by one
+    """
+    line_number = 1
+    for block in iter_complete_blocks(chunks, _record_boundary):
+        counted = 0
+        position = 0
+        while True:
+            match = pattern.search(block, position)
+            if match is None:
+                break
+            start = block.rfind("\n", 0, match.start()) + 1
+            end = block.find("\n", match.start())
+            end = len(block) if end == -1 else end
+            line_number += block.count("\n", counted, start)
+            counted = start
+            record_start = get_record_start(block, start)
+            record_line_end = block.find("\n", record_start)
+            yield line_number, block[start:end], block[record_start:end if record_line_end == -1 else record_line_end]
+            position = end + 1
+        line_number += block.count("\n", counted)
+
+
+def iter_units(chunks, records=True):
+    """ yields (offset, text) of every line, or every log record (with its continuation lines), of the chunks """
+    offset = 0
+    for block in iter_complete_blocks(chunks, _record_boundary if records else _line_boundary):
+        if records:
+            starts = get_record_starts(block)
+            for start, end in zip(starts, starts[1:] + [len(block)]):
+                yield offset + start, block[start:end]
+        else:
+            position = 0
+            for line in block.split("\n")[:-1]:
+                yield offset + position, line + "\n"
+                position += len(line) + 1
+            if position < len(block):  # the last line of the text, without a newline
+                yield offset + position, block[position:]
+        offset += len(block)
+
+
+if __name__ == "__main__":
+    # benchmark, from the directory containing the package: python -m <package>.grep_engine [size in MB ...]
+    import os
+    import sys
+    import tempfile
+    from time import time
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100, 1024]
+    line = "2015-04-08 12:34:56.123456 izbox[1]pid=1:[main] tid=1:2 tag=x module=io level=INFO msg=request {}\n"
+    traceback = "Traceback (most recent call last):\n  File \"io.py\", line 1\nIOError: failed\n"
+    for size in sizes:
+        fd, filepath = tempfile.mkstemp(suffix=".log")
+        with os.fdopen(fd, "w") as log:
+            written = 0
+            block = "".join(line.format(index) for index in range(10000)) + traceback
+            while written < size * 1024 * 1024:
+                log.write(block)
+                written += len(block)
+        try:
+            for description, pattern, kwargs in [("grep", "request 1234", dict()),
+                                                 ("grep -v", "request 1", dict(invert=True)),
+                                                 ("log grep", "IOError", dict(records=True)),
+                                                 ("log grep -v", "level=INFO", dict(records=True, invert=True))]:
+                start = time()
+                output = sum(len(result) for result in grep(iter_file_chunks(filepath), compile_pattern(pattern),
+                                                            **kwargs))
+                elapsed = time() - start
+                print("{} MB {:<12} {:.2f} seconds, {:.0f} MB/s, {} bytes of output".format(
+                      size, description, elapsed, size / elapsed, output))
+        finally:
+            os.remove(filepath)
@@ -0,0 +1,402 @@
+import io
+import os
+import bz2
+import mmap
+import zlib
+import lzma
+from collections import OrderedDict
+from glob import glob
+from .timestamps import TIMESTAMP_BYTES_PATTERN, parse_timestamp_bytes
+
+# once the bisection narrows the range down to this many bytes, a linear scan is cheaper than more seeks
+LINEAR_SCAN_THRESHOLD = 64 * 1024
+
+COMPRESSED_BLOCK_SIZE = 64 * 1024
+CHECKPOINT_INTERVAL = 16 * 1024 * 1024
+TAIL_SIZE = 64 * 1024
+MAX_CACHED_CHECKPOINTS = 8
+HEAD_SCAN_SIZE = 32 * 1024  # the first record of a file is expected this close to its beginning
+TAIL_SCAN_SIZE = 1024 * 1024  # and its last one this close to its end, binary garbage included
+
+
+def _gzip_decompressor():
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+DECOMPRESSORS = {".gz": _gzip_decompressor, ".bz2": bz2.BZ2Decompressor, ".xz": lzma.LZMADecompressor}
+
+
+def get_compression_suffix(filepath):
+    suffix = os.path.splitext(filepath)[1]
+    return suffix if suffix in DECOMPRESSORS else None
+
+
+def strip_compression_suffix(filepath):
+    return filepath[:-len(get_compression_suffix(filepath))] if get_compression_suffix(filepath) else filepath
+
+
+def get_file_prefix(filepath):
+    filepath = strip_compression_suffix(filepath)
+    if filepath[-1].isdigit():
+        return filepath.rsplit('.', 1)[0]
+    return filepath
+
+
+def get_file_series(prefix):
+    return sorted(glob(prefix + "*"))
+
+
+class Checkpoints(object):
+    """
+    What we learn about a compressed file in a single decompression pass:
+    its uncompressed size, its tail, and (uncompressed offset, compressed offset, decompressor state) seek points.
+    zlib decompressors can be copied, so gzip files get a seek point every CHECKPOINT_INTERVAL bytes;
+    bz2 and lzma decompressors can't, so those only get one at the beginning of each stream
+    """
+    def __init__(self, filepath):
+        self.points = []
+        self.size = 0
+        self.tail = b""
+        self._build(filepath, DECOMPRESSORS[get_compression_suffix(filepath)])
+
+    def _build(self, filepath, new_decompressor):
+        decompressor = new_decompressor()
+        self.points.append((0, 0, None))  # None stands for a fresh decompressor, at a stream beginning
+        copyable = hasattr(decompressor, "copy")
+        next_checkpoint = CHECKPOINT_INTERVAL
+        with open(filepath, 'rb') as fd:
+            for data in iter(lambda: fd.read(COMPRESSED_BLOCK_SIZE), b""):
+                while data:
+                    # another stream (e.g. concatenated gzips), starting in this read or in the next one
+                    if decompressor.eof:
+                        decompressor = new_decompressor()
+                        self.points.append((self.size, fd.tell() - len(data), None))
+                    output = decompressor.decompress(data)
+                    data = decompressor.unused_data if decompressor.eof else b""
+                    self.size += len(output)
+                    self.tail = (self.tail + output)[-TAIL_SIZE:]
+                if copyable and self.size >= next_checkpoint and not decompressor.eof:
+                    self.points.append((self.size, fd.tell(), decompressor.copy()))
+                    next_checkpoint = self.size + CHECKPOINT_INTERVAL
+        self.random_access = copyable
+
+    def find(self, offset):
+        """:returns: the last seek point at or before offset"""
+        for index in range(len(self.points) - 1, -1, -1):
+            if self.points[index][0] <= offset:
+                return self.points[index]
+
+
+_checkpoints_cache = OrderedDict()
+
+
+def get_checkpoints(filepath):
+    stat = os.stat(filepath)
+    key = filepath, stat.st_size, stat.st_mtime
+    if key in _checkpoints_cache:
+        _checkpoints_cache.move_to_end(key)
+        return _checkpoints_cache[key]
+    checkpoints = _checkpoints_cache[key] = Checkpoints(filepath)
+    while len(_checkpoints_cache) > MAX_CACHED_CHECKPOINTS:
+        _checkpoints_cache.popitem(last=False)
+    return checkpoints
+
+
+class DecompressedFile(io.RawIOBase):
+    """ a read-only, seekable view of the uncompressed contents of a .gz/.bz2/.xz file """
+    def __init__(self, filepath):
+        self._suffix = get_compression_suffix(filepath)
+        self._checkpoints = get_checkpoints(filepath)
+        self._fd = open(filepath, 'rb')
+        self._restore(self._checkpoints.points[0])
+        self.random_access = self._checkpoints.random_access
+
+    def _restore(self, point):
+        self._position, compressed_offset, decompressor = point
+        self._decompressor = DECOMPRESSORS[self._suffix]() if decompressor is None else decompressor.copy()
+        self._fd.seek(compressed_offset)
+        self._buffer = b""
+
+    def _fill(self):
+        while not self._buffer:
+            data = b""
+            if self._decompressor.eof:  # another stream may follow, in the unused data or in the next read
+                data = self._decompressor.unused_data
+                self._decompressor = DECOMPRESSORS[self._suffix]()
+            if not data:
+                data = self._fd.read(COMPRESSED_BLOCK_SIZE)
+                if not data:  # only the end of the file is the end of the data
+                    return False
+            self._buffer = self._decompressor.decompress(data)
+        return True
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def readinto(self, buffer):
+        if not self._fill():
+            return 0
+        count = min(len(buffer), len(self._buffer))
+        buffer[:count] = self._buffer[:count]
+        self._buffer = self._buffer[count:]
+        self._position += count
+        return count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._checkpoints.size
+        offset = max(0, min(offset, self._checkpoints.size))
+        point = self._checkpoints.find(offset)
+        if not point[0] <= self._position <= offset:  # can't get there by reading forward from here
+            self._restore(point)
+        tail_start = self._checkpoints.size - len(self._checkpoints.tail)
+        if offset >= tail_start and self._position < tail_start:  # served from the tail we kept, no decompression
+            self._buffer = self._checkpoints.tail[offset - tail_start:]
+            self._position = offset
+            self._fd.seek(0, io.SEEK_END)
+            self._decompressor = DECOMPRESSORS[self._suffix]()
+            return offset
+        while self._position < offset and self._fill():
+            skip = min(offset - self._position, len(self._buffer))
+            self._buffer = self._buffer[skip:]
+            self._position += skip
+        return self._position
+
+    def close(self):
+        self._fd.close()
+        super(DecompressedFile, self).close()
+
+
+def open_log(filepath):
+    """ opens plain and compressed log files alike, for reading bytes """
+    if get_compression_suffix(filepath) is None:
+        return open(filepath, 'rb')
+    return io.BufferedReader(DecompressedFile(filepath))
+
+
+def is_random_access(fd):
+    return getattr(getattr(fd, "raw", fd), "random_access", True)
+
+
+def parse_record_line(line):
+    """:returns: the timestamp of a log line that starts a record (begins with a digit), or None"""
+    if not line[:1].isdigit():
+        return None
+    match = TIMESTAMP_BYTES_PATTERN.search(line)
+    if match is None:
+        return None
+    try:
+        return parse_timestamp_bytes(match.group())
+    except ValueError:
+        return None
+
+
+def iter_records(fd, offset):
+    """
+    Yields (offset, timestamp, line) for every record starting at or after offset.
+    If offset falls in the middle of a line, resynchronizes to the beginning of the next line.
+    """
+    for position, timestamp, line in iter_records_and_continuations(fd, offset):
+        if timestamp is not None:
+            yield position, timestamp, line
+
+
+def iter_whole_records(fd, offset):
+    """ like iter_records, but the yielded text includes the continuation lines (e.g. tracebacks) of the record """
+    current = None
+    for position, timestamp, line in iter_records_and_continuations(fd, offset):
+        if timestamp is None:
+            if current is not None:
+                current[2].append(line)
+            continue
+        if current is not None:
+            yield current[0], current[1], b"".join(current[2])
+        current = position, timestamp, [line]
+    if current is not None:
+        yield current[0], current[1], b"".join(current[2])
+
+
+def iter_records_and_continuations(fd, offset):
+    """ yields (offset, timestamp, line) for every line, with None for the timestamp of continuation lines """
+    if offset > 0:
+        fd.seek(offset - 1)
+        fd.readline()  # the rest of the line containing offset-1, so we're at the beginning of a line
+    else:
+        fd.seek(0)
+    position = fd.tell()
+    for line in iter(fd.readline, b""):
+        yield position, parse_record_line(line), line
+        position += len(line)
+
+
+def first_record_at_or_after(fd, offset):
+    for record in iter_records(fd, offset):
+        return record
+    return None
+
+
+def _is_digit(data, position):
+    return 0x30 <= data[position] <= 0x39  # indexing bytes or an mmap gives an int, nothing is allocated
+
+
+def find_first_timestamp(data, start, end):
+    """
+    :param data: bytes or an mmap, scanned in place without decoding
+    :returns: the timestamp bytes of the first record line in data[start:end], or None
+    """
+    while start < end:
+        line_end = data.find(b"\n", start, end)
+        if line_end == -1:
+            line_end = end
+        if start < line_end and _is_digit(data, start):
+            match = TIMESTAMP_BYTES_PATTERN.search(data, start, line_end)
+            if match is not None:
+                return match.group()
+        start = line_end + 1
+    return None
+
+
+def find_last_timestamp(data, start, end, cut=None):
+    """
+    scans data[start:end] backwards from the end, line by line, for the last record line.
+    :param cut: whether the line at start is incomplete, so isn't considered (by default, unless start is 0)
+    :returns: the timestamp bytes of that line, or None
+    """
+    if cut is None:
+        cut = start > 0
+    while end > start:
+        newline = data.rfind(b"\n", start, end - 1)
+        if newline == -1 and cut:
+            return None
+        line_start = newline + 1
+        if line_start < end and _is_digit(data, line_start):
+            match = TIMESTAMP_BYTES_PATTERN.search(data, line_start, end)
+            if match is not None:
+                return match.group()
+        end = line_start
+    return None
+
+
+def _find_timeframe(data, size, offset=0):
+    """ the first and last timestamps of data, which holds the file from offset on (e.g. only its tail) """
+    first = find_first_timestamp(data, 0, min(size, HEAD_SCAN_SIZE)) if offset == 0 else None
+    start = max(0, size - TAIL_SCAN_SIZE)
+    last = find_last_timestamp(data, start, size, cut=start > 0 or offset > 0)
+    return first, last
+
+
+def get_timeframe(filepath):
+    """
+    :returns: the timestamps of the first and last records of the log file, or None if it has none.
+    plain files are memory mapped read-only (fine on read-only mounts), and nothing is decoded or copied
+    """
+    if get_compression_suffix(filepath) is not None:
+        with open_log(filepath) as fd:
+            head = fd.read(HEAD_SCAN_SIZE)
+        first = find_first_timestamp(head, 0, len(head))
+        checkpoints = get_checkpoints(filepath)  # the tail was kept when the file was decompressed
+        tail = checkpoints.tail
+        last = _find_timeframe(tail, len(tail), checkpoints.size - len(tail))[1]
+    else:
+        with open(filepath, 'rb') as fd:
+            size = os.fstat(fd.fileno()).st_size
+            if size == 0:
+                return None
+            data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                first, last = _find_timeframe(data, size)
+            finally:
+                data.close()
+    if first is None or last is None:
+        return None
+    try:
+        return parse_timestamp_bytes(first), parse_timestamp_bytes(last)
+    except ValueError:
+        return None
+
+
+def find_timestamp_offset(fd, t0):
+    """
+    Bisects the (mostly monotonic) log file on disk for the record at t0.
+    :returns: (offset, timestamp, line) of the first record stamped t0 or, if there is none,
+              the last record before t0 (the first record in the file if they're all after t0).
+              None if the file has no records at all
+    """
+    fd.seek(0, 2)
+    low, high = 0, fd.tell()
+    if not is_random_access(fd):
+        high = low  # every backward seek would decompress from the beginning again, a single forward scan is cheaper
+    previous = None
+    while high - low > LINEAR_SCAN_THRESHOLD:
+        middle = (low + high) // 2
+        record = first_record_at_or_after(fd, middle)
+        if record is None or record[1] >= t0:
+            high = middle
+        else:
+            low = record[0] + 1
+            previous = record
+    for record in iter_records(fd, low):
+        if record[1] >= t0:
+            if record[1] == t0 or previous is None:
+                return record
+            return previous
+        previous = record
+    return previous
+
+
+def find_record_offset(fd, t0, after=False):
+    """:returns: the offset of the first record stamped t0 or later (with after=True, later than t0), or EOF"""
+    found = find_timestamp_offset(fd, t0)
+    for position, timestamp, _ in iter_records(fd, found[0] if found is not None else 0):
+        if timestamp > t0 or (timestamp == t0 and not after):
+            return position
+    return fd.seek(0, 2)
+
+
+def find_time_window(fd, start=None, finish=None):
+    """
+    :returns: (begin, end) byte offsets of the records stamped between start and finish (inclusive), with their
+              continuation lines. either bound may be None. begin == end if there are none
+    """
+    begin = 0 if start is None else find_record_offset(fd, start)
+    end = fd.seek(0, 2) if finish is None else find_record_offset(fd, finish, after=True)
+    return begin, max(begin, end)
+
+
+def copy_range(source, destination, offset, count):
+    """
+    copies count bytes from offset in source to the current position of destination (an unbuffered file).
+    plain files are copied inside the kernel (copy_file_range, or sendfile), without passing through python
+    """
+    if not isinstance(getattr(source, "raw", source), DecompressedFile):
+        for copy in (getattr(os, "copy_file_range", None), getattr(os, "sendfile", None)):
+            if copy is None:
+                continue
+            try:
+                while count > 0:
+                    if copy is os.sendfile:
+                        copied = os.sendfile(destination.fileno(), source.fileno(), offset, count)
+                    else:
+                        copied = copy(source.fileno(), destination.fileno(), count, offset)
+                    if copied == 0:
+                        return
+                    offset += copied
+                    count -= copied
+                return
+            except OSError:  # not supported between these files (e.g. across filesystems on older kernels)
+                continue
+    source.seek(offset)
+    while count > 0:
+        data = source.read(min(count, COMPRESSED_BLOCK_SIZE))
+        if not data:
+            return
+        destination.write(data)
+        count -= len(data)
@@ -0,0 +1,41 @@
+import sublime, sublime_plugin
+from .background import run_in_background
+from .grep import get_view_chunks
+from .results_view import new_results_view, append_to_results_view, format_result
+from .template_miner import TemplateMiner, mine_templates
+
+TIMESTAMP_SIZE = len("2015-04-08 12:34:56")
+
+
+def render_templates(name, filepath, miner):
+    """ the templates, most common first, each followed by links to its first records """
+    lines = [u"Log templates of {}: {} records, {} templates".format(name, miner.records, len(miner.templates))]
+    if miner.evicted_templates:
+        lines.append(u"{} templates not seen recently ({} records) were dropped to bound memory".format(
+            miner.evicted_templates, miner.evicted_records))
+    lines.append(u"Variable parts are shown as <*>. Use Infinidat: Open Search Result on an example to open it")
+    lines.append(u"")
+    for template in sorted(miner.templates.values(), key=lambda template: -template.count):
+        lines.append(u"{:>9}  {} .. {}  {}".format(template.count, template.first[:TIMESTAMP_SIZE] or u"-",
+                                                  template.last[:TIMESTAMP_SIZE] or u"-", template))
+        for line_number, line in template.examples:
+            lines.append(format_result(filepath, line_number, line) if filepath else
+                         u"line {}: {}\n".format(line_number, line))
+    return u"\n".join(line.rstrip(u"\n") for line in lines) + u"\n"
+
+
+class LogTemplates(sublime_plugin.TextCommand):
+    """ groups the records of the view into templates, to spot the rare messages among millions of similar ones """
+    def run(self, edit):
+        view = self.view
+        name = view.name() or view.file_name() or "untitled"
+        filepath = view.file_name() if not view.is_dirty() else None  # line numbers of unsaved text can't be opened
+        chunks = get_view_chunks(view)
+        max_templates = sublime.load_settings("Infinidat.sublime-settings").get("log-templates-max", 1000)
+        results_view = new_results_view(view.window(), "templates {}".format(name))
+
+        def work(task):
+            miner = mine_templates(chunks, TemplateMiner(max_templates=max_templates), task)
+            append_to_results_view(results_view, render_templates(name, filepath, miner), wait=True)
+
+        run_in_background(("log_templates", results_view.id()), results_view, work, cancel_on_close=True)
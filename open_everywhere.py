@@ -1,5 +1,98 @@
 import sublime, sublime_plugin
 import os
+import threading
+from time import time
+from collections import OrderedDict
+from .background import BULK_EXECUTOR, run_in_background
+from .path_index import PathIndex, DEFAULT_EXCLUDES
+
+MAX_CACHED_LISTINGS = 64
+MAX_PREFETCHED_DIRS = 8
+
+
+class DirListingCache(object):
+	""" LRU of directory listings, each valid as long as the mtime of its directory doesn't change """
+	def __init__(self, size=MAX_CACHED_LISTINGS):
+		self.size = size
+		self.listings = OrderedDict()
+		self.lock = threading.Lock()
+
+	def list_dir(self, dirname):
+		""":returns: sorted list of (name, is_dir)"""
+		dirname = os.path.normpath(dirname)
+		mtime = os.stat(dirname).st_mtime
+		with self.lock:
+			cached = self.listings.get(dirname)
+			if cached is not None and cached[0] == mtime:
+				self.listings.move_to_end(dirname)
+				return cached[1]
+		entries = self.scan(dirname)
+		with self.lock:
+			self.listings[dirname] = (mtime, entries)
+			self.listings.move_to_end(dirname)
+			while len(self.listings) > self.size:
+				self.listings.popitem(last=False)
+		return entries
+
+	def scan(self, dirname):
+		if hasattr(os, "scandir"):
+			# scandir gets the entry types with the names (d_type), so there is no stat per entry
+			entries = []
+			for entry in os.scandir(dirname):
+				try:
+					entries.append((entry.name, entry.is_dir()))
+				except OSError:
+					entries.append((entry.name, False))
+		else:
+			entries = [(name, os.path.isdir(os.path.join(dirname, name))) for name in os.listdir(dirname)]
+		# put dirs last.
+		# TODO IMO they should be first instead, but reversing this sort doesn't change the order in the popup anyway
+		entries.sort(key=lambda entry: entry[1])
+		return entries
+
+	def prefetch(self, dirnames):
+		""" lists the directories in the background, so they are already cached when the user gets there """
+		def prefetch():
+			for dirname in dirnames:
+				try:
+					self.list_dir(dirname)
+				except OSError:
+					pass
+		BULK_EXECUTOR.submit(prefetch)
+
+
+LISTING_CACHE = DirListingCache()
+
+MAX_INDEXED_MATCHES = 50
+PATH_INDEX = None
+# typing is only searched for in the path index (and rendered, in Open file) once the user pauses for this long
+DEBOUNCE_DELAY_MS = 80
+
+
+def get_path_index():
+	""" the index of the configured roots, refreshed in the background when it gets older than the refresh interval """
+	global PATH_INDEX
+	settings = sublime.load_settings("Infinidat.sublime-settings")
+	roots = settings.get("path-index-roots", ["~"])
+	if PATH_INDEX is None or PATH_INDEX.roots != [os.path.abspath(os.path.expanduser(root)) for root in roots]:
+		PATH_INDEX = PathIndex(roots, settings.get("path-index-excludes", DEFAULT_EXCLUDES))
+	index = PATH_INDEX
+	stale = index.updated is None or time() - index.updated > settings.get("path-index-refresh-interval", 300)
+	if stale and not index.refreshing:
+		index.refreshing = True
+
+		def refresh():
+			try:
+				index.refresh()
+			finally:
+				index.refreshing = False
+		BULK_EXECUTOR.submit(refresh)
+	return index
+
+
+def search_path_index(fragment, limit=MAX_INDEXED_MATCHES):
+	""" fuzzy search for fragment in the index of the configured roots (empty until its first build is done) """
+	return get_path_index().search(fragment, limit)
 
 
 class OpenEverywhereInsertText(sublime_plugin.TextCommand):
@@ -15,11 +108,16 @@ class OpenEverywhere(sublime_plugin.WindowCommand):
 	items = None
 	dirname = None
 	current_item = None
+	query = None
+	change_count = 0
 
 	def run(self):
 		OpenEverywhere.active = True
 		OpenEverywhere.dirname = None
 		OpenEverywhere.current_item = None
+		OpenEverywhere.query = None
+		OpenEverywhere.change_count += 1
+		get_path_index()  # start building it, if it's not there yet
 		def cancel(index):
 			OpenEverywhere.active = False
 		# just pop up the window, the listener will take over then
@@ -47,22 +145,29 @@ class OpenEverywhereListener(sublime_plugin.EventListener):
 
 	def get_dir_items(self, dirname):
 		try:
-			items = [os.path.join(dirname, f) for f in os.listdir(dirname)]
+			entries = LISTING_CACHE.list_dir(dirname)
 		except OSError:
 			return []
-		items = [f + (os.sep if os.path.isdir(f) else "") for f in items]		# add directory indicators
-		# put dirs last.
-		# TODO IMO they should be first instead, but reversing this sort doesn't change the order in the popup anyway
-		items.sort(key=lambda x: os.path.isdir(x))
-		return items
+		# add directory indicators
+		return [os.path.join(dirname, name) + (os.sep if is_dir else "") for name, is_dir in entries]
+
+	def prefetch(self, dirname, fragment):
+		""" the likely next directories: the subdirectories matching what was typed so far, and the parent """
+		try:
+			entries = LISTING_CACHE.list_dir(dirname)
+		except OSError:
+			return
+		subdirs = [os.path.join(dirname, name) for name, is_dir in entries if is_dir and name.startswith(fragment)]
+		LISTING_CACHE.prefetch(subdirs[:MAX_PREFETCHED_DIRS] + [os.path.dirname(dirname.rstrip(os.sep))])
 
-	def rerun(self, window, text, dirname):
+	def rerun(self, window, text, dirname, items=None):
 		"""
 		Recalculates the items to show and re-popus the overlay (with the text specified in the parameter).
 		Called when the dirname component of the entered text changes, or when we select a directory from the list
 		Note that we can't change the items in the overlay dynamically, so we close it and recreate it
 		"""
-		items = self.get_dir_items(dirname)
+		if items is None:
+			items = self.get_dir_items(dirname)
 		if len(items) == 0:
 			# empty dirs or dirs without permissions: we want to reopen the overlay but we can't open it without items,
 			# so we use the same items as before and nothing will change. Hope the user understands...
@@ -87,9 +192,33 @@ class OpenEverywhereListener(sublime_plugin.EventListener):
 				window.open_file(OpenEverywhere.current_item)
 				window.run_command("hide_overlay")
 				window.run_command(command[0], command[1])
+				return True
 			elif text == key:
 				window.run_command("hide_overlay")
 				window.run_command(command[0], command[1])
+				return True
+		return False
+
+	def search_everywhere(self, window, text):
+		"""
+		text that isn't a path is a fuzzy search over the path index, in the background once the user pauses typing.
+		the results are shown only if nothing was typed since
+		"""
+		if text == OpenEverywhere.query:  # these are the results shown
+			return
+		change_count = OpenEverywhere.change_count
+
+		def done(items):
+			if change_count != OpenEverywhere.change_count or not OpenEverywhere.active or not items:
+				return
+			OpenEverywhere.query = text
+			OpenEverywhere.dirname = None
+			self.rerun(window, text, None, items)
+
+		def search():
+			if change_count == OpenEverywhere.change_count:
+				run_in_background(("open_everywhere", window.id()), None, lambda task: search_path_index(text), done)
+		sublime.set_timeout(search, DEBOUNCE_DELAY_MS)
 
 	def on_modified_async(self, view):
 		"""main plugin callback"""
@@ -99,11 +228,19 @@ class OpenEverywhereListener(sublime_plugin.EventListener):
 			return
 		# get text from "view" (it's the dialog)
 		text = view.substr(sublime.Region(0, view.size()))
-		self.check_special_text(text, view.window())
+		OpenEverywhere.change_count += 1  # supersedes the searches of the previous text
+		if self.check_special_text(text, view.window()):
+			return
+		if len(text) >= 2 and os.sep not in text and not text.startswith(("~", "$")):
+			self.search_everywhere(view.window(), text)
+			return
 		text = os.path.expandvars(os.path.expanduser(text))
 		dirname = os.path.dirname(text)
 		# if the dirname component hasn't changed, there is nothing to do
 		if not os.path.exists(dirname) or dirname == OpenEverywhere.dirname:
+			self.prefetch(dirname, os.path.basename(text))
 			return
 		OpenEverywhere.dirname = dirname
+		OpenEverywhere.query = None
 		self.rerun(view.window(), text, dirname)
+		self.prefetch(dirname, os.path.basename(text))
@@ -0,0 +1,237 @@
+import os
+import re
+import heapq
+import threading
+from time import time
+from array import array
+from bisect import bisect_right
+from itertools import accumulate, chain
+
+DEFAULT_EXCLUDES = [".git", ".hg", ".svn", "__pycache__", "node_modules"]
+MAX_CANDIDATES = 1000
+
+
+class PathIndex(object):
+    """
+    All the paths under a set of roots, for fuzzy searching.
+    The paths are kept in a single newline-separated string, with a lowercase copy and a string of the lowercase
+    basenames beside it, so a query is a few str.find and regular expression scans in C over compact buffers
+    instead of a python loop over millions of path objects. Only the first MAX_CANDIDATES matching paths of the
+    cheapest passes are scored in python.
+    Directories are re-listed on refresh only if their mtime changed, the paths of the others are copied over
+    from the previous string
+    """
+    def __init__(self, roots, excludes=DEFAULT_EXCLUDES):
+        self.roots = [os.path.abspath(os.path.expanduser(root)) for root in roots]
+        self.excludes = set(excludes)
+        self.paths = ""
+        self.count = 0
+        self.updated = None
+        self.refreshing = False
+        self._lowered = ""
+        self._names = "\n"
+        self._path_starts = array("L", [0])  # the offset of each line of paths, and the length of paths
+        self._name_starts = array("L")  # the offset of each line of _names
+        self._directories = dict()  # dirpath -> (mtime, start, end of the paths of its entries in paths, subdirs)
+        self._lock = threading.Lock()
+
+    def _list_directory(self, dirpath):
+        """:returns: (path, is_dir) of the entries of the directory, without following symlinks"""
+        if not hasattr(os, "scandir"):
+            return [(path, os.path.isdir(path) and not os.path.islink(path))
+                    for path in [os.path.join(dirpath, name) for name in os.listdir(dirpath)]]
+        entries = []
+        for entry in os.scandir(dirpath):
+            try:
+                entries.append((entry.path, entry.is_dir(follow_symlinks=False)))
+            except OSError:
+                entries.append((entry.path, False))
+        return entries
+
+    def _scan_directory(self, dirpath):
+        paths, subdirs = [], []
+        try:
+            entries = self._list_directory(dirpath)
+        except OSError:
+            return "", []
+        for path, is_dir in entries:
+            if os.path.basename(path) in self.excludes:
+                continue
+            if is_dir:
+                subdirs.append(path)
+                paths.append(path + os.sep)
+            else:
+                paths.append(path)
+        return "".join(path + "\n" for path in paths), subdirs
+
+    def refresh(self):
+        """ walks the roots, re-listing only new or modified directories """
+        with self._lock:
+            previous_paths, previous_directories = self.paths, self._directories
+        directories = dict()
+        segments = []
+        size = 0
+        pending = list(reversed(self.roots))
+        while pending:
+            dirpath = pending.pop()
+            try:
+                mtime = os.stat(dirpath).st_mtime
+            except OSError:
+                continue
+            cached = previous_directories.get(dirpath)
+            if cached is None or cached[0] != mtime:
+                segment, subdirs = self._scan_directory(dirpath)
+            else:
+                segment, subdirs = previous_paths[cached[1]:cached[2]], cached[3]
+            directories[dirpath] = (mtime, size, size + len(segment), subdirs)
+            segments.append(segment)
+            size += len(segment)
+            pending.extend(reversed(subdirs))
+        self._set_paths("".join(segments), directories)
+
+    def _set_paths(self, paths, directories=None):
+        lines = paths.split("\n")[:-1]
+        lowered = paths.lower()
+        if len(lowered) != len(paths):  # a few characters lowercase to several, keep those lines as they are
+            lowered = "".join(get_lowercase_line(line) + "\n" for line in lines)
+        names = [os.path.basename(line.rstrip(os.sep)).lower() for line in lines]
+        path_starts = array("L", accumulate(chain([0], (len(line) + 1 for line in lines))))
+        name_starts = array("L", accumulate(chain([1], (len(name) + 1 for name in names[:-1]))) if names else [])
+        names = "\n" + "".join(name + "\n" for name in names)
+        with self._lock:
+            self._directories = directories or dict()
+            self.paths = paths
+            self.count = len(lines)
+            self._lowered = lowered
+            self._names = names
+            self._path_starts = path_starts
+            self._name_starts = name_starts
+            self.updated = time()
+
+    def search(self, fragment, limit=20):
+        """
+        :returns: the paths that contain the characters of fragment in order, best matches first.
+                  the candidates are collected by cheaper passes first - basenames starting with the fragment,
+                  basenames containing it, basenames containing its characters in order, and only then whole paths
+                  containing its characters in order - until there are MAX_CANDIDATES of them, and only those are
+                  scored
+        """
+        fragment = fragment.strip().lower()
+        if not fragment:
+            return []
+        with self._lock:
+            paths, lowered, names = self.paths, self._lowered, self._names
+            path_starts, name_starts = self._path_starts, self._name_starts
+        subsequence = re.compile(get_subsequence_pattern(fragment))
+        passes = [(lowered, path_starts, subsequence.search)]
+        if os.sep not in fragment:
+            passes.insert(0, (names, name_starts, subsequence.search))
+            if fragment in names:
+                passes[:0] = [(names, name_starts, get_find("\n" + fragment, 1)),
+                              (names, name_starts, get_find(fragment))]
+        candidates = set()
+        for text, starts, search in passes:
+            for line in iter_matching_lines(text, starts, search):
+                candidates.add(line)
+                if len(candidates) >= MAX_CANDIDATES:
+                    break
+            if len(candidates) >= MAX_CANDIDATES:
+                break
+        matches = [paths[path_starts[line]:path_starts[line + 1] - 1] for line in candidates]
+        return heapq.nlargest(limit, matches, key=lambda path: score(path, fragment))
+
+
+def get_find(needle, skip=0):
+    """ a search function like a compiled pattern's, for a plain substring """
+    def find(text, position):
+        start = text.find(needle, position)
+        return None if start == -1 else start + skip
+    return find
+
+
+def iter_matching_lines(text, starts, search):
+    """
+    :param starts: the offsets of the lines of text
+    :param search: search(text, position) -> the position of the next match, or a match object, or None
+    :returns: the numbers of the lines with matches, each once
+    """
+    position = 0
+    while True:
+        match = search(text, position)
+        if match is None:
+            return
+        start = match if isinstance(match, int) else match.start()
+        yield bisect_right(starts, start) - 1
+        position = text.find("\n", start) + 1
+        if position == 0:
+            return
+
+
+def get_lowercase_line(line):
+    """ the line in lowercase, except for the characters that lowercase to several """
+    return "".join(character if len(character.lower()) != 1 else character.lower() for character in line)
+
+
+def get_subsequence_pattern(fragment):
+    """
+    a regular expression matching the characters of the lowercase fragment in order, within a lowercase line.
+    it starts with a literal, which the regular expression engine scans for quickly, and each gap excludes the
+    next character, so the match never backtracks
+    """
+    parts = []
+    for character, next_character in zip(fragment, fragment[1:] + "\0"):
+        parts.append(re.escape(character))
+        if next_character != "\0":
+            parts.append("[^{}\n]*".format(re.escape(next_character)))
+    return "".join(parts)
+
+
+def score(path, fragment):
+    """
+    scores a fuzzy match of the lowercase fragment in path: consecutive characters, characters at word starts
+    and matches in the basename score higher, long paths score lower
+    """
+    lowered = path.lower()
+    basename_start = lowered.rstrip(os.sep).rfind(os.sep) + 1
+    total = 0
+    position = len(lowered)
+    previous = None
+    # match from the end, so the basename gets the characters it can
+    for character in reversed(fragment):
+        position = lowered.rfind(character, 0, position)
+        if position == -1:
+            return -len(path)
+        total += 1
+        if position >= basename_start:
+            total += 2
+        if position == 0 or not lowered[position - 1].isalnum():
+            total += 3
+        if previous is not None and previous == position + 1:
+            total += 4
+        previous = position
+    return total * 100 - len(path)
+
+
+if __name__ == "__main__":
+    # benchmark: python path_index.py [number of paths]
+    import sys
+    import random
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    words = ["src", "lib", "tests", "logs", "var", "share", "include", "python", "module", "core", "utils", "data",
+             "build", "node", "docs", "config", "izbox", "system", "kernel", "drivers", "net", "support"]
+    random.seed(0)
+    lines = []
+    for _ in range(count):
+        dirpath = os.sep.join(random.choice(words) + random.choice(["", "_v2", "-old", str(random.randrange(100))])
+                              for _ in range(random.randint(2, 6)))
+        lines.append(os.sep + os.sep.join(["home", "user", dirpath, "{}_{:x}{}".format(
+            random.choice(words), random.getrandbits(24), random.choice([".py", ".log", ".c", ".txt", ""]))]))
+    index = PathIndex([])
+    start = time()
+    index._set_paths("".join(line + "\n" for line in lines))
+    print("{} paths, {:.2f} seconds to prepare".format(index.count, time() - start))
+    for fragment in ["log", "izlog", "mtest", "homeizboxc", "qqqzz"]:
+        start = time()
+        matches = index.search(fragment)
+        print("{:<12} {:.1f} ms, {} matches, best: {}".format(fragment, (time() - start) * 1000, len(matches),
+                                                            matches[0] if matches else None))
@@ -1,14 +1,31 @@
 import sublime
 import sublime_plugin
-from os import listdir, sep, getenv
+from os import sep, getenv
 from os.path import commonprefix, isdir, exists, split, dirname, basename, commonprefix, join
 from math import ceil, floor
+from itertools import zip_longest
+from .open_everywhere import search_path_index, LISTING_CACHE, DEBOUNCE_DELAY_MS
+from .background import run_in_background
+
+MAX_INDEXED_MATCHES = 20
+# the file list lays out one viewport of rows plus this many, the rest of a huge directory is shown a page at a time
+PAGE_MARGIN_ROWS = 10
+MIN_COLUMN_SIZE = 10
+# window id -> the prompt shown in it, for page down/up in its input panel (see OpenFilePathPage)
+PROMPTS = dict()
 
 
 class PromptOpenFilePath(sublime_plugin.WindowCommand):
     def run(self):
         self.scratch_file_list_buffer = None
         self.last_text = None
+        self.change_count = 0
+        self.listing = None  # (directory, entries from the listing cache, sorted names, names of directories)
+        self.last_filter = None  # (filtered names, lowercase fragment, matching names)
+        self.scratch_contents = None
+        self.page = 0
+        self.shown_files = None  # (fname, all files, completion files) of the file list
+        self.indexed_matches = None  # (fname, its matches in the path index)
 
         current_dir = getenv('HOME') + sep
         active_view = self.window.active_view()
@@ -18,6 +35,8 @@ class PromptOpenFilePath(sublime_plugin.WindowCommand):
                 current_dir = dirname(current_file_path) + sep
         self.input_panel = self.window.show_input_panel("Open:", current_dir, self.on_done_open, self.on_change,
                                                         self.panel_was_closed)
+        self.input_panel.settings().set("infinidat_open_file_path", True)
+        PROMPTS[self.window.id()] = self
 
     def on_change(self, text):
         if not text:
@@ -35,13 +54,51 @@ class PromptOpenFilePath(sublime_plugin.WindowCommand):
             text = getenv("HOME") + sep
             need_completion = True
 
+        # any change supersedes the renders still waiting for the debounce delay
+        self.change_count += 1
+        if need_completion:
+            self.complete(text, need_completion)
+            return
+        # plain typing: only the latest keystroke within the debounce delay gets rendered, tab completion is immediate
+        change_count = self.change_count
+
+        def debounced():
+            if change_count == self.change_count:
+                self.complete(text, need_completion)
+        sublime.set_timeout(debounced, DEBOUNCE_DELAY_MS)
+
+    def list_dir(self, fdir):
+        """:returns: (sorted names, names of directories) in fdir, cached as long as the directory is unmodified"""
+        try:
+            entries = LISTING_CACHE.list_dir(fdir)
+        except OSError:
+            return [], set()
+        if self.listing is None or self.listing[0] != fdir or self.listing[1] is not entries:
+            self.listing = (fdir, entries, sorted(name for name, _ in entries),
+                            set(name for name, is_dir in entries if is_dir))
+        return self.listing[2], self.listing[3]
+
+    def filter_files(self, fragment, all_files):
+        """
+        case-insensitive substring filter. when the fragment grows (the user keeps typing), the previous
+        matches are narrowed down instead of scanning the whole directory again
+        """
+        fragment = fragment.lower()
+        candidates = all_files
+        if self.last_filter is not None and self.last_filter[0] is all_files and self.last_filter[1] in fragment:
+            candidates = self.last_filter[2]
+        files = [name for name in candidates if fragment in name.lower()]
+        self.last_filter = (all_files, fragment, files)
+        return files
+
+    def complete(self, text, need_completion):
         full_path = text.strip('\t')
         fname = basename(full_path)
         fdir = dirname(full_path)
         new_path = full_path
 
-        all_files_in_dir = listdir(fdir)
-        files_in_dir = [name for name in all_files_in_dir if fname.lower() in name.lower()]
+        all_files_in_dir, dirs_in_dir = self.list_dir(fdir)
+        files_in_dir = self.filter_files(fname, all_files_in_dir)
 
         if need_completion:
             if files_in_dir:
@@ -51,13 +108,13 @@ class PromptOpenFilePath(sublime_plugin.WindowCommand):
                     prefix = commonprefix(files_in_dir)
                     if prefix and len(prefix) > len(fname):
                         new_path = join(fdir, prefix)
-                        files_in_dir = [name for name in all_files_in_dir if prefix.lower() in name.lower()]
+                        files_in_dir = self.filter_files(prefix, all_files_in_dir)
                 else:
                     new_path = join(fdir, files_in_dir[0])
                     # if the new path is a directory, append a / automatically.
-                    if isdir(new_path):
+                    if files_in_dir[0] in dirs_in_dir:
                         new_path += sep
-                        all_files_in_dir = listdir(new_path)
+                        all_files_in_dir, _ = self.list_dir(new_path)
                         files_in_dir = []
             else:
                 new_path = full_path
@@ -66,8 +123,15 @@ class PromptOpenFilePath(sublime_plugin.WindowCommand):
         if new_path != full_path or need_completion:
             self.last_text = new_path
             self.input_panel.run_command('open_file_path_replace_panel', dict(contents=new_path))
+        self.page = 0
         self.set_scratch_file_list(fname, all_files_in_dir, files_in_dir)
 
+    def turn_page(self, delta):
+        if self.shown_files is None:
+            return
+        self.page = max(0, self.page + delta)
+        self.set_scratch_file_list(*self.shown_files)
+
     def on_done_open(self, text):
         self.panel_was_closed()
 
@@ -102,6 +166,8 @@ class PromptOpenFilePath(sublime_plugin.WindowCommand):
 
     def panel_was_closed(self):
         self.last_text = None
+        if PROMPTS.get(self.window.id()) is self:
+            del PROMPTS[self.window.id()]
         self.close_scratch_file_list_if_exists()
 
     def get_view_content(self):
@@ -119,6 +185,12 @@ class PromptOpenFilePath(sublime_plugin.WindowCommand):
             self.scratch_file_list_buffer = self.window.new_file()
             self.scratch_file_list_buffer.set_scratch(True)
 
+        self.shown_files = (fname, all_files, completion_files)
+        # the viewport is measured once per redraw, and each section only lays out the files that fit in it.
+        # the first section is the one that's paged
+        view_width_chars, view_height_chars = self.get_viewport_chars()
+        page_rows = view_height_chars + PAGE_MARGIN_ROWS
+
         titles = []
         highlights = []
         rows = []
@@ -127,7 +199,8 @@ class PromptOpenFilePath(sublime_plugin.WindowCommand):
             titles.append(len(rows))
             rows.append(u"%d files can be chosen:" % (len(completion_files),))
             rows.append(u"")
-            rows += self.create_file_list(completion_files)
+            file_list, self.page = self.create_file_list(completion_files, view_width_chars, page_rows, self.page)
+            rows += file_list
             rows.append(u"")
         elif fname and not completion_files:
             titles.append(len(rows))
@@ -135,48 +208,106 @@ class PromptOpenFilePath(sublime_plugin.WindowCommand):
             rows.append(u"")
             rows.append(u"No match for file name '{}'".format(fname))
             rows.append(u"")
+            indexed_matches = self.get_indexed_matches(fname)
+            if indexed_matches is None:
+                rows.append(u"Searching elsewhere...")
+                rows.append(u"")
+            elif indexed_matches:
+                titles.append(len(rows))
+                rows.append(u"Matches elsewhere:")
+                rows.append(u"")
+                rows += indexed_matches
+                rows.append(u"")
 
         if all_files:
+            paged = not titles
             titles.append(len(rows))
             rows.append(u"%d files in the directory:" % (len(all_files),))
             rows.append(u"")
-            rows += self.create_file_list(all_files)
+            if paged:
+                file_list, self.page = self.create_file_list(all_files, view_width_chars, page_rows - len(rows),
+                                                             self.page)
+                rows += file_list
+            elif len(rows) < page_rows:  # don't lay out files that would be below the fold anyway
+                rows += self.create_file_list(all_files, view_width_chars, page_rows - len(rows))[0]
         else:
             rows.append(u"No files found in current directory")
 
+        contents = "\n".join(rows)
+        if contents == self.scratch_contents:  # nothing changed, don't redraw
+            return
+        self.scratch_contents = contents
         self.scratch_file_list_buffer.run_command('open_file_path_set_buffer_contents',
-                                                  dict(contents="\n".join(rows), titles=titles, highlights=highlights))
-
-    def create_file_list(self, files):
+                                                  dict(contents=contents, titles=titles, highlights=highlights))
+
+    def get_indexed_matches(self, fname):
+        """
+        :returns: the matches of fname in the path index, or None while they're searched for in the background.
+                  the file list is redrawn with them when they're found, unless the user typed on in the meantime
+        """
+        if len(fname) < 2:
+            return []
+        if self.indexed_matches is not None and self.indexed_matches[0] == fname:
+            return self.indexed_matches[1]
+        change_count = self.change_count
+
+        def done(matches):
+            if change_count != self.change_count or PROMPTS.get(self.window.id()) is not self:
+                return
+            self.indexed_matches = (fname, matches)
+            self.set_scratch_file_list(*self.shown_files)
+        run_in_background(("open_file_path", self.window.id()), None,
+                          lambda task: search_path_index(fname, MAX_INDEXED_MATCHES), done)
+        return None
+
+    def get_viewport_chars(self):
+        """:returns: (width, height) of the file list view, in characters"""
         vp_width, vp_height = self.scratch_file_list_buffer.viewport_extent()
         view_height_chars = int(floor(vp_height / self.scratch_file_list_buffer.line_height()))
         view_width_chars = int(floor(vp_width / self.scratch_file_list_buffer.em_width()))
-
-        files = sorted(files)
-        num_files = len(files)
-        file_max_len = max(len(f) for f in files) if files else 0
-        col_size = file_max_len + 5
-        max_num_cols = max(1, int(floor(float(view_width_chars) / col_size)))
-
-        num_rows = -1
-        num_cols = max_num_cols
-        for n_cols in range(max_num_cols):
-            num_rows = int(ceil(float(num_files) / (n_cols + 1)))
-            if num_rows <= view_height_chars - 5:
-                num_cols = n_cols + 1
-
-        if num_rows == -1:
-            num_cols = max_num_cols
-            num_rows = int(ceil(float(num_files) / num_cols))
-
-        rows = [u"" for i in range(num_rows)]
-        files_i = 0
-        for c in range(num_cols):
-            for r in range(min(num_rows, num_files - c * num_rows)):
-                rows[r] += files[files_i].ljust(col_size)
-                files_i += 1
-        rows = [r.strip() for r in rows]
-        return rows
+        return view_width_chars, view_height_chars
+
+    def layout_columns(self, files, start, view_width_chars, max_rows):
+        """
+        lays the files from start on out in columns, like ls, in at most max_rows rows.
+        :returns: (rows, number of files laid out)
+        """
+        # the column width is measured on the files that can possibly be shown, not on the whole directory
+        max_num_cols = max(1, view_width_chars // MIN_COLUMN_SIZE)
+        col_size = max(len(f) for f in files[start:start + max_rows * max_num_cols]) + 5
+        num_cols = max(1, int(floor(float(view_width_chars) / col_size)))
+        shown = files[start:start + max_rows * num_cols]
+        num_rows = int(ceil(float(len(shown)) / num_cols))
+        columns = [[name.ljust(col_size) for name in shown[c * num_rows:(c + 1) * num_rows]] for c in range(num_cols)]
+        return [u"".join(cells).rstrip() for cells in zip_longest(*columns, fillvalue=u"")], len(shown)
+
+    def create_file_list(self, files, view_width_chars, max_rows, page=0):
+        """
+        lays the files out in columns, a page of max_rows rows at a time, so the cost depends on the size of the view
+        and not on the size of the directory. a last row tells how to get to the other pages
+        :returns: (rows, the page shown), which is the last page if there are fewer pages than page
+        """
+        if not files:
+            return [], 0
+        max_rows = max(1, max_rows)
+        rows, count = self.layout_columns(files, 0, view_width_chars, max_rows)
+        if count == len(files):
+            return rows, 0
+        # a page's column width depends on its own files, so each page starts where the previous one ended
+        start, shown_page = 0, 0
+        while True:
+            rows, count = self.layout_columns(files, start, view_width_chars, max(1, max_rows - 1))
+            if shown_page == page or start + count == len(files):
+                break
+            start, shown_page = start + count, shown_page + 1
+        remaining = len(files) - start - count
+        footer = [u"page %d" % (shown_page + 1,)]
+        if remaining:
+            footer.append(u"%d more, page down for the next page" % (remaining,))
+        if shown_page:
+            footer.append(u"page up for the previous one")
+        rows.append(u"... " + u", ".join(footer))
+        return rows, shown_page
 
     def close_scratch_file_list_if_exists(self):
         if self.scratch_file_list_buffer:
@@ -197,11 +328,18 @@ class PromptOpenFilePath(sublime_plugin.WindowCommand):
         return sys.executable
 
 
+class OpenFilePathPage(sublime_plugin.WindowCommand):
+    """ shows the next (or previous) page of the Open file list, bound to page down/up in its input panel """
+    def run(self, forward=True):
+        prompt = PROMPTS.get(self.window.id())
+        if prompt is not None:
+            prompt.turn_page(1 if forward else -1)
+
+
 class OpenFilePathSetBufferContentsCommand(sublime_plugin.TextCommand):
     def run(self, edit, contents, titles, highlights, block=False):
         self.view.set_read_only(False)
-        self.view.erase(edit, sublime.Region(0, self.view.size()))
-        self.view.insert(edit, 0, contents)
+        self.view.replace(edit, sublime.Region(0, self.view.size()), contents)
 
         def line_to_region(line):
             tp = self.view.text_point(line, 0)
@@ -0,0 +1,99 @@
+import re
+from array import array
+from bisect import bisect_right
+from itertools import accumulate, chain, islice
+
+# log records start with a digit (the timestamp), continuation lines (e.g. tracebacks) don't
+RECORD_START = re.compile(r"^\d", re.MULTILINE)
+
+
+def get_record_starts(text):
+    starts = [match.start() for match in RECORD_START.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)  # leading continuation lines are treated as a record of their own
+    return starts
+
+
+def get_record_start(text, position):
+    """:returns: the start of the record containing position"""
+    while True:
+        start = text.rfind("\n", 0, position) + 1
+        if start == 0 or text[start:start + 1].isdigit():
+            return start
+        position = start - 1
+
+
+def get_record_end(text, position):
+    """:returns: the end of the record containing position (the start of the next one)"""
+    match = RECORD_START.search(text, text.find("\n", position) + 1 or len(text))
+    return len(text) if match is None else match.start()
+
+
+class RecordIndex(object):
+    """
+    Sorted start offsets of all the records in a text, so finding the record around an offset is a bisect.
+    Text appended later (a growing log) is indexed incrementally with append()
+    """
+    def __init__(self, text=""):
+        self.starts = array('Q', [0])
+        self.size = 0
+        self._last_line = ""  # the (possibly incomplete) last line, needed to index appended text correctly
+        self.append(text)
+
+    def append(self, text):
+        if not text:
+            return
+        base = self.size - len(self._last_line)
+        text = self._last_line + text
+        self.starts.extend(base + match.start() for match in RECORD_START.finditer(text)
+                           if base + match.start() > self.starts[-1])
+        self.size = base + len(text)
+        self._last_line = text[text.rfind("\n") + 1:]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def find(self, position):
+        """:returns: the index of the record containing position"""
+        return bisect_right(self.starts, position) - 1
+
+    def get_record(self, index):
+        """:returns: (start, end) of the record, where end is the start of the next record"""
+        end = self.starts[index + 1] if index + 1 < len(self.starts) else self.size
+        return self.starts[index], end
+
+    def record_at(self, position):
+        return self.get_record(self.find(position))
+
+
+class LineIndex(object):
+    """
+    Sorted start offsets of all the lines in a text, so mapping an offset to its row (and back) is a bisect.
+    Text appended later is indexed incrementally with append()
+    """
+    def __init__(self, text=""):
+        self.starts = array('Q', [0])
+        self.size = 0
+        self.append(text)
+
+    def append(self, text):
+        if not text:
+            return
+        # every newline starts a line right after it. split and accumulate find them all in a single pass in C
+        lengths = (len(line) + 1 for line in text.split("\n")[:-1])
+        self.starts.extend(islice(accumulate(chain([self.size], lengths)), 1, None))
+        self.size += len(text)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def row(self, position):
+        """:returns: the row of the line containing position"""
+        return bisect_right(self.starts, position) - 1
+
+    def point(self, row):
+        """:returns: the offset of the start of the row"""
+        return self.starts[max(0, min(row, len(self.starts) - 1))]
+
+    def is_line_start(self, position):
+        return self.starts[self.row(position)] == position
@@ -0,0 +1,74 @@
+import sublime, sublime_plugin
+import re
+import threading
+
+# every result line links back to its source, like sublime's own "Find Results": path:line: text
+RESULT_LINE_PATTERN = re.compile(r"^(\S.*?):(\d+): ")
+
+
+def format_result(filepath, line_number, text):
+    return "{}:{}: {}\n".format(filepath, line_number, text.rstrip("\n"))
+
+
+def new_results_view(window, name):
+    view = window.new_file()
+    view.set_scratch(True)
+    view.set_name(name)
+    settings = view.settings()
+    settings.set("word_wrap", False)
+    settings.set("result_file_regex", RESULT_LINE_PATTERN.pattern)
+    return view
+
+
+def append_to_results_view(view, contents, wait=False, task=None):
+    """
+    can be called from any thread, the text is appended on the main thread in a single insert.
+    with wait=True, blocks until it was inserted, so a fast producer can't queue up unbounded amounts of text.
+    with a task, the text is dropped if the task was superseded by then: the newer task may have cleared the view
+    """
+    if not contents:
+        return
+    inserted = threading.Event()
+
+    def append():
+        if task is None or not task.cancelled:  # checked on the main thread, where the views are cleared too
+            view.run_command("append_results", dict(contents=contents))
+        inserted.set()
+
+    sublime.set_timeout(append, 0)
+    if wait:
+        inserted.wait()
+
+
+def clear_results_view(view, task=None):
+    """ to be called from a background thread, blocks until the view is empty (unless the task was superseded) """
+    cleared = threading.Event()
+
+    def clear():
+        if task is None or not task.cancelled:
+            view.run_command("clear_results")
+        cleared.set()
+
+    sublime.set_timeout(clear, 0)
+    cleared.wait()
+
+
+class AppendResultsCommand(sublime_plugin.TextCommand):
+    def run(self, edit, contents):
+        self.view.insert(edit, self.view.size(), contents)
+
+
+class ClearResultsCommand(sublime_plugin.TextCommand):
+    def run(self, edit):
+        self.view.erase(edit, sublime.Region(0, self.view.size()))
+
+
+class OpenResultCommand(sublime_plugin.TextCommand):
+    def run(self, edit):
+        line = self.view.substr(self.view.line(self.view.sel()[0]))
+        match = RESULT_LINE_PATTERN.match(line)
+        if match is None:
+            sublime.status_message("not a search result")
+            return
+        filepath, line_number = match.groups()
+        self.view.window().open_file("{}:{}".format(filepath, line_number), sublime.ENCODED_POSITION)
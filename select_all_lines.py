@@ -1,31 +1,65 @@
 import sublime, sublime_plugin
+from .view_index import get_view_index
+
+# selections bigger than this are added in chunks, letting the UI breathe (and the user cancel) in between
+CHUNK_SIZE = 100000
+# view id -> the latest selection being applied in chunks, an older one stops when it sees it was superseded
+APPLYING = dict()
+
 
 class SelectAllLinesCommand(sublime_plugin.TextCommand):
-    def select_lines(self, start_row, direction):
-        row = start_row
-        last_row = self.view.rowcol(self.view.size())[0]
-        while True:
-            text_point = self.view.text_point(row, 0)
-            if row > last_row or row < 0:
-                break
-            self.view.sel().add(sublime.Region(text_point))
-            row += direction
-
-    def clear_no_line_beginnings(self):
-        for region in reversed(self.view.sel()):
-            if self.view.rowcol(region.begin())[1] != 0:
-                self.view.sel().subtract(region)
+    def select_lines(self, line_starts, start_row, direction):
+        """:returns: the regions of the line beginnings from start_row in direction, up to the cap, nearest first"""
+        max_lines = sublime.load_settings("Infinidat.sublime-settings").get("select-all-lines-max", 1000000)
+        if direction == 1:
+            points = line_starts[start_row:start_row + max_lines]
+            capped = len(line_starts) - start_row > max_lines
+        else:
+            points = reversed(line_starts[max(0, start_row + 1 - max_lines):start_row + 1])
+            capped = start_row + 1 > max_lines
+        if capped:
+            sublime.status_message("Selecting only the nearest {} lines".format(max_lines))
+        return [sublime.Region(point) for point in points]
+
+    def clear_no_line_beginnings(self, lines):
+        """:returns: the current selections that start at a line beginning"""
+        return [region for region in self.view.sel() if lines.is_line_start(region.begin())]
+
+    def apply_selection(self, regions):
+        selection = self.view.sel()
+        selection.clear()
+        selection.add_all(regions[:CHUNK_SIZE])
+        if len(regions) <= CHUNK_SIZE:
+            return
+        view_id = self.view.id()
+        token = APPLYING[view_id] = object()
+
+        def add_chunk(start):
+            # stop if a newer command took over, or the user changed the selection in the meantime
+            if APPLYING.get(view_id) is not token or len(selection) != expected[0]:
+                return
+            selection.add_all(regions[start:start + CHUNK_SIZE])
+            expected[0] = len(selection)
+            if start + CHUNK_SIZE < len(regions):
+                sublime.status_message("Selecting lines... {}%".format((start + CHUNK_SIZE) * 100 // len(regions)))
+                sublime.set_timeout(lambda: add_chunk(start + CHUNK_SIZE), 0)
+            else:
+                del APPLYING[view_id]
+
+        expected = [len(selection)]
+        sublime.set_timeout(lambda: add_chunk(CHUNK_SIZE), 0)
 
     def run(self, edit, direction):
+        APPLYING.pop(self.view.id(), None)  # supersede a selection still being applied
         if direction == "forward":
             direction = 1
-            start_selection = self.view.sel()[-1]
+            start_point = self.view.sel()[-1].begin()
         elif direction == "backward":
             direction = -1
-            start_selection = self.view.sel()[0]
+            start_point = self.view.sel()[0].begin()
         else:
             direction = 1
-            start_selection = self.view.line(0)
-        start_row = self.view.rowcol(start_selection.begin())[0]
-        self.clear_no_line_beginnings()
-        self.select_lines(start_row, direction)
+            start_point = 0
+        lines = get_view_index(self.view).lines
+        regions = self.clear_no_line_beginnings(lines) + self.select_lines(lines.starts, lines.row(start_point), direction)
+        self.apply_selection(regions)
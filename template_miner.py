@@ -0,0 +1,203 @@
+import re
+from collections import OrderedDict
+from .grep_engine import iter_complete_blocks
+from .timestamps import TIMESTAMP_PATTERN
+
+WILDCARD = "<*>"
+MAX_MESSAGE_SIZE = 1024
+# the first line of every log record: it starts with a digit (the timestamp), like record_index.RECORD_START.
+# groups: the timestamp, and the (truncated) message after it
+RECORD_LINE = re.compile(r"^(?=\d)({})?\d*([^\n]{{0,{}}})[^\n]*".format(TIMESTAMP_PATTERN.pattern, MAX_MESSAGE_SIZE),
+                         re.MULTILINE)
+# numbers, and whatever follows them in the same word (hex ids, units), are variables, not part of the template
+VARIABLE = re.compile(r"\d\w*")
+# messages that differ only in which digits they have (not in where) are looked up in the cache without masking
+# them: replacing every digit with 0 with str.translate is many times faster than substituting every number with a
+# regex, and since VARIABLE only depends on where the digits are, such messages always get the same mask
+DIGITS = str.maketrans("123456789", "000000000")
+MAX_CACHED_MESSAGES = 20000
+
+
+class Template(object):
+    """ a cluster of log messages that differ only in their variable tokens """
+    __slots__ = ("id", "tokens", "count", "first", "last", "examples", "leaf", "evicted")
+
+    def __init__(self, id, tokens, leaf):
+        self.id = id
+        self.tokens = tokens
+        self.count = 0
+        self.first = self.last = ""
+        self.examples = []  # (line number, first line) of the first records of the template
+        self.leaf = leaf
+        self.evicted = False
+
+    def __str__(self):
+        return " ".join(self.tokens)
+
+
+class TemplateMiner(object):
+    """
+    Online log template mining, in the spirit of Drain: messages are routed through a fixed-depth prefix tree
+    (token count, then the first tokens) to a short list of templates, and join the most similar one.
+    At most max_templates are kept; the least recently seen ones are dropped (only counted) to bound memory.
+    Messages seen before skip the tree altogether: first by the shape of their digits, and if that's new (other
+    lengths of numbers, hex ids), by their masked text
+    """
+    def __init__(self, similarity=0.5, prefix_tokens=2, max_children=100, max_templates=1000, max_examples=3):
+        self.similarity = similarity
+        self.prefix_tokens = prefix_tokens
+        self.max_children = max_children
+        self.max_templates = max_templates
+        self.max_examples = max_examples
+        self.templates = OrderedDict()  # id -> Template, least recently seen first
+        self.records = 0
+        self.evicted_templates = 0
+        self.evicted_records = 0
+        self._root = dict()
+        self._cache = dict()  # message with every digit replaced by 0 -> Template
+        self._masked_cache = dict()  # message with its variables masked -> Template
+        self._next_id = 0
+
+    def _get_leaf(self, tokens):
+        node = self._root.setdefault(len(tokens), dict())
+        for index, token in enumerate(tokens[:self.prefix_tokens]):
+            if WILDCARD in token or (token not in node and len(node) >= self.max_children):
+                token = WILDCARD
+            last = index == min(len(tokens), self.prefix_tokens) - 1
+            node = node.setdefault(token, [] if last else dict())
+        return node if isinstance(node, list) else node.setdefault(WILDCARD, [])
+
+    def _match(self, tokens):
+        leaf = self._get_leaf(tokens)
+        best, best_score, best_wildcards = None, -1.0, -1
+        for template in leaf:
+            same = wildcards = 0
+            for template_token, token in zip(template.tokens, tokens):
+                if template_token == WILDCARD:
+                    wildcards += 1
+                elif template_token == token:
+                    same += 1
+            score = same / float(len(tokens)) if tokens else 1.0
+            if score > best_score or (score == best_score and wildcards > best_wildcards):
+                best, best_score, best_wildcards = template, score, wildcards
+        if best is not None and best_score >= self.similarity:
+            best.tokens = [template_token if template_token == token else WILDCARD
+                           for template_token, token in zip(best.tokens, tokens)]
+            self.templates.move_to_end(best.id)
+            return best
+        template = Template(self._next_id, tokens, leaf)
+        leaf.append(template)
+        self.templates[template.id] = template
+        self._next_id += 1
+        if len(self.templates) > self.max_templates:
+            self._evict()
+        return template
+
+    def _get_template(self, message):
+        masked = VARIABLE.sub(WILDCARD, message)
+        template = self._masked_cache.get(masked)
+        if template is None or template.evicted:
+            if len(self._masked_cache) >= MAX_CACHED_MESSAGES:
+                self._masked_cache.clear()
+            template = self._masked_cache[masked] = self._match(masked.split())
+        else:
+            self.templates.move_to_end(template.id)
+        return template
+
+    def _evict(self):
+        _, template = self.templates.popitem(last=False)
+        template.leaf.remove(template)
+        template.evicted = True
+        self.evicted_templates += 1
+        self.evicted_records += template.count
+
+    def add_block(self, block, line_number=1):
+        """
+        adds all the records of a block of whole lines, whose first line is line_number.
+        The records are split out of the whole block by a regex, and their digits replaced all at once, so the python
+        loop is mostly a cache lookup per record. Only messages missing from the cache are masked
+        """
+        lines = RECORD_LINE.findall(block)
+        if not lines:
+            return
+        keys = "\n".join(message for _, message in lines).translate(DIGITS).split("\n")
+        cache, move_to_end, max_examples = self._cache, self.templates.move_to_end, self.max_examples
+        examples = []
+        for index, key in enumerate(keys):
+            template = cache.get(key)
+            if template is None or template.evicted:
+                if len(cache) >= MAX_CACHED_MESSAGES:
+                    cache.clear()
+                template = cache[key] = self._get_template(lines[index][1])
+            else:
+                move_to_end(template.id)
+            template.count += 1
+            timestamp = lines[index][0]
+            if timestamp:
+                if timestamp > template.last:
+                    template.last = timestamp
+                if not template.first or timestamp < template.first:
+                    template.first = timestamp
+            if len(template.examples) < max_examples:
+                template.examples.append(None)  # filled in below, finding lines is only needed for examples
+                examples.append((index, template, len(template.examples) - 1))
+        self.records += len(lines)
+        if not examples:
+            return
+        counted = 0
+        matches = RECORD_LINE.finditer(block)
+        match_index, match = 0, next(matches)
+        for index, template, example_index in examples:
+            while match_index < index:
+                match_index, match = match_index + 1, next(matches)
+            line_number += block.count("\n", counted, match.start())
+            counted = match.start()
+            end = block.find("\n", counted)
+            line = block[counted:len(block) if end == -1 else end]
+            template.examples[example_index] = (line_number, line[:MAX_MESSAGE_SIZE])
+
+
+def mine_templates(chunks, miner=None, task=None):
+    """ streams the chunks through a TemplateMiner, one block of whole lines at a time. :returns: the miner """
+    if miner is None:
+        miner = TemplateMiner()
+    line_number = 1
+    for block in iter_complete_blocks(chunks, lambda text: text.rfind("\n") + 1):
+        if task is not None:
+            task.progress("Mining log templates: {} records, {} templates".format(miner.records,
+                                                                                  len(miner.templates)))
+        miner.add_block(block, line_number)
+        line_number += block.count("\n")
+    return miner
+
+
+if __name__ == "__main__":
+    # benchmark, from the directory containing the package: python -m <package>.template_miner [lines ...]
+    import random
+    import sys
+    from time import time
+    counts = [int(arg) for arg in sys.argv[1:]] or [1000000]
+    # every line has new variables: numbers of any length, hex ids and other ids with letters in them
+    formats = ["volume {} created in pool {} size={}GB", "request {} from host 10.0.{}.{} took {}ms",
+               "cache flush of {} pages on node {} done", "retrying io to 0x{:x} ({} attempts)",
+               "user admin{} logged in from {}", "snapshot snap_{:x} of vol{} deleted",
+               "replication link {} state changed to {}", "disk {} latency {}us above threshold",
+               "session {:x}-{:x} opened for {}", "task 0x{:x} of job {}a{} queued"]
+    header = "2015-04-08 12:{:02}:{:02}.{:06} izbox[1]pid={}:[main] tid={}:2 tag=x module=io level=INFO msg="
+    traceback = "Traceback (most recent call last):\n  File \"io.py\", line 1\nIOError: failed\n"
+    random.seed(1)
+    for count in counts:
+        blocks = []
+        for first in range(0, count, 10000):
+            lines = [header.format(index // 60 % 60, index % 60, index % 10 ** 6, index % 97, index % 13) +
+                     formats[index % len(formats)].format(*[random.getrandbits(random.choice([8, 20, 40]))
+                                                            for _ in range(4)]) + "\n"
+                     for index in range(first, min(first + 10000, count))]
+            blocks.append("".join(lines) + traceback)
+        start = time()
+        miner = mine_templates(blocks)
+        elapsed = time() - start
+        print("{} records: {:.2f} seconds, {:.0f} records/s, {} templates".format(
+              miner.records, elapsed, miner.records / elapsed, len(miner.templates)))
+    for template in sorted(miner.templates.values(), key=lambda template: -template.count):
+        print(template.count, template.first, template.last, template, template.examples[0])
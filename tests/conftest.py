@@ -0,0 +1,10 @@
+import os
+import sys
+import types
+
+# the plugin is a sublime package: its modules import each other relatively, so they are imported as submodules
+# of a package named after nothing in particular. only the modules that don't import sublime can be tested
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+package = types.ModuleType("infinidat")
+package.__path__ = [PACKAGE_DIR]
+sys.modules.setdefault("infinidat", package)
@@ -0,0 +1,31 @@
+from datetime import datetime
+from infinidat.activity_index import ActivityIndex, Activity, bin_file
+
+LOG = b"""2024-01-01 10:00:01 started
+2024-01-01 10:00:30 ERROR failed
+Traceback (most recent call last):
+  File "io.py", line 1
+1970-01-01 00:00:00 after a clock reset
+2024-01-01 10:02:00 done
+"""
+
+
+def test_bin_file_keeps_only_minutes_with_records(tmpdir):
+    filepath = str(tmpdir.join("izbox.log"))
+    with open(filepath, "wb") as fd:
+        fd.write(LOG)
+    activity = bin_file(filepath)
+    assert activity.minutes == {datetime(1970, 1, 1, 0, 0): [1, 0, 0],
+                                datetime(2024, 1, 1, 10, 0): [2, 1, 1],
+                                datetime(2024, 1, 1, 10, 2): [1, 0, 0]}
+    index = ActivityIndex(str(tmpdir.join("index.json")))
+    assert index.get(filepath).minutes == activity.minutes
+    index.save()
+    assert ActivityIndex(str(tmpdir.join("index.json"))).get(filepath, scan=None).minutes == activity.minutes
+
+
+def test_add():
+    total = Activity({datetime(2024, 1, 1, 10, 0): [1, 1, 0]})
+    total.add(Activity({datetime(2024, 1, 1, 10, 0): [2, 0, 1], datetime(2024, 1, 2, 10, 0): [1, 0, 0]}))
+    assert total.minutes == {datetime(2024, 1, 1, 10, 0): [3, 1, 1], datetime(2024, 1, 2, 10, 0): [1, 0, 0]}
+    assert total.start == datetime(2024, 1, 1, 10, 0)
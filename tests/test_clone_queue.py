@@ -0,0 +1,90 @@
+import os
+import subprocess
+import threading
+import pytest
+from infinidat import clone_queue
+from infinidat.clone_queue import CloneOptions, CloneQueue, DONE, FAILED
+
+
+def make_bare_repo(path):
+    """ a bare repository with one commit, at path """
+    work = path + ".work"
+    subprocess.check_call(["git", "init", "-q", work])
+    with open(os.path.join(work, "README"), "w") as fd:
+        fd.write(os.path.basename(path))
+    subprocess.check_call(["git", "-C", work, "add", "README"])
+    subprocess.check_call(["git", "-C", work, "-c", "user.name=test", "-c", "user.email=test@example.com",
+                           "commit", "-q", "-m", "first"])
+    subprocess.check_call(["git", "clone", "-q", "--bare", work, path])
+    return "file://" + path
+
+
+@pytest.fixture
+def repos(tmpdir):
+    return dict((name, make_bare_repo(str(tmpdir.join("remote", name)))) for name in
+                ["group1/utils.git", "group2/utils.git", "group1/app.git"])
+
+
+@pytest.fixture
+def destination(tmpdir):
+    return str(tmpdir.mkdir("clones"))
+
+
+def run_batch(jobs, retries=0):
+    """ clones (name, url, destination) with git, and returns the jobs once the whole batch finished """
+    finished = threading.Event()
+    batches = []
+
+    def on_update(queue, job):
+        batch = queue.take_finished_batch()
+        if batch is not None:
+            batches.append(batch)
+            finished.set()
+
+    queue = CloneQueue(CloneOptions("projector", depth=1), max_workers=2, retries=retries, on_update=on_update)
+    for name, url, destination in jobs:
+        queue.add(name, url, destination)
+    assert finished.wait(60)
+    return batches[0]
+
+
+def test_clones(repos, destination):
+    jobs = run_batch([("group1/app", repos["group1/app.git"], destination),
+                      ("group1/utils", repos["group1/utils.git"], destination)])
+    assert [job.state for job in jobs] == [DONE, DONE]
+    assert sorted(os.listdir(destination)) == ["app", "utils"]
+    assert all(job.size > 0 for job in jobs)
+
+
+def test_same_dirname_is_rejected(repos, destination):
+    jobs = run_batch([("group1/utils", repos["group1/utils.git"], destination),
+                      ("group2/utils", repos["group2/utils.git"], destination)])
+    assert [job.state for job in jobs] == [DONE, FAILED]
+    with open(os.path.join(destination, "utils", "README")) as fd:
+        assert fd.read() == "utils.git"
+    assert "another repository" in jobs[1].error
+
+
+def test_failed_clone_is_removed(tmpdir, destination, monkeypatch):
+    monkeypatch.setattr(clone_queue, "RETRY_DELAY", 0)
+    jobs = run_batch([("missing", "file://" + str(tmpdir.join("missing.git")), destination)], retries=1)
+    assert jobs[0].state == FAILED
+    assert jobs[0].attempts == 2
+    assert os.listdir(destination) == []
+
+
+def test_existing_directory_is_kept(repos, destination):
+    os.makedirs(os.path.join(destination, "utils"))
+    with open(os.path.join(destination, "utils", "mine"), "w") as fd:
+        fd.write("not a clone")
+    jobs = run_batch([("group1/utils", repos["group1/utils.git"], destination)])
+    assert jobs[0].state == FAILED
+    assert "already exists" in jobs[0].error
+    assert os.listdir(os.path.join(destination, "utils")) == ["mine"]
+
+
+def test_get_command():
+    job = clone_queue.CloneJob("group/app", "git@gitlab:group/app.git", "/clones")
+    assert CloneOptions("projector").get_command(job) == (["projector", "repository", "clone", job.url], "/clones")
+    argv, cwd = CloneOptions("projector", depth=1).get_command(job)
+    assert argv == ["git", "clone", "--depth", "1", "--no-single-branch", job.url, "/clones/app"]
@@ -0,0 +1,95 @@
+import io
+import os
+import sys
+import json
+import stat
+import time
+import pytest
+from infinidat import gitlab_repos
+from infinidat.gitlab_repos import ListingFailed, list_repositories, iter_repo_items, load_cache, save_cache, \
+    update_cache, is_cache_fresh, get_binary_cache_path, get_sorted_items
+
+REPOSITORIES = dict(("group/repo{}".format(i), "git@gitlab:group/repo{}.git".format(i)) for i in range(250))
+REPOSITORIES['quo"te\'s'] = "git@gitlab:hé.git"
+
+FAKE_PROJECTOR = """#!{python}
+import sys
+output = {output!r}
+# written in small pieces, so items (and utf-8 characters) are split across reads
+for start in range(0, len(output), 100):
+    sys.stdout.buffer.write(output[start:start + 100])
+    sys.stdout.flush()
+sys.exit({exit_code})
+"""
+
+
+def make_projector(tmpdir, repo_list, exit_code=0):
+    """ a fake projector, printing the repositories as a python dict like 'projector gitlab list' does """
+    path = str(tmpdir.join("projector"))
+    with open(path, "w") as f:
+        f.write(FAKE_PROJECTOR.format(python=sys.executable, output=repr(repo_list).encode("utf-8"),
+                                      exit_code=exit_code))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    return path
+
+
+def test_list_repositories(tmpdir):
+    progress = []
+    assert list_repositories(make_projector(tmpdir, REPOSITORIES), progress.append) == REPOSITORIES
+    assert progress == [100, 200]
+
+
+def test_failed_listing(tmpdir):
+    with pytest.raises(ListingFailed):
+        list_repositories(make_projector(tmpdir, REPOSITORIES, exit_code=1))
+
+
+def test_items_split_across_chunks():
+    text = json.dumps(REPOSITORIES)
+    chunks = [text[start:start + 7] for start in range(0, len(text), 7)]
+    assert dict(iter_repo_items(chunks)) == REPOSITORIES
+
+
+def test_cache_round_trip(tmpdir):
+    cache_file = str(tmpdir.join(".tkc"))
+    assert load_cache(cache_file) == []
+    assert not is_cache_fresh(cache_file, 3600)
+    save_cache(cache_file, REPOSITORIES)
+    assert load_cache(cache_file) == get_sorted_items(REPOSITORIES)
+    assert is_cache_fresh(cache_file, 3600)
+    assert not os.path.exists(cache_file)  # older versions read it as json
+
+
+def test_json_cache_of_older_versions(tmpdir):
+    cache_file = str(tmpdir.join(".tkc"))
+    with open(cache_file, "w") as f:
+        json.dump(REPOSITORIES, f)
+    assert load_cache(cache_file) == get_sorted_items(REPOSITORIES)
+    update_cache(cache_file, REPOSITORIES, REPOSITORIES)
+    assert os.path.exists(get_binary_cache_path(cache_file))
+    with open(cache_file) as f:
+        assert json.load(f) == REPOSITORIES
+
+
+def test_other_binary_version_is_ignored(tmpdir, monkeypatch):
+    cache_file = str(tmpdir.join(".tkc"))
+    save_cache(cache_file, REPOSITORIES)
+    data = io.BytesIO()
+    monkeypatch.setattr(gitlab_repos, "CACHE_VERSION", gitlab_repos.CACHE_VERSION + 1)
+    gitlab_repos.write_binary_cache(data, get_sorted_items(REPOSITORIES))
+    assert gitlab_repos.read_binary_cache(data.getvalue()) == get_sorted_items(REPOSITORIES)
+    monkeypatch.undo()
+    assert gitlab_repos.read_binary_cache(data.getvalue()) == []
+
+
+def test_update_cache(tmpdir):
+    cache_file = str(tmpdir.join(".tkc"))
+    save_cache(cache_file, REPOSITORIES)
+    binary_path = get_binary_cache_path(cache_file)
+    os.utime(binary_path, (0, 0))
+    assert update_cache(cache_file, REPOSITORIES, REPOSITORIES) == (set(), set())
+    assert time.time() - os.path.getmtime(binary_path) < 60  # touched, not rewritten
+    changed = dict(REPOSITORIES, new="git@gitlab:new.git")
+    del changed["group/repo0"]
+    assert update_cache(cache_file, REPOSITORIES, changed) == ({"new"}, {"group/repo0"})
+    assert load_cache(cache_file) == get_sorted_items(changed)
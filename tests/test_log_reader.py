@@ -0,0 +1,26 @@
+import bz2
+import gzip
+import io
+import lzma
+import pytest
+from infinidat import log_reader
+from infinidat.log_reader import open_log
+
+COMPRESS = {".gz": gzip.compress, ".bz2": bz2.compress, ".xz": lzma.compress}
+
+
+@pytest.mark.parametrize("suffix", sorted(COMPRESS))
+def test_concatenated_streams_on_a_read_boundary(tmpdir, monkeypatch, suffix):
+    first = b"".join(b"2024-01-01 10:00:%02d first stream\n" % i for i in range(60))
+    second = b"".join(b"2024-01-01 10:01:%02d second stream\n" % i for i in range(60))
+    compressed = COMPRESS[suffix](first)
+    # the first stream ends exactly where a read of the compressed file ends
+    monkeypatch.setattr(log_reader, "COMPRESSED_BLOCK_SIZE", len(compressed))
+    filepath = str(tmpdir.join("izbox.log" + suffix))
+    with open(filepath, "wb") as fd:
+        fd.write(compressed + COMPRESS[suffix](second))
+    with open_log(filepath) as fd:
+        assert fd.read() == first + second
+        fd.seek(len(first) + 10)
+        assert fd.read(20) == second[10:30]
+        assert fd.seek(0, io.SEEK_END) == len(first) + len(second)
@@ -0,0 +1,58 @@
+import os
+from infinidat import path_index
+from infinidat.path_index import PathIndex
+
+
+def touch(filepath):
+    if not os.path.isdir(os.path.dirname(filepath)):
+        os.makedirs(os.path.dirname(filepath))
+    open(filepath, "w").close()
+
+
+def test_best_match_after_many_weaker_ones(tmpdir):
+    root = str(tmpdir)
+    for i in range(2000):
+        touch(os.path.join(root, "a", "i-z-l-o-g-{:04d}".format(i)))
+    touch(os.path.join(root, "a", "z", "IzLog.txt"))  # the entries of a subdirectory come after its parent's
+    index = PathIndex([root])
+    index.refresh()
+    assert index.count == 2000 + 1 + 2
+    assert index.search("izlog", 3)[0] == os.path.join(root, "a", "z", "IzLog.txt")
+
+
+def test_directories_and_excludes(tmpdir):
+    root = str(tmpdir)
+    touch(os.path.join(root, "src", "module.py"))
+    touch(os.path.join(root, ".git", "module.py"))
+    index = PathIndex([root])
+    index.refresh()
+    assert index.search("module") == [os.path.join(root, "src", "module.py")]
+    assert index.search("src") == [os.path.join(root, "src") + os.sep, os.path.join(root, "src", "module.py")]
+
+
+def test_refresh_keeps_unchanged_directories(tmpdir):
+    root = str(tmpdir)
+    touch(os.path.join(root, "one", "first.log"))
+    touch(os.path.join(root, "two", "second.log"))
+    index = PathIndex([root])
+    index.refresh()
+    touch(os.path.join(root, "two", "third.log"))
+    os.utime(os.path.join(root, "two"), (0, 1))  # a new mtime, even on filesystems with coarse timestamps
+    index.refresh()
+    assert sorted(index.search("log")) == sorted(os.path.join(root, *parts) for parts in
+                                                 [("one", "first.log"), ("two", "second.log"), ("two", "third.log")])
+    assert index.paths.count("\n") == index.count == 5
+
+
+def test_candidate_passes(tmpdir, monkeypatch):
+    monkeypatch.setattr(path_index, "MAX_CANDIDATES", 10)
+    root = str(tmpdir)
+    for i in range(20):
+        touch(os.path.join(root, "a{:02d}".format(i), "x-m-o-d.txt"))
+    touch(os.path.join(root, "z", "MOD.txt"))
+    index = PathIndex([root])
+    index.refresh()
+    assert index.search("mod", 1) == [os.path.join(root, "z", "MOD.txt")]  # a basename prefix, though found last
+    assert index.search("z" + os.sep + "md") == [os.path.join(root, "z", "MOD.txt")]
+    assert len(index.search("xmod", 100)) == 10
+    assert index.search("missing") == []
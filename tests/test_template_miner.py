@@ -0,0 +1,17 @@
+from infinidat.template_miner import TemplateMiner
+
+HEADER = "2015-04-08 12:00:00.000000 izbox[1]pid=1:[main] tid=1:2 tag=x module=io level=INFO msg="
+
+
+def test_cached_messages_get_their_own_mask():
+    miner = TemplateMiner(similarity=1.0)
+    miner.add_block("".join(HEADER + message + "\n" for message in ["opened abc1def", "opened abcdef",
+                                                                    "opened abc2def", "opened abc1234567def"]))
+    assert sorted((str(template).split()[-1], template.count) for template in miner.templates.values()) == \
+        [("abc<*>", 3), ("abcdef", 1)]
+
+
+def test_hex_ids():
+    miner = TemplateMiner()
+    miner.add_block("".join(HEADER + "retrying io to 0x{:x}\n".format(value) for value in [0xabc, 0x1f2e3d, 0x9]))
+    assert [(str(template).split()[-1], template.count) for template in miner.templates.values()] == [("<*>", 3)]
@@ -0,0 +1,58 @@
+import os
+from datetime import datetime
+import pytest
+from infinidat.timeframe_index import TimeframeIndex
+
+START = datetime(2024, 1, 1, 10, 0, 0)
+FINISH = datetime(2024, 1, 1, 10, 5, 0)
+LATER = datetime(2024, 1, 1, 10, 9, 0)
+
+
+@pytest.fixture
+def log(tmpdir):
+    filepath = str(tmpdir.join("izbox.log"))
+    with open(filepath, "w") as fd:
+        fd.write("2024-01-01 10:00:00 first\n2024-01-01 10:05:00 second\n")
+    return filepath
+
+
+@pytest.fixture
+def index(tmpdir, log):
+    index = TimeframeIndex(str(tmpdir.join("index.json")))
+    index.get(log, lambda filepath: (START, FINISH))
+    return index
+
+
+def append(filepath, text):
+    previous_size = os.path.getsize(filepath)
+    with open(filepath, "a") as fd:
+        fd.write(text)
+    return previous_size, os.path.getsize(filepath)
+
+
+def test_extend(index, log):
+    previous_size, size = append(log, "2024-01-01 10:09:00 third\n")
+    assert index.extend(log, START, previous_size, size, LATER)
+    assert index.get(log, None) == (START, LATER)
+
+
+def test_extend_after_a_gap(index, log):
+    append(log, "2024-01-01 10:07:00 not seen\n")
+    previous_size, size = append(log, "2024-01-01 10:09:00 third\n")
+    assert index.extend(log, START, previous_size, size, LATER)
+    assert index.get(log, None) == (START, LATER)
+    previous_size, size = append(log, "   a continuation line\n")
+    assert index.extend(log, START, previous_size, size, None)
+    assert index.get(log, None) == (START, LATER)
+
+
+def test_extend_needs_the_finish_of_a_gap(index, log):
+    append(log, "2024-01-01 10:07:00 not seen\n")
+    previous_size, size = append(log, "   a continuation line\n")
+    assert not index.extend(log, START, previous_size, size, None)
+
+
+def test_extend_replaced_file(index, log):
+    previous_size, size = append(log, "2024-01-01 10:09:00 third\n")
+    assert not index.extend(log, LATER, previous_size, size, LATER)
+    assert not index.extend(log, START, previous_size, size - 1, LATER)
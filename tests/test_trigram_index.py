@@ -0,0 +1,152 @@
+import os
+import threading
+import pytest
+from infinidat import trigram_index
+from infinidat.trigram_index import TrigramIndex, IndexLock, encode_postings, decode_postings, iter_blocks, \
+    verify, get_bundle_series
+
+
+def write(filepath, data):
+    if not os.path.isdir(os.path.dirname(filepath)):
+        os.makedirs(os.path.dirname(filepath))
+    with open(filepath, "wb") as fd:
+        fd.write(data)
+    return filepath
+
+
+def get_log_dir(root, node="node1"):
+    return os.path.join(root, node, "2024-01-01", "files", "var", "log", "izbox")
+
+
+@pytest.fixture
+def root(tmpdir):
+    return str(tmpdir.mkdir("bundles"))
+
+
+@pytest.fixture
+def index_dir(tmpdir):
+    return str(tmpdir.join("index"))
+
+
+def search(index, text):
+    return [(os.path.basename(filepath), line_number, line) for filepath, _, line_number, line in index.search(text)]
+
+
+@pytest.mark.parametrize("values", [[0], [1, 2, 3], [5, 200, 201, 70000, 2 ** 31]])
+def test_postings_round_trip(values):
+    encoded = encode_postings(values)
+    assert decode_postings(encoded) == values
+    assert decode_postings(memoryview(encoded)) == values
+
+
+def test_iter_blocks(tmpdir, monkeypatch):
+    monkeypatch.setattr(trigram_index, "BLOCK_SIZE", 8)
+    lines = [b"one", b"two", b"a line longer than a block", b"three", b"no newline"]
+    filepath = write(str(tmpdir.join("log")), b"\n".join(lines))
+    blocks = list(iter_blocks(filepath))
+    with open(filepath, "rb") as fd:
+        data = fd.read()
+    assert b"".join(block for _, _, block in blocks) == data
+    for offset, line_number, block in blocks:
+        assert data[offset:offset + len(block)] == block
+        assert data.count(b"\n", 0, offset) + 1 == line_number
+        assert offset == 0 or data[offset - 1:offset] == b"\n"
+
+
+def test_verify(tmpdir, monkeypatch):
+    monkeypatch.setattr(trigram_index, "BLOCK_SIZE", 16)
+    filepath = write(str(tmpdir.join("log")), b"first error\nok\nsecond error here\nok\nok\nthird error")
+    blocks = sorted((offset, len(block), line_number) for offset, line_number, block in iter_blocks(filepath))
+    results = list(verify(filepath, blocks, trigram_index.re.compile(b"error")))
+    assert [(line_number, line) for _, line_number, line in results] == \
+        [(1, "first error"), (3, "second error here"), (6, "third error")]
+    with open(filepath, "rb") as fd:
+        data = fd.read()
+    assert all(data[offset:offset + 5] == b"error" for offset, _, _ in results)
+
+
+def test_update_and_search(root, index_dir):
+    write(os.path.join(get_log_dir(root), "izbox.log"), b"2024 starting\n2024 volume created\n")
+    write(os.path.join(get_log_dir(root, "node2"), "izbox.log.1"), b"2024 volume deleted\n")
+    write(os.path.join(root, "node1", "2024-01-01", "files", "other.log"), b"volume elsewhere\n")
+    files = get_bundle_series(root)
+    assert [os.path.basename(filepath) for filepath in files] == ["izbox.log", "izbox.log.1"]
+    index = TrigramIndex(index_dir)
+    assert index.get_unindexed(files) == files
+    index.update(files)
+    assert index.get_unindexed(files) == []
+    assert sorted(search(index, "volume")) == [("izbox.log", 2, "2024 volume created"),
+                                                ("izbox.log.1", 1, "2024 volume deleted")]
+    assert search(index, "volume created") == [("izbox.log", 2, "2024 volume created")]
+    assert search(index, "missing") == []
+    assert search(TrigramIndex(index_dir), "starting") == [("izbox.log", 1, "2024 starting")]
+
+
+def test_rotation_reuses_entries(root, index_dir):
+    log_dir = get_log_dir(root)
+    write(os.path.join(log_dir, "izbox.log"), b"old lines\n")
+    index = TrigramIndex(index_dir)
+    index.update(get_bundle_series(root))
+    entry = index.files[os.path.join(log_dir, "izbox.log")]
+    os.rename(os.path.join(log_dir, "izbox.log"), os.path.join(log_dir, "izbox.log.1"))
+    write(os.path.join(log_dir, "izbox.log"), b"new lines\n")
+    index.update(get_bundle_series(root))
+    assert index.files[os.path.join(log_dir, "izbox.log.1")]["id"] == entry["id"]
+    assert search(index, "lines") == [("izbox.log", 1, "new lines"), ("izbox.log.1", 1, "old lines")]
+
+
+def test_concurrent_updaters_keep_each_others_files(root, index_dir):
+    log_dir = get_log_dir(root)
+    logs = [write(os.path.join(log_dir, "izbox.log"), b"from the logs\n")]
+    traces = [write(os.path.join(log_dir, "izbox-traces.log"), b"from the traces\n")]
+    first, second = TrigramIndex(index_dir), TrigramIndex(index_dir)
+    first.update(logs)
+    second.update(traces)
+    assert search(TrigramIndex(index_dir), "from") == [("izbox-traces.log", 1, "from the traces"),
+                                                       ("izbox.log", 1, "from the logs")]
+    assert len(set(entry["segment"] for entry in second.files.values())) == 2
+
+
+def test_growing_log_is_compacted(root, index_dir, monkeypatch):
+    monkeypatch.setattr(trigram_index, "BLOCK_SIZE", 16)
+    log_dir = get_log_dir(root)
+    static = write(os.path.join(log_dir, "izbox.log.1"), b"static line\n")
+    growing = write(os.path.join(log_dir, "izbox.log"), b"".join(b"line %d\n" % i for i in range(100)))
+    index = TrigramIndex(index_dir)
+    index.update([static, growing])
+    with open(growing, "ab") as fd:
+        fd.write(b"line 100\n")
+    index.update([static, growing])
+    segments = [name for name in os.listdir(index_dir) if name.endswith(".segment")]
+    assert len(segments) == 2
+    assert index.files[static]["segment"] not in ("0.segment", index.files[growing]["segment"])
+    assert search(index, "static") == [("izbox.log.1", 1, "static line")]
+    assert search(index, "line 100") == [("izbox.log", 101, "line 100")]
+    assert len(search(index, "line")) == 102
+
+
+def test_lock_is_exclusive(index_dir, monkeypatch):
+    monkeypatch.setattr(trigram_index, "LOCK_POLL_INTERVAL", 0.01)
+    os.makedirs(index_dir)
+    waited = []
+
+    class Waited(Exception):
+        pass
+
+    def on_wait():
+        raise Waited()
+
+    def lock_in_thread():
+        try:
+            with IndexLock(index_dir, on_wait):
+                pass
+        except Waited:
+            waited.append(True)
+
+    with IndexLock(index_dir):
+        thread = threading.Thread(target=lock_in_thread)
+        thread.start()
+        thread.join()
+    assert waited == [True]
+    lock_in_thread()
+    assert waited == [True]
@@ -0,0 +1,116 @@
+import os
+import json
+import hashlib
+import tempfile
+from .timestamps import TIMESTAMP_FORMAT, parse_timestamp
+
+INDEX_VERSION = 1
+
+
+def get_index_path(index_dir, dirname, suffix=".timeframes.json"):
+    """ one index file per diagnostics log directory, named after a hash of the directory path """
+    digest = hashlib.sha1(os.path.abspath(dirname).encode("utf-8")).hexdigest()
+    return os.path.join(index_dir, digest + suffix)
+
+
+def get_file_key(filepath):
+    stat = os.stat(filepath)
+    return [stat.st_size, stat.st_mtime]
+
+
+class TimeframeIndex(object):
+    """
+    On-disk cache of (start, finish) timestamps of every file in a log directory.
+    Entries are keyed on the file path and are valid as long as the file size and mtime did not change,
+    so only new or rotated files are scanned again.
+    """
+    version = INDEX_VERSION
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.entries = self._load()
+        self.dirty = False
+
+    def _load(self):
+        try:
+            with open(self.index_path) as fd:
+                data = json.load(fd)
+        except (IOError, OSError, ValueError):
+            return dict()
+        if data.get("version") != self.version:
+            return dict()
+        return data.get("files", dict())
+
+    def save(self):
+        if not self.dirty:
+            return
+        index_dir = os.path.dirname(self.index_path)
+        if not os.path.isdir(index_dir):
+            os.makedirs(index_dir)
+        fd, temp_path = tempfile.mkstemp(dir=index_dir)
+        with os.fdopen(fd, "w") as temp_file:
+            json.dump(dict(version=self.version, files=self.entries), temp_file)
+        os.rename(temp_path, self.index_path)  # atomic, a concurrent reader never sees a partial index
+        self.dirty = False
+
+    def get(self, filepath, scan):
+        """:returns: (start, finish) of filepath, calling scan(filepath) only if the cached entry is stale"""
+        key = get_file_key(filepath)
+        entry = self.entries.get(filepath)
+        if entry is None or entry["key"] != key:
+            entry = self._find_renamed(filepath, key)
+        if entry is not None:
+            return parse_timestamp(entry["start"]), parse_timestamp(entry["finish"])
+        start, finish = scan(filepath)
+        self.entries[filepath] = dict(key=key,
+                                      start=start.strftime(TIMESTAMP_FORMAT),
+                                      finish=finish.strftime(TIMESTAMP_FORMAT))
+        self.dirty = True
+        return start, finish
+
+    def _find_renamed(self, filepath, key):
+        """
+        log rotation renames every file of a series (izbox.log.1 -> izbox.log.2 ...). a file whose entry is stale
+        may still be in the index under its old name, with the same size and mtime
+        """
+        for other_path, entry in self.entries.items():
+            if other_path != filepath and entry["key"] == key:
+                try:
+                    if get_file_key(other_path) == key:  # a different file that happens to look the same
+                        continue
+                except OSError:
+                    pass
+                self.entries[filepath] = dict(entry)
+                self.dirty = True
+                return entry
+        return None
+
+    def extend(self, filepath, start, previous_size, size, finish=None):
+        """
+        updates the entry of a file that grew from previous_size to size by appending (e.g. a followed log)
+        without scanning it again: its start doesn't change, and finish is the last timestamp in the appended data.
+        the entry may be of any size up to size (saved before, or after, the appended data was read), as long as
+        the file still starts at start, i.e. it wasn't replaced.
+        :returns: True if there was an up to date entry to update
+        """
+        entry = self.entries.get(filepath)
+        if entry is None or start is None or entry["start"] != start.strftime(TIMESTAMP_FORMAT):
+            return False
+        if entry["key"][0] > size:
+            return False
+        if entry["key"][0] < previous_size and finish is None:  # the timestamps in between weren't seen
+            return False
+        key = get_file_key(filepath)
+        if key[0] != size:  # it grew again meanwhile, we don't know its finish
+            return False
+        entry["key"] = key
+        if finish is not None:
+            entry["finish"] = finish.strftime(TIMESTAMP_FORMAT)
+        self.dirty = True
+        return True
+
+    def prune(self):
+        """ forget files that no longer exist (e.g. rotations that were deleted) """
+        for filepath in [filepath for filepath in self.entries if not os.path.exists(filepath)]:
+            del self.entries[filepath]
+            self.dirty = True
@@ -0,0 +1,174 @@
+import sublime, sublime_plugin
+import heapq
+from itertools import chain
+from os import listdir, makedirs, path, remove
+from time import time
+from .background import run_in_background
+from .diagnostics import get_active_filepath, get_bundle_files, get_file_prefix, get_file_series, \
+    get_files_timeframes, get_index_dir, open_file_and_do_something_with_it, parse_datestring, word_wrap_callback
+from .log_reader import open_log, find_timestamp_offset, find_time_window, copy_range, iter_whole_records
+from .results_view import new_results_view, append_to_results_view
+
+BATCH_SIZE = 1024 * 1024
+EXTRACT_MAX_AGE = 24 * 60 * 60  # extracts are removed from the cache directory once they're a day old
+
+
+def get_source_label(filepath):
+    """ e.g. 'host-1 izbox-traces.log.3', the node and the file of a record in the timeline """
+    parts = filepath.split(path.sep)
+    return "{} {}".format(parts[-7] if len(parts) >= 7 else "", path.basename(filepath))
+
+
+def iter_file_records(filepath, start=None, finish=None):
+    """ yields (timestamp, label, text) for the records of the file in the time window, reading only that slice """
+    label = get_source_label(filepath)
+    with open_log(filepath) as fd:
+        offset = 0
+        if start is not None:
+            found = find_timestamp_offset(fd, start)
+            offset = found[0] if found is not None else 0
+        for _, timestamp, text in iter_whole_records(fd, offset):
+            if start is not None and timestamp < start:
+                continue
+            if finish is not None and timestamp > finish:
+                break
+            yield timestamp, label, text
+
+
+def get_series_iterators(timeframes, start=None, finish=None):
+    """
+    the files of a rotated series (same node, same prefix) don't overlap in time, so each series is read as one
+    chain of lazily opened files, and the heap merge only has one item per series
+    """
+    series = dict()
+    for item in timeframes:
+        if start is not None and item['finish'] < start:
+            continue
+        if finish is not None and item['start'] > finish:
+            continue
+        series.setdefault(get_file_prefix(item['filepath']), []).append(item['filepath'])
+    return [chain.from_iterable(iter_file_records(filepath, start, finish) for filepath in files)
+            for files in series.values()]
+
+
+def merge_timeline(timeframes, start=None, finish=None):
+    """ k-way merge of all the series by timestamp, in constant memory """
+    for timestamp, label, text in heapq.merge(*get_series_iterators(timeframes, start, finish)):
+        yield label, text
+
+
+def write_timeline(view, records, task=None):
+    batch, size = [], 0
+    for label, text in records:
+        line = "{}: {}".format(label, text.decode("utf-8", "replace"))
+        batch.append(line)
+        size += len(line)
+        if size >= BATCH_SIZE:
+            if task is not None:
+                task.check()
+            append_to_results_view(view, "".join(batch), wait=True)
+            batch, size = [], 0
+    append_to_results_view(view, "".join(batch), wait=True)
+
+
+def parse_time_window(text):
+    """ 'start, finish' where either may be omitted. :returns: (start, finish), or None if invalid """
+    if not text.strip():
+        return None, None
+    parts = [part.strip() for part in text.split(",")]
+    if len(parts) != 2:
+        sublime.error_message("Enter the time window as: start, finish")
+        return None
+    start, finish = [parse_datestring(part) if part else None for part in parts]
+    if (parts[0] and start is None) or (parts[1] and finish is None):
+        return None
+    return start, finish
+
+
+class MergedTimeline(sublime_plugin.WindowCommand):
+    def run(self):
+        self.window.show_input_panel("Time window (start, finish), empty for everything", "", self.on_done,
+                                     None, None)
+
+    def on_done(self, text):
+        time_window = parse_time_window(text)
+        if time_window is None:
+            return
+        files = get_bundle_files(self.window)
+        view = new_results_view(self.window, "timeline")
+        start, finish = time_window
+
+        def build(task):
+            timeframes = get_files_timeframes(files, task)
+            task.progress("Merging {} files...".format(len(timeframes)))
+            write_timeline(view, merge_timeline(timeframes, start, finish), task)
+
+        run_in_background(("timeline", view.id()), view, build, cancel_on_close=True)
+
+
+def extract_time_window(timeframes, start, finish, destination, task=None):
+    """
+    copies the records between start and finish of the files into destination, reading only that slice:
+    files outside the window are skipped by their timeframes, and the slice of each file is found by bisection.
+    :returns: the number of bytes copied
+    """
+    total = 0
+    for item in timeframes:
+        if (start is not None and item['finish'] < start) or (finish is not None and item['start'] > finish):
+            continue
+        if task is not None:
+            task.progress("Extracting from {}...".format(path.basename(item['filepath'])))
+        with open_log(item['filepath']) as fd:
+            begin, end = find_time_window(fd, start, finish)
+            copy_range(fd, destination, begin, end - begin)
+        total += end - begin
+    return total
+
+
+def remove_old_extracts(extracts_dir):
+    now = time()
+    for name in listdir(extracts_dir):
+        try:
+            if now - path.getmtime(path.join(extracts_dir, name)) > EXTRACT_MAX_AGE:
+                remove(path.join(extracts_dir, name))
+        except OSError:
+            pass
+
+
+def get_extract_path(prefix, start, finish):
+    extracts_dir = path.join(get_index_dir(), "extracts")
+    if not path.isdir(extracts_dir):
+        makedirs(extracts_dir)
+    remove_old_extracts(extracts_dir)
+    bound = lambda timestamp: "" if timestamp is None else timestamp.strftime("%Y%m%d-%H%M%S")
+    return path.join(extracts_dir, "{}-{}-{}.log".format(path.basename(prefix), bound(start), bound(finish)))
+
+
+class ExtractTimeWindow(sublime_plugin.WindowCommand):
+    """ opens the records of a time window of all the files of the current type, e.g. all the izbox logs """
+    def run(self):
+        self.window.show_input_panel("Time window (start, finish)", "", self.on_done, None, None)
+
+    def on_done(self, text):
+        time_window = parse_time_window(text)
+        if time_window is None:
+            return
+        start, finish = time_window
+        if start is None and finish is None:  # the whole series would be copied
+            sublime.error_message("Enter the start and/or the finish of the time window")
+            return
+        prefix = get_file_prefix(get_active_filepath(self.window))
+        files = get_file_series(prefix)
+        window = self.window
+
+        def work(task):
+            timeframes = get_files_timeframes(files, task)
+            extract_path = get_extract_path(prefix, start, finish)
+            with open(extract_path, "wb", buffering=0) as destination:
+                extract_time_window(timeframes, start, finish, destination, task)
+            return extract_path
+
+        def done(extract_path):
+            open_file_and_do_something_with_it(window, extract_path, word_wrap_callback())
+
+        run_in_background(("extract", window.id()), window.active_view(), work, done)
@@ -0,0 +1,120 @@
+import re
+from datetime import datetime
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+# the fixed layout every izbox log record starts with, see infilog.tmLanguage
+TIMESTAMP_PATTERN = re.compile(r"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(?:\.\d+)?")
+TIMESTAMP_BYTES_PATTERN = re.compile(TIMESTAMP_PATTERN.pattern.encode("ascii"))
+
+# everything a user may type in "Goto Date", matched in a single pass.
+# accepts the same strings the old list of strptime formats did:
+#   d/m/y, m/d/y (day first if ambiguous), with '/' or '-', 2 or 4 digit years
+#   optionally followed by H:M[:S], or by -H-M-S after a d/m/y date
+#   H:M[:S] alone
+#   Y-m-d H:M[:S[.f]]
+DATESTRING_PATTERN = re.compile(r"""
+    ^(?:
+        (?P<iso_year>\d{4})-(?P<iso_month>\d{1,2})-(?P<iso_day>\d{1,2})[ ]
+            (?P<iso_hour>\d{1,2}):(?P<iso_minute>\d{1,2})(?::(?P<iso_second>\d{1,2})(?:\.(?P<iso_fraction>\d{1,6}))?)?
+    |
+        (?P<first>\d{1,2})(?P<separator>[/-])(?P<second>\d{1,2})(?P=separator)(?P<year>\d{4}|\d{2})
+        (?:
+            [ ](?P<hour>\d{1,2}):(?P<minute>\d{1,2})(?::(?P<seconds>\d{1,2}))?
+        |
+            -(?P<dash_hour>\d{1,2})-(?P<dash_minute>\d{1,2})-(?P<dash_second>\d{1,2})
+        )?
+    |
+        (?P<time_hour>\d{1,2}):(?P<time_minute>\d{1,2})(?::(?P<time_second>\d{1,2}))?
+    )$""", re.VERBOSE)
+
+
+def parse_timestamp(string):
+    """
+    Parses the fixed 'YYYY-MM-DD HH:MM:SS[.ffffff]' layout of log timestamps by slicing,
+    which is several times faster than datetime.strptime.
+    Anything that does not fit the layout is handed over to strptime, which raises ValueError as before
+    """
+    if len(string) < 19 or string[4] != '-' or string[7] != '-' or string[10] != ' ' or \
+       string[13] != ':' or string[16] != ':' or (len(string) > 19 and string[19] != '.'):
+        return datetime.strptime(string, TIMESTAMP_FORMAT)
+    fraction = string[20:26]
+    microsecond = int(fraction) * 10 ** (6 - len(fraction)) if fraction else 0
+    return datetime(int(string[0:4]), int(string[5:7]), int(string[8:10]),
+                    int(string[11:13]), int(string[14:16]), int(string[17:19]), microsecond)
+
+
+def parse_timestamp_bytes(data):
+    return parse_timestamp(data.decode("ascii"))
+
+
+def _expand_year(year):
+    # same pivot as strptime's %y
+    if len(year) == 4:
+        return int(year)
+    year = int(year)
+    return year + (2000 if year < 69 else 1900)
+
+
+def _int(value):
+    return int(value) if value else 0
+
+
+def parse_datestring(datestring):
+    """:returns: a datetime object, or None if the string is not in any of the supported layouts"""
+    match = DATESTRING_PATTERN.match(datestring.strip())
+    if match is None:
+        return None
+    groups = match.groupdict()
+    try:
+        if groups["iso_year"]:
+            fraction = groups["iso_fraction"] or ""
+            return datetime(int(groups["iso_year"]), int(groups["iso_month"]), int(groups["iso_day"]),
+                            int(groups["iso_hour"]), int(groups["iso_minute"]), _int(groups["iso_second"]),
+                            int(fraction) * 10 ** (6 - len(fraction)) if fraction else 0)
+        if groups["time_hour"]:
+            return datetime(1900, 1, 1, int(groups["time_hour"]), int(groups["time_minute"]),
+                            _int(groups["time_second"]))
+    except ValueError:
+        return None
+    if groups["dash_hour"] and (groups["separator"] != "/" or len(groups["year"]) != 2):
+        return None
+    year = _expand_year(groups["year"])
+    hour = _int(groups["hour"] or groups["dash_hour"])
+    minute = _int(groups["minute"] or groups["dash_minute"])
+    second = _int(groups["seconds"] or groups["dash_second"])
+    first, second_field = int(groups["first"]), int(groups["second"])
+    for day, month in ((first, second_field), (second_field, first)):  # day first, like the old format list
+        try:
+            return datetime(year, month, day, hour, minute, second)
+        except ValueError:
+            pass
+    return None
+
+
+if __name__ == "__main__":
+    # micro-benchmark: python timestamps.py
+    from timeit import timeit
+    legacy_formats = ["%d/%m/%y", "%d/%m/%Y", "%d-%m-%y", "%d-%m-%Y", "%m/%d/%y", "%m/%d/%Y", "%m-%d-%y", "%m-%d-%Y",
+                      "%d/%m/%y %H:%M:%S", "%d/%m/%Y %H:%M:%S", "%d-%m-%y %H:%M:%S", "%d-%m-%Y %H:%M:%S",
+                      "%m/%d/%y %H:%M:%S", "%m/%d/%Y %H:%M:%S", "%m-%d-%y %H:%M:%S", "%m-%d-%Y %H:%M:%S",
+                      "%d/%m/%y-%H-%M-%S", "%m/%d/%y-%H-%M-%S",
+                      "%d/%m/%y %H:%M", "%d/%m/%Y %H:%M", "%d-%m-%y %H:%M", "%d-%m-%Y %H:%M",
+                      "%m/%d/%y %H:%M", "%m/%d/%Y %H:%M", "%m-%d-%y %H:%M", "%m-%d-%Y %H:%M",
+                      "%H:%M:%S", "%H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M"]
+
+    def legacy_parse_datestring(datestring):
+        for format in legacy_formats:
+            try:
+                return datetime.strptime(datestring, format)
+            except ValueError:
+                pass
+
+    line = "2015-04-08 12:34:56.123456"
+    user_input = "2015-04-08 12:34"
+    count = 20000
+    for name, func in [("datetime.strptime", lambda: datetime.strptime(line, TIMESTAMP_FORMAT)),
+                       ("parse_timestamp", lambda: parse_timestamp(line)),
+                       ("legacy format trial", lambda: legacy_parse_datestring(user_input)),
+                       ("parse_datestring", lambda: parse_datestring(user_input))]:
+        seconds = timeit(func, number=count)
+        print("{:<20} {:.2f} seconds per million".format(name, seconds * 1000000 / count))
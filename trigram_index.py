@@ -0,0 +1,523 @@
+import os
+import re
+import json
+import mmap
+import struct
+import tempfile
+import time
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import accumulate
+from .log_reader import open_log, get_file_series
+from .timeframe_index import get_file_key
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+    import msvcrt
+
+BLOCK_SIZE = 128 * 1024  # a query result is verified by reading the blocks (of whole lines) it may be in
+SEGMENT_MAX_POSTINGS = 20 * 1000 * 1000  # bounds the memory used while indexing, ~4 bytes per posting
+SEGMENT_MAGIC = b"TGI\0"
+SEGMENT_VERSION = 1
+SEGMENT_HEADER = struct.Struct("<4sIII")  # magic, version, number of blocks, number of trigrams
+METADATA_VERSION = 2
+COMPACT_RATIO = 0.5  # a segment is rewritten once less than this part of its blocks are of indexed files
+LOCK_POLL_INTERVAL = 1.0
+# diagnostics_dir/hostname/timestamp/files/var/log/dirname/izbox*, the layout get_files_of_other_node() walks
+LOG_DIR_LAYOUT = ["files", "var", "log", "*"]
+
+
+def get_bundle_series(root):
+    """
+    the izbox logs and traces of every node and timestamp directory under root: a diagnostics directory,
+    a bundle (holding one) or a directory of bundles
+    """
+    files = []
+    for depth in range(3):
+        prefix = os.path.join(root, *(["*"] * (depth + 2) + LOG_DIR_LAYOUT + ["izbox"]))
+        files.extend(filepath for filepath in get_file_series(prefix) if os.path.isfile(filepath))
+    return sorted(files)
+
+
+class IndexLock(object):
+    """
+    an exclusive lock on an index directory, held while updating it: updaters (the plugin in several windows,
+    an offline cron job) allocate segment names and file ids from the metadata, and each saves all of it
+    """
+    def __init__(self, index_dir, on_wait=None):
+        self.lock_path = os.path.join(index_dir, "lock")
+        self.on_wait = on_wait
+        self._fd = None
+
+    def _try_lock(self):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(self._fd.fileno(), msvcrt.LK_NBLCK, 1)
+        except (IOError, OSError):
+            return False
+        return True
+
+    def __enter__(self):
+        self._fd = open(self.lock_path, "a")
+        self._fd.seek(0)  # msvcrt locks bytes from the current position
+        try:
+            while not self._try_lock():
+                if self.on_wait is not None:
+                    self.on_wait()
+                time.sleep(LOCK_POLL_INTERVAL)
+        except BaseException:
+            self._fd.close()
+            raise
+        return self
+
+    def __exit__(self, *args):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd.fileno(), fcntl.LOCK_UN)
+            else:
+                self._fd.seek(0)
+                msvcrt.locking(self._fd.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._fd.close()
+
+
+def get_trigram_key(trigram):
+    first, second, third = trigram
+    return first << 16 | second << 8 | third
+
+
+def get_trigrams(tokens):
+    """
+    the trigrams of whitespace-separated tokens. any text without whitespace lies within a single token,
+    so a query only needs the trigrams of its own tokens, and trigrams across tokens are never indexed
+    """
+    trigrams = set()
+    for token in tokens:
+        trigrams.update(zip(token, token[1:], token[2:]))
+    return trigrams
+
+
+def encode_postings(values):
+    """ sorted block numbers, as varint (LEB128) deltas """
+    deltas = [value - previous for previous, value in zip([0] + values[:-1], values)]
+    if max(deltas) < 0x80:  # the common case of a trigram found in nearby blocks, one byte each
+        return bytes(deltas)
+    data = bytearray()
+    for delta in deltas:
+        while delta >= 0x80:
+            data.append(delta & 0x7f | 0x80)
+            delta >>= 7
+        data.append(delta)
+    return bytes(data)
+
+
+def decode_postings(data):
+    if not data:
+        return []
+    if max(data) < 0x80:
+        return list(accumulate(data))
+    values, value, shift, current = [], 0, 0, 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        current += value
+        values.append(current)
+        value = shift = 0
+    return values
+
+
+def iter_blocks(filepath):
+    """ yields (offset, first line number, data) of blocks of whole lines of the (decompressed) file """
+    offset, line_number, remainder = 0, 1, b""
+    with open_log(filepath) as fd:
+        for data in iter(lambda: fd.read(BLOCK_SIZE), b""):
+            data = remainder + data
+            cut = data.rfind(b"\n") + 1
+            if cut == 0:  # a line longer than a block
+                remainder = data
+                continue
+            yield offset, line_number, data[:cut]
+            offset, line_number, remainder = offset + cut, line_number + data.count(b"\n", 0, cut), data[cut:]
+    if remainder:
+        yield offset, line_number, remainder
+
+
+class SegmentWriter(object):
+    """ accumulates the blocks of files and their trigrams, and writes them as one immutable segment """
+    def __init__(self):
+        self.block_offsets = array('Q')
+        self.block_files = array('I')
+        self.block_sizes = array('I')
+        self.block_lines = array('I')
+        self.postings = defaultdict(lambda: array('I'))
+        self.count = 0
+
+    def _add_block_entry(self, file_id, offset, size, line_number):
+        self.block_offsets.append(offset)
+        self.block_files.append(file_id)
+        self.block_sizes.append(size)
+        self.block_lines.append(line_number)
+        return len(self.block_offsets) - 1
+
+    def add_block(self, file_id, offset, line_number, data):
+        block = self._add_block_entry(file_id, offset, len(data), line_number)
+        trigrams = get_trigrams(set(data.split()))  # log lines repeat the same words over and over
+        for trigram in trigrams:
+            self.postings[get_trigram_key(trigram)].append(block)
+        self.count += len(trigrams)
+
+    def add_segment(self, segment, file_ids):
+        """ adds the blocks of the files of the segment, without reading the files again """
+        numbers = dict()
+        for block in range(segment.block_count):
+            if segment.block_files[block] in file_ids:
+                numbers[block] = self._add_block_entry(segment.block_files[block], segment.block_offsets[block],
+                                                       segment.block_sizes[block], segment.block_lines[block])
+        for key, postings in segment.iter_postings():
+            blocks = [numbers[block] for block in decode_postings(postings) if block in numbers]
+            if blocks:
+                self.postings[key].extend(blocks)
+                self.count += len(blocks)
+
+    def write(self, segment_path):
+        """
+        layout: header, block offsets, posting starts (64 bit), block file ids, block sizes, block first lines,
+        trigram keys (32 bit), then the postings of every trigram, in the order of the keys
+        """
+        keys = array('I', sorted(self.postings))
+        encoded = [encode_postings(self.postings[key].tolist()) for key in keys]
+        starts = array('Q', [0])
+        starts.extend(accumulate(len(postings) for postings in encoded))
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(segment_path))
+        with os.fdopen(fd, "wb") as temp_file:
+            temp_file.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, len(self.block_offsets), len(keys)))
+            for table in (self.block_offsets, starts, self.block_files, self.block_sizes, self.block_lines, keys):
+                temp_file.write(table.tobytes())
+            for postings in encoded:
+                temp_file.write(postings)
+        os.rename(temp_path, segment_path)
+
+
+class Segment(object):
+    """ a memory-mapped segment: the tables are read in place, nothing is loaded up front """
+    def __init__(self, segment_path):
+        with open(segment_path, "rb") as fd:
+            self._mmap = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.block_count, trigram_count = SEGMENT_HEADER.unpack_from(self._mmap)
+        if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+            self._mmap.close()
+            raise ValueError("{} is not a trigram index segment".format(segment_path))
+        data = memoryview(self._mmap)
+        self._views = [data]
+        position = SEGMENT_HEADER.size
+        tables = []
+        for code, count in [("Q", self.block_count), ("Q", trigram_count + 1), ("I", self.block_count),
+                            ("I", self.block_count), ("I", self.block_count), ("I", trigram_count)]:
+            size = count * struct.calcsize(code)
+            table = data[position:position + size]
+            tables.append(table.cast(code))
+            self._views.extend([table, tables[-1]])
+            position += size
+        self.postings = data[position:]
+        self._views.append(self.postings)
+        self.block_offsets, self._starts, self.block_files, self.block_sizes, self.block_lines, self._keys = tables
+
+    def get_postings(self, key):
+        """:returns: the encoded postings of the trigram, or None if it's in none of the blocks"""
+        index = bisect_left(self._keys, key)
+        if index == len(self._keys) or self._keys[index] != key:
+            return None
+        return self.postings[self._starts[index]:self._starts[index + 1]]
+
+    def iter_postings(self):
+        """ yields (trigram key, encoded postings) of every trigram in the segment """
+        for index, key in enumerate(self._keys):
+            yield key, self.postings[self._starts[index]:self._starts[index + 1]]
+
+    def find_blocks(self, keys):
+        """:returns: the numbers of the blocks containing all of the trigrams, rarest trigrams decoded first"""
+        if not keys:
+            return range(self.block_count)
+        all_postings = [self.get_postings(key) for key in keys]
+        if any(postings is None for postings in all_postings):
+            return []
+        all_postings.sort(key=len)
+        blocks = decode_postings(all_postings[0])
+        for postings in all_postings[1:]:
+            if not blocks:
+                break
+            blocks = sorted(set(blocks).intersection(decode_postings(postings)))
+        return blocks
+
+    def close(self):
+        for view in reversed(self._views):  # the map can't be closed while views of it exist
+            view.release()
+        self._mmap.close()
+
+
+def verify(filepath, blocks, pattern):
+    """
+    :param blocks: sorted (offset, size, first line number) of the candidate blocks of the file
+    :returns: generator of (offset, line number, line) of the lines the pattern is really in
+    """
+    with open_log(filepath) as fd:
+        for offset, size, line_number in blocks:
+            fd.seek(offset)
+            data = fd.read(size)
+            position, counted = 0, 0
+            while True:
+                match = pattern.search(data, position)
+                if match is None:
+                    break
+                start = data.rfind(b"\n", 0, match.start()) + 1
+                end = data.find(b"\n", match.end())
+                end = len(data) if end == -1 else end
+                line_number += data.count(b"\n", counted, start)
+                counted = start
+                yield offset + match.start(), line_number, data[start:end].decode("utf-8", "replace")
+                position = end + 1
+
+
+class TrigramIndex(object):
+    """
+    A trigram index of the logs of diagnostics bundles, in a directory of its own: metadata.json lists the indexed
+    files (keyed on size and mtime, like TimeframeIndex) and the immutable segment holding the blocks of each.
+    Updates are serialized by an IndexLock, and only index new or changed files, into new segments.
+    Queries take no lock: the metadata and the segments are replaced atomically, and the segments are memory-mapped
+    """
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self.metadata_path = os.path.join(index_dir, "metadata.json")
+        self.files, self.next_id, self.next_segment = self._load()
+
+    def _load(self):
+        try:
+            with open(self.metadata_path) as fd:
+                data = json.load(fd)
+        except (IOError, OSError, ValueError):
+            return dict(), 0, 0
+        if data.get("version") != METADATA_VERSION:
+            return dict(), 0, 0
+        return data["files"], data["next_id"], data["next_segment"]
+
+    def _save(self):
+        fd, temp_path = tempfile.mkstemp(dir=self.index_dir)
+        with os.fdopen(fd, "w") as temp_file:
+            json.dump(dict(version=METADATA_VERSION, files=self.files, next_id=self.next_id,
+                           next_segment=self.next_segment), temp_file)
+        os.rename(temp_path, self.metadata_path)  # atomic, a concurrent query never sees a partial index
+
+    def _get_segment_path(self, name):
+        return os.path.join(self.index_dir, name)
+
+    def get_unindexed(self, files):
+        """:returns: the files that are new or changed since they were indexed"""
+        unindexed = []
+        for filepath in files:
+            entry = self.files.get(filepath)
+            try:
+                if entry is None or entry["key"] != get_file_key(filepath):
+                    unindexed.append(filepath)
+            except OSError:
+                pass
+        return unindexed
+
+    def update(self, files, task=None):
+        """
+        indexes the files that are new or changed, and forgets the indexed files that changed or are gone.
+        the files other updaters indexed (other roots, other kinds of logs) are kept as long as they didn't change
+        """
+        if not os.path.isdir(self.index_dir):
+            os.makedirs(self.index_dir)
+
+        def on_wait():
+            if task is not None:
+                task.progress("Waiting for another update of the bundle index")
+
+        with IndexLock(self.index_dir, on_wait):
+            # another process may have updated the index since it was loaded
+            self.files, self.next_id, self.next_segment = self._load()
+            self._update(files, task)
+
+    def _update(self, files, task):
+        keys = dict()
+        for filepath in files:
+            try:
+                keys[filepath] = get_file_key(filepath)
+            except OSError:
+                pass
+        current, moved = dict(), dict()
+        for filepath, entry in self.files.items():
+            try:
+                key = keys[filepath] if filepath in keys else get_file_key(filepath)
+            except OSError:
+                key = None
+            if key == entry["key"]:
+                current[filepath] = entry
+            else:
+                moved[tuple(entry["key"])] = entry
+        pending = []
+        for filepath, key in sorted(keys.items()):
+            if filepath in current:
+                continue
+            # log rotation renames every file of a series, their entries are still good under the new names
+            entry = moved.pop(tuple(key), None)
+            if entry is None:
+                pending.append(filepath)
+            else:
+                current[filepath] = entry
+        self.files = current
+        writer, written = SegmentWriter(), []
+        try:
+            for count, filepath in enumerate(pending):
+                if task is not None:
+                    task.progress("Indexing bundle logs [{}/{}]".format(count + 1, len(pending)))
+                file_id, self.next_id = self.next_id, self.next_id + 1
+                first_block = len(writer.block_offsets)
+                try:
+                    for offset, line_number, data in iter_blocks(filepath):
+                        writer.add_block(file_id, offset, line_number, data)
+                except (IOError, OSError, EOFError, ValueError):  # bad file, or truncated compressed one
+                    continue
+                written.append((filepath, dict(key=keys[filepath], id=file_id,
+                                               blocks=len(writer.block_offsets) - first_block)))
+                if writer.count >= SEGMENT_MAX_POSTINGS:
+                    self._write_segment(writer, written)
+                    writer, written = SegmentWriter(), []
+            if written:
+                self._write_segment(writer, written)
+                written = []
+            self._compact(task)
+        finally:  # even if cancelled, keep what was indexed so far
+            if written:
+                self._write_segment(writer, written)
+            self._save()
+            self._remove_unused_segments()
+
+    def _write_segment(self, writer, entries):
+        """ writes a new segment, holding the blocks of the (filepath, entry) entries """
+        name = "{}.segment".format(self.next_segment)
+        self.next_segment += 1
+        writer.write(self._get_segment_path(name))
+        for filepath, entry in entries:
+            entry["segment"] = name
+            self.files[filepath] = entry
+
+    def _compact(self, task=None):
+        """
+        merges the segments most of whose blocks are dead (of files that changed, like a growing log that was
+        indexed again as a whole into a newer segment, or that are gone) into new segments, without their dead blocks
+        """
+        entries_of = defaultdict(list)
+        for filepath, entry in self.files.items():
+            entries_of[entry["segment"]].append((filepath, entry))
+        writer, moved = SegmentWriter(), []
+        for name, entries in sorted(entries_of.items()):
+            try:
+                segment = Segment(self._get_segment_path(name))
+            except (IOError, OSError, ValueError):
+                continue
+            try:
+                if sum(entry["blocks"] for _, entry in entries) >= segment.block_count * COMPACT_RATIO:
+                    continue
+                if task is not None:
+                    task.progress("Compacting the bundle index")
+                writer.add_segment(segment, set(entry["id"] for _, entry in entries))
+            finally:
+                segment.close()
+            moved.extend(entries)
+            if writer.count >= SEGMENT_MAX_POSTINGS:
+                self._write_segment(writer, moved)
+                writer, moved = SegmentWriter(), []
+        if moved:
+            self._write_segment(writer, moved)
+
+    def _remove_unused_segments(self):
+        used = set(entry["segment"] for entry in self.files.values())
+        for name in os.listdir(self.index_dir):
+            if name.endswith(".segment") and name not in used:
+                try:
+                    os.remove(self._get_segment_path(name))
+                except OSError:
+                    pass
+
+    def _open_segments(self):
+        """
+        :returns: the current metadata files, and {segment name: Segment} of the segments they are in.
+                  an update removes segments only after saving metadata that doesn't use them, so if a segment is
+                  missing, the metadata is read again
+        """
+        for attempt in range(3):
+            files = self._load()[0]
+            segments = dict()
+            try:
+                for name in set(entry["segment"] for entry in files.values()):
+                    try:
+                        segments[name] = Segment(self._get_segment_path(name))
+                    except ValueError:  # not a segment (e.g. of another version), nothing to find in it
+                        pass
+                return files, segments
+            except (IOError, OSError):
+                for segment in segments.values():
+                    segment.close()
+        return dict(), dict()
+
+    def search(self, text, task=None):
+        """
+        :returns: generator of (filepath, offset, line number, line) of the lines containing text, verified by
+                  reading only the blocks of the indexed files that contain all of its trigrams
+        """
+        needle = text.encode("utf-8")
+        pattern = re.compile(re.escape(needle))
+        keys = sorted(get_trigram_key(trigram) for trigram in get_trigrams(needle.split()))
+        self.files, segments = self._open_segments()
+        # a file's blocks are only looked for in its own segment: the older segments it was in may not be removed yet
+        files_by_id = dict(((entry["segment"], entry["id"]), filepath) for filepath, entry in self.files.items())
+        candidates = defaultdict(list)
+        try:
+            for name, segment in segments.items():
+                for block in segment.find_blocks(keys):
+                    filepath = files_by_id.get((name, segment.block_files[block]))
+                    if filepath is not None:
+                        candidates[filepath].append((segment.block_offsets[block], segment.block_sizes[block],
+                                                     segment.block_lines[block]))
+        finally:
+            for segment in segments.values():
+                segment.close()
+        for filepath in sorted(candidates):
+            if task is not None:
+                task.progress("Searching {}".format(filepath))
+            try:
+                for offset, line_number, line in verify(filepath, sorted(candidates[filepath]), pattern):
+                    yield filepath, offset, line_number, line
+            except (IOError, OSError, EOFError):
+                continue
+
+
+if __name__ == "__main__":
+    # offline indexing (e.g. by a cron job on the machine holding the bundles), and searching:
+    #   python -m <package>.trigram_index INDEX_DIR ROOT [TEXT]
+    # set "bundle-index-dir" to INDEX_DIR for the plugin to use the same indexes
+    import sys
+    from time import time
+    from .timeframe_index import get_index_path
+    index_dir, root = sys.argv[1:3]
+    index = TrigramIndex(get_index_path(index_dir, root, suffix=".trigrams"))
+    start = time()
+    if len(sys.argv) > 3:
+        results = 0
+        for filepath, offset, line_number, line in index.search(sys.argv[3]):
+            print("{}:{}: {}".format(filepath, line_number, line))
+            results += 1
+        print("{} results in {:.2f} seconds".format(results, time() - start))
+    else:
+        files = get_bundle_series(root)
+        unindexed = len(index.get_unindexed(files))
+        index.update(files)
+        print("indexed {} of {} files in {:.2f} seconds".format(unindexed, len(files), time() - start))
@@ -0,0 +1,92 @@
+import sublime, sublime_plugin
+import threading
+from .record_index import LineIndex, RecordIndex
+
+# buffer id -> ViewIndex. shared by all the commands, so each buffer is scanned at most once per version
+VIEW_INDEXES = dict()
+APPEND_CHECK_SIZE = 1024
+# sublime 4 tells us exactly what changed, sublime 3 only that something did
+HAS_TEXT_CHANGE_LISTENER = hasattr(sublime_plugin, "TextChangeListener")
+_lock = threading.Lock()
+
+
+class ViewIndex(object):
+    """
+    The line starts and the log record starts of a buffer, for offset <-> row and offset <-> record in O(log n).
+    Each of them is built on first use. Text appended to the buffer (a growing log, a results view) is indexed
+    incrementally; any other modification makes the index stale, and it is rebuilt the next time it's needed
+    """
+    def __init__(self, view, change_count):
+        self.view = view
+        self.size = view.size()
+        self.change_count = change_count
+        self.tail = _get_text(view, max(0, self.size - APPEND_CHECK_SIZE), self.size)
+        self._lines = None
+        self._records = None
+
+    @property
+    def lines(self):
+        if self._lines is None:
+            self._lines = LineIndex(_get_text(self.view, 0, self.size))
+        return self._lines
+
+    @property
+    def records(self):
+        if self._records is None:
+            self._records = RecordIndex(_get_text(self.view, 0, self.size))
+        return self._records
+
+    def append(self, text, change_count):
+        for index in (self._lines, self._records):
+            if index is not None:
+                index.append(text)
+        self.size += len(text)
+        self.change_count = change_count
+        self.tail = (self.tail + text)[-APPEND_CHECK_SIZE:]
+
+
+def _get_text(view, start, end):
+    return view.substr(sublime.Region(start, end))
+
+
+def get_view_index(view):
+    """:returns: the up to date ViewIndex of the view's buffer"""
+    key = view.buffer_id()
+    change_count = view.change_count()
+    with _lock:
+        index = VIEW_INDEXES.get(key)
+        if index is not None and index.change_count == change_count:
+            return index
+        size = view.size()
+        if index is not None and size >= index.size and not HAS_TEXT_CHANGE_LISTENER and \
+           _get_text(view, index.size - len(index.tail), index.size) == index.tail:
+            # without modification events, this is how we tell text was only appended since the index was built
+            index.append(_get_text(view, index.size, size), change_count)
+        else:
+            index = ViewIndex(view, change_count)
+        VIEW_INDEXES[key] = index
+        return index
+
+
+class ViewIndexListener(sublime_plugin.EventListener):
+    def on_close(self, view):
+        with _lock:
+            VIEW_INDEXES.pop(view.buffer_id(), None)
+
+
+if HAS_TEXT_CHANGE_LISTENER:
+    class ViewIndexChangeListener(sublime_plugin.TextChangeListener):
+        """ keeps the indexes current from the modification events of sublime 4, without reading the buffer """
+        def on_text_changed(self, changes):
+            key = self.buffer.id()
+            with _lock:
+                index = VIEW_INDEXES.get(key)
+                if index is None:
+                    return
+                for change in changes:
+                    if change.a.pt == change.b.pt == index.size:
+                        index.append(change.str, index.change_count)
+                    else:
+                        del VIEW_INDEXES[key]  # stale, rebuilt when it's needed
+                        return
+                index.change_count = self.buffer.primary_view().change_count()